@@ -17,6 +17,8 @@
 __website__ = "https://github.com/Sigmmma/refinery"
 __all__ = (
     'defs', 'heuristic_deprotection', 'repl', 'tag_index', 'widgets', 'windows',
-    'constants', 'core', 'crc_functions', 'editor_constants', 'exceptions',
-    'main', 'queue_item', 'util',
+    'constants', 'core', 'crc_functions', 'dependency_graph',
+    'editor_constants', 'exceptions', 'extraction_progress',
+    'lazy_resource_map', 'main', 'meta_cache', 'parallel', 'queue_item', 'tag_index_cache',
+    'util',
     )
@@ -20,8 +20,12 @@ def main():
         raise SystemExit(0)
 
     from datetime import datetime
+    from multiprocessing import freeze_support
     from traceback import format_exc
 
+    # lets frozen builds start extraction worker processes
+    freeze_support()
+
     try:
         from refinery.main import Refinery
         main_window = Refinery()
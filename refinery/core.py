@@ -12,8 +12,12 @@
 import sys
 import zlib
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path, PureWindowsPath
-from struct import unpack
+from array import array
+from bisect import bisect_right
+from struct import pack_into, unpack, unpack_from
+from threading import RLock
 from time import time
 from traceback import format_exc
 
@@ -47,13 +51,16 @@
      get_tag_index, get_map_magic
 from reclaimer.meta.class_repair import class_repair_functions,\
      get_tagc_refs
-from reclaimer.meta.rawdata_ref_editing import rawdata_ref_move_functions
-from reclaimer.meta.halo1_map_fast_functions import class_bytes_by_fcc
+from reclaimer.meta.halo1_map_fast_functions import class_bytes_by_fcc,\
+     iter_reflexive_offs
 
 from refinery.constants import INF, ACTIVE_INDEX, MAP_TYPE_ANY,\
      MAP_TYPE_REGULAR, MAP_TYPE_RESOURCE
 from refinery import crc_functions
 from refinery import editor_constants as e_c
+from refinery.parallel import TagExtractionPool, DeprotectionResult,\
+     DEPROTECTION_SETTING_NAMES, deprotect_maps, get_worker_count,\
+     get_loaded_resource_map_paths
 from refinery.exceptions import RefineryError, MapNotLoadedError,\
      EngineDetectionError, MapAlreadyLoadedError, CouldNotGetMetaError,\
      InvalidTagIdError, InvalidClassError, MetaConversionError,\
@@ -61,9 +68,18 @@
 from refinery.queue_item import RefineryQueueItem
 from refinery.heuristic_deprotection.constants import VERY_HIGH_PRIORITY
 from refinery.heuristic_deprotection.functions import heuristic_deprotect
+from refinery.heuristic_deprotection.worklist import HeuristicWorklist
+from refinery.lazy_resource_map import register_lazy_resource_maps
+from refinery.meta_cache import MetaCache, MetaCachedMap
 from refinery.tag_index.tag_path_handler import TagPathHandler
 from refinery.tag_index.tag_path_detokenizer import TagPathDetokenizer
-from refinery.util import inject_file_padding, int_to_fourcc
+from refinery.tag_index.tag_path_query_index import \
+     invalidate_tag_path_query_index
+from refinery.tag_index_cache import TagIndexCache
+from refinery.dependency_graph import get_dependency_graph,\
+     update_dependency_graph
+from refinery.util import apply_file_padding, copy_file_data,\
+     int_to_fourcc, plan_file_padding
 
 from supyr_struct.util import is_path_empty
 
@@ -92,6 +108,24 @@
 # Use a different wrapper for this so we can use a different set of tag defs
 halo_map_wrappers_by_engine["halo1yelo"] = Halo1YeloMap
 
+# the map wrappers parse maps by forcing the byte order of every supyr_struct
+# FieldType for the whole process, so only one thread may parse at a time
+_map_parse_lock = RLock()
+# how much of a map file to read at a time when reading it ahead of parsing
+MAP_PREFETCH_CHUNK_SIZE = 4*1024**2
+
+
+def prefetch_map_file(map_path):
+    '''
+    Reads the map file at map_path and throws the data away, so the os
+    has it cached by the time it's parsed. Reading the file releases the
+    GIL, so other threads can parse maps while this waits on the disk.
+    '''
+    buffer = bytearray(MAP_PREFETCH_CHUNK_SIZE)
+    with open(str(map_path), "rb", buffering=0) as f:
+        while f.readinto(buffer):
+            pass
+
 
 def get_halo_map_section_ends(halo_map):
     head  = halo_map.map_header
@@ -103,13 +137,211 @@ def get_halo_map_section_ends(halo_map):
     return raw_data_end, vertex_data_end, index_data_end, meta_data_end
 
 
+def get_map_region_crcs(halo_map, *changed_regions):
+    '''
+    Returns the dict of crcs of the checksummed regions of the map, keyed
+    by (offset, size). Any cached regions overlapping one of the given
+    (offset, size) changed_regions are removed from it before returning.
+    '''
+    region_crcs = getattr(halo_map, "region_crcs", None)
+    if not isinstance(region_crcs, dict):
+        region_crcs = halo_map.region_crcs = {}
+
+    for changed_off, changed_size in changed_regions:
+        for off, size in tuple(region_crcs):
+            if off < changed_off + changed_size and changed_off < off + size:
+                region_crcs.pop((off, size), None)
+
+    return region_crcs
+
+
+def get_tag_path_string_slack(halo_map, map_file, changed_tag_ids):
+    '''
+    Finds where the new paths of the changed tags can be written over the
+    existing tag path strings rather than appended to the end of the meta.
+    Only strings proven to be stored between the tag index header and the
+    first tag's meta data are reused, and if any tag path pointer in that
+    area doesn't point to the string loaded for it, nothing is reused.
+
+    Returns a dict of the new path pointers of the tags that fit, and a
+    list of the [start, end) pointer ranges that were freed but not used.
+    '''
+    map_header     = halo_map.map_header
+    tag_index      = halo_map.tag_index
+    index_array    = tag_index.tag_index
+    orig_tag_paths = halo_map.orig_tag_paths
+    map_magic      = halo_map.map_magic
+
+    # everything after the tag index header and before the first meta
+    # data is the tag index array and the tag path strings
+    index_magic = map_header.tag_index_header_offset + map_magic
+    data_start  = index_magic + tag_index.get_size()
+    data_end    = index_magic + map_header.tag_data_size
+    array_start = tag_index.tag_index_offset
+    array_end   = array_start + 32*len(index_array)
+
+    area_end = data_end
+    for b in index_array:
+        if not b.indexed and b.meta_offset in range(data_start, data_end):
+            area_end = min(area_end, b.meta_offset)
+
+    spans = {}
+    for i in range(len(index_array)):
+        start = index_array[i].path_offset
+        try:
+            path = orig_tag_paths[i].encode("latin-1") + b"\x00"
+        except UnicodeEncodeError:
+            continue
+
+        end = start + len(path)
+        if (start < data_start or end > area_end or
+            (start < array_end and array_start < end)):
+            # not in the path string area. leave it alone
+            continue
+
+        map_file.seek(start - map_magic)
+        if map_file.read(len(path)) != path:
+            # pointers can't be trusted to be pointing at path strings
+            return {}, []
+
+        spans[i] = (start, end)
+
+    if not spans:
+        return {}, []
+
+    changed_tag_ids = set(changed_tag_ids)
+    kept  = sorted(span for i, span in spans.items() if i not in changed_tag_ids)
+    freed = sorted(span for i, span in spans.items() if i in changed_tag_ids)
+
+    # any zero padding between the last string and the next thing after it
+    strings_end = max(end for start, end in spans.values())
+    padding_end = area_end
+    if array_start >= strings_end:
+        padding_end = min(padding_end, array_start)
+
+    map_file.seek(strings_end - map_magic)
+    padding = map_file.read(max(0, padding_end - strings_end))
+    padding_size = len(padding) - len(padding.lstrip(b"\x00"))
+    if padding_size:
+        freed.append((strings_end, strings_end + padding_size))
+
+    # merge the freed strings into ranges, and then remove any parts of
+    # those ranges still used by strings that aren't changing
+    merged = []
+    for start, end in freed:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    slack, k = [], 0
+    for start, end in merged:
+        while start < end:
+            while k < len(kept) and kept[k][1] <= start:
+                k += 1
+
+            if k == len(kept) or kept[k][0] >= end:
+                slack.append([start, end])
+                break
+            elif kept[k][0] > start:
+                slack.append([start, kept[k][0]])
+
+            start = max(start, kept[k][1])
+
+    # put the longest strings in first so the slack is used best
+    new_offs = {}
+    for i in sorted(changed_tag_ids, key=lambda i: -len(index_array[i].path)):
+        try:
+            size = len(index_array[i].path.encode("latin-1")) + 1
+        except UnicodeEncodeError:
+            continue
+
+        for gap in slack:
+            if gap[1] - gap[0] >= size:
+                new_offs[i] = gap[0]
+                gap[0] += size
+                break
+
+    return new_offs, [gap for gap in slack if gap[1] > gap[0]]
+
+
+# where the rawdata references are in the meta of each tag class that has
+# them. each entry is either the offset of a rawdata reference, or the
+# (offset, struct size, entries) of a reflexive of structs containing them.
+# these match the offsets reclaimer's rawdata_ref_move_functions use.
+RAWDATA_REF_LAYOUTS = {
+    "antr": ((116, 180, (72, 140, 160)), ),
+    "devc": (4, 24),
+    "font": (136, ),
+    "metr": (152, ),
+    "scnr": (260, (280, 64, (44, )), (876, 64, (44, )), 1140, 1160,
+             (1216, 52, (32, ))),
+    "snd!": ((152, 72, ((60, 124, (64, 84, 104)), )), ),
+
+    # open sauce
+    "magy": ((116, 180, (72, 140, 160)), ),
+    "shpg": (24, ),
+    "shpp": (24, ),
+    "sidy": (0, ),
+    }
+
+
+def _iter_rawdata_pointer_offs(map_data, struct_ptr, layout, magic, engine):
+    for entry in layout:
+        if isinstance(entry, tuple):
+            refl_off, struct_size, sub_layout = entry
+            for moff in iter_reflexive_offs(
+                    map_data, struct_ptr + refl_off - magic, struct_size):
+                yield from _iter_rawdata_pointer_offs(
+                    map_data, moff, sub_layout, magic, engine)
+            continue
+
+        # skip empty rawdata and rawdata stored outside the map
+        size, flags = unpack_from("<2L", map_data, struct_ptr + entry - magic)
+        if size and not ((flags & 1) and "xbox" not in engine):
+            yield struct_ptr + entry + 8
+
+
+def get_rawdata_pointer_index(halo_map):
+    '''
+    Returns an array of the meta pointers to every rawdata pointer in the
+    map's tag data that points to rawdata inside the map. The meta pointers
+    don't change when the map's sections are moved, so this is cached on
+    the map until the tag classes are changed.
+    '''
+    ptr_index = getattr(halo_map, "rawdata_pointer_index", None)
+    if ptr_index is not None:
+        return ptr_index
+
+    map_data = halo_map.map_data
+    magic = halo_map.map_magic
+    ptr_index = array("L")
+    for ref in halo_map.tag_index.tag_index:
+        tag_cls = int_to_fourcc(ref.class_1.data)
+        if ref.indexed:
+            continue
+        elif tag_cls in RAWDATA_REF_LAYOUTS:
+            ptr_index.extend(_iter_rawdata_pointer_offs(
+                map_data, ref.meta_offset, RAWDATA_REF_LAYOUTS[tag_cls],
+                magic, halo_map.engine))
+        elif tag_cls == "bitm":
+            # bitmap pixel data pointers aren't in rawdata references
+            for moff in iter_reflexive_offs(
+                    map_data, ref.meta_offset + 96 - magic, 48):
+                # skip bitmaps with their pixel data in the resource map
+                flags = unpack_from("<H", map_data, moff + 14 - magic)[0]
+                if not flags & (1<<8):
+                    ptr_index.append(moff + 24)
+
+    halo_map.rawdata_pointer_index = ptr_index
+    return ptr_index
+
+
 def expand_halo_map(halo_map, raw_data_expansion=0, vertex_data_expansion=0,
                     triangle_data_expansion=0, meta_data_expansion=0):
     map_file   = halo_map.get_writable_map_data()
     map_header = halo_map.map_header
     tag_index  = halo_map.tag_index
-    tag_index_array = tag_index.tag_index
-    index_header_offset = map_header.tag_index_header_offset
 
     raw_data_end, vertex_data_end, index_data_end, meta_data_end = \
                   get_halo_map_section_ends(halo_map)
@@ -119,14 +351,20 @@ def expand_halo_map(halo_map, raw_data_expansion=0, vertex_data_expansion=0,
                   (index_data_end,  triangle_data_expansion),
                   (meta_data_end,   meta_data_expansion))
 
-    # expand the map's sections
-    map_end = inject_file_padding(map_file, *expansions)
-    diffs_by_offsets, diff = dict(expansions), 0
-    for off in sorted(diffs_by_offsets):
-        diff += diffs_by_offsets[off]
-        diffs_by_offsets[off] = diff
+    meta_ptr_diff = raw_data_expansion + vertex_data_expansion +\
+                    triangle_data_expansion
+    if meta_ptr_diff:
+        # find the rawdata pointers while the meta is where the magic says
+        ptr_index = get_rawdata_pointer_index(halo_map)
 
-    meta_ptr_diff = diff - meta_data_expansion
+    # plan where every section ends up, then move each byte at most once
+    map_file.flush()
+    moves, pads, map_end = plan_file_padding(len(map_file), *expansions)
+    map_file.resize(map_end)
+    apply_file_padding(map_file, moves, pads)
+    if moves:
+        # sections were moved, so any cached checksums are useless
+        get_map_region_crcs(halo_map).clear()
 
     # update the map_header and tag_index_header's offsets and sizes
     tag_index.model_data_offset += raw_data_expansion
@@ -139,12 +377,17 @@ def expand_halo_map(halo_map, raw_data_expansion=0, vertex_data_expansion=0,
 
     # adjust rawdata pointers in various tags if the index header moved
     if meta_ptr_diff:
-        for ref in tag_index_array:
-            func = rawdata_ref_move_functions.get(int_to_fourcc(ref.class_1.data))
-            if func is None or ref.indexed:
-                continue
-            func(ref.id & 0xFFff, tag_index_array, map_file,
-                 halo_map.map_magic, halo_map.engine, diffs_by_offsets)
+        # moves are listed last to first, and each section moved
+        # as far as the padding injected at or before its start
+        section_starts = [srcoff for srcoff, dstoff, size in moves[::-1]]
+        section_diffs  = [dstoff - srcoff for srcoff, dstoff, size in moves[::-1]]
+        magic = halo_map.map_magic
+        for ptr in ptr_index:
+            raw_ptr = unpack_from("<L", map_file, ptr - magic)[0]
+            i = bisect_right(section_starts, raw_ptr) - 1
+            if i >= 0:
+                pack_into("<L", map_file, ptr - magic,
+                          raw_ptr + section_diffs[i])
 
     map_file.flush()
     return map_end
@@ -161,10 +404,33 @@ class RefineryCore:
     _data_dir = Path("")
     _tagslist_path = Path("")
 
+    _meta_cache = None
+
+    # the ExtractionProgress to report to and check for cancelling while
+    # processing the queue. set it to watch or cancel from another thread
+    extraction_progress = None
+
     # settings
     autoload_resources = True
+    # whether to wait until a resource map is needed before loading it
+    lazy_load_resources = False
+    # whether to cache the tag indexes of loaded maps to disk so
+    # unchanged maps don't need to be fully parsed to identify them
+    use_tag_index_cache = False
+    tag_index_cache_dir = Path(e_c.SETTINGS_DIR, "tag_index_cache")
+    # whether to find every tag a recursive extraction needs from a graph
+    # of each map's tag references before extracting any of them
+    use_dependency_graph = False
     do_printout = False
     print_errors = False
+    # number of threads to read maps with when loading several at
+    # once. less than 1 means one per cpu
+    load_workers = 1
+    # number of threads to calculate map checksums with
+    checksum_threads = 1
+    # number of bytes of parsed metas to keep cached for reuse while
+    # deprotecting and building dependency graphs. 0 disables caching
+    meta_cache_size = 64 * 1024 * 1024
 
     # extraction settings
     force_lower_case_paths = True
@@ -181,12 +447,17 @@ class RefineryCore:
     globals_overwrite_mode = 0
 
     skip_seen_tags_during_queue_processing = True
+    # number of processes to extract with. less than 1 means one per cpu
+    extract_workers = 1
     disable_safe_mode = False
     disable_tag_cleaning = False
 
     # deprotection settings
+    # number of processes to deprotect maps with. less than 1 means one per cpu
+    deprotect_workers = 1
     fix_tag_classes = True
     fix_tag_index_offset = False
+    patch_tag_paths_in_place = False
     use_minimum_priorities = True
     use_heuristics = True
     valid_tag_paths_are_accurate = True
@@ -206,6 +477,13 @@ def __init__(self, *args, **kwargs):
         self.tagslist_path = self.tags_dir.joinpath("tagslist.txt")
         self._maps_by_engine = {}
         self._extract_queue = []
+        self._meta_cache = MetaCache(self.meta_cache_size)
+
+    @property
+    def meta_cache(self):
+        # keep the cache's budget in sync with the setting
+        self._meta_cache.max_size = self.meta_cache_size
+        return self._meta_cache
 
     @property
     def active_map_path(self):
@@ -357,6 +635,7 @@ def unload_map(self, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw):
         if halo_map is self.active_map:
             self.active_map_name = ""
 
+        self.meta_cache.invalidate(halo_map)
         halo_map.unload_map()
 
     def save_map(self, save_path=None, map_name=ACTIVE_INDEX,
@@ -372,13 +651,19 @@ def save_map(self, save_path=None, map_name=ACTIVE_INDEX,
         assert vertex_data_expansion   >= 0
         assert triangle_data_expansion >= 0
 
+        do_printout = kw.pop("do_printout", self.do_printout)
         fix_tag_index_offset = kw.pop(
             "fix_tag_index_offset", self.fix_tag_index_offset)
+        patch_tag_paths_in_place = kw.pop(
+            "patch_tag_paths_in_place", self.patch_tag_paths_in_place)
 
         halo_map = self.maps_by_engine.get(engine, {}).get(map_name)
         if halo_map is None:
             raise KeyError("No map loaded and none provided.")
-        elif halo_map.is_resource:
+
+        # saving moves the tag data around and reloads the map
+        self.meta_cache.invalidate(halo_map)
+        if halo_map.is_resource:
             raise TypeError("Cannot save resource maps.")
         elif halo_map.engine not in ("halo1ce", "halo1yelo",
                                      "halo1pc", "halo1vap"):
@@ -394,6 +679,8 @@ def save_map(self, save_path=None, map_name=ACTIVE_INDEX,
         save_dir = save_path.parent
         save_dir.mkdir(exist_ok=True, parents=True)
 
+        # bytes copied over from the original map versus written by us
+        bytes_copied = bytes_written = 0
         try:
             map_file = halo_map.map_data
             if save_path == halo_map.filepath:
@@ -408,9 +695,24 @@ def save_map(self, save_path=None, map_name=ACTIVE_INDEX,
                 else:
                     tmp_file = save_path.open('w+b')
 
-                map_file.seek(0) # need to seek to 0 as shutil.copyfileobj uses
-                tmp_file.seek(0) # the current file offsets for copying to/from
-                shutil.copyfileobj(map_file, tmp_file)
+                try:
+                    # make sure any changes made through the mmap are
+                    # in the file before the os copies the file itself
+                    map_file.flush()
+                    with Path(halo_map.decomp_filepath).open('rb') as src_file:
+                        bytes_copied = copy_file_data(
+                            src_file, tmp_file, len(map_file))
+                except Exception:
+                    # map isn't backed by a file we can copy from
+                    tmp_file.truncate(0)
+                    bytes_copied = 0
+
+                if bytes_copied != len(map_file):
+                    map_file.seek(0)
+                    tmp_file.seek(0)
+                    shutil.copyfileobj(map_file, tmp_file)
+                    bytes_copied = len(map_file)
+
                 tmp_file.flush()
                 os.fsync(tmp_file.fileno())
                 tmp_file.close()
@@ -419,6 +721,19 @@ def save_map(self, save_path=None, map_name=ACTIVE_INDEX,
                     out_file = PeekableMmap(f.fileno(), 0)
 
             map_header = halo_map.map_header
+
+            # figure out which changed tag paths can fit where the old
+            # strings were BEFORE anything is moved around in the map
+            patched_offs, unused_slack = {}, ()
+            if patch_tag_paths_in_place and not fix_tag_index_offset:
+                # NOTE: not done when fixing the tag index offset, since
+                # the tag index could be moved on top of the strings
+                patched_offs, unused_slack = get_tag_path_string_slack(
+                    halo_map, map_file, [
+                        i for i in range(len(halo_map.tag_index.tag_index))
+                        if halo_map.orig_tag_paths[i].lower() !=
+                        halo_map.tag_index.tag_index[i].path.lower()])
+
             index_off_diff = (raw_data_expansion +
                               vertex_data_expansion +
                               triangle_data_expansion)
@@ -440,6 +755,7 @@ def save_map(self, save_path=None, map_name=ACTIVE_INDEX,
             # any existing path pointers, as we cannot assume they point
             # to areas reserved for tag paths(map might be damaged and
             # the pointers are actually pointing into tag data.)
+            # patch_tag_paths_in_place validates that they do beforehand.
             strings_size, string_offs = 0, {}
             meta_data_end = map_header.tag_data_size + index_header_offset
             for i in range(len(index_array)):
@@ -447,6 +763,9 @@ def save_map(self, save_path=None, map_name=ACTIVE_INDEX,
                 if orig_tag_paths[i].lower() == tag_path.lower():
                     # path wasnt changed
                     continue
+                elif i in patched_offs:
+                    # path fits where the old strings were
+                    continue
 
                 # put the new string at the end of the metadata
                 string_offs[i] = meta_data_end + map_magic + strings_size
@@ -462,6 +781,9 @@ def save_map(self, save_path=None, map_name=ACTIVE_INDEX,
             for i, off in string_offs.items():
                 index_array[i].path_offset = off
 
+            for i, off in patched_offs.items():
+                index_array[i].path_offset = off
+
             # move the tag_index array back to where it SHOULD be
             if fix_tag_index_offset:
                 tag_index.tag_index_offset = index_magic + tag_index.get_size()
@@ -490,9 +812,16 @@ def save_map(self, save_path=None, map_name=ACTIVE_INDEX,
             index_header_offset = map_header.tag_index_header_offset
             map_magic = halo_map.map_magic
 
+            # clear out the parts of the old strings that weren't reused
+            for start, end in unused_slack:
+                out_file.seek(start - map_magic)
+                out_file.write(b"\x00"*(end - start))
+                bytes_written += end - start
+
             # serialize the tag_index_header, tag_index and all the tag_paths
             tag_index.serialize(buffer=out_file, calc_pointers=False,
                                 magic=map_magic, offset=index_header_offset)
+            bytes_written += tag_index.binsize + sum(expansions)
 
             # set the size of the map in the header to 0 to fix a bug where
             # halo will leak file handles for very large maps. Also removes
@@ -503,7 +832,12 @@ def save_map(self, save_path=None, map_name=ACTIVE_INDEX,
             # write the map header so the calculate_ce_checksum can read it
             out_file.seek(0)
             out_file.write(map_header.serialize(calc_pointers=False))
-            crc = crc_functions.calculate_ce_checksum(out_file, index_magic)
+            # only the tag data changes when saving, so reuse the
+            # checksums of the other sections if they were calculated
+            crc = crc_functions.calculate_ce_checksum(
+                out_file, index_magic, self.checksum_threads,
+                region_crcs=get_map_region_crcs(
+                    halo_map, (index_header_offset, map_header.tag_data_size)))
             if halo_map.force_checksum:
                 crc_functions.E.__defaults__[0][:] = [
                     0, 0x800000000 - map_header.crc32, map_header.crc32]
@@ -516,42 +850,218 @@ def save_map(self, save_path=None, map_name=ACTIVE_INDEX,
             out_file.seek(0)
             out_file.write(map_header.serialize(calc_pointers=False))
             out_file.flush()
+            bytes_written += map_header.binsize
 
             halo_map.filepath = halo_map.decomp_filepath = save_path
+
+            # the strings in the map match the tag paths now, so
+            # record them as the originals for the next time it's saved
+            halo_map.cache_original_tag_paths()
         except Exception:
             if halo_map.map_data is not out_file:
                 out_file.close()
             raise
 
-        return save_path
-
-    def load_map(self, map_path, replace_if_same_name=False, **kw):
-        make_active        = kw.pop("make_active", None)
-        do_printout        = kw.get("do_printout", self.do_printout)
-        autoload_resources = kw.pop("autoload_resources", self.autoload_resources)
-
         if do_printout:
-            print("Loading %s..." % map_path.name)
+            print("Saved %s. Copied %s bytes and wrote %s bytes." % (
+                save_path.name, bytes_copied, bytes_written))
+
+        return save_path
 
-        with get_rawdata_context(filepath=map_path, writable=False) as f:
+    def identify_map(self, map_path, tag_index_cache=None):
+        '''
+        Returns the engine and name of the map at map_path, the class to
+        load it with, and its CachedMapIdentity if tag_index_cache has it.
+        Only resource maps are looked up in tag_index_cache, as they're
+        the only ones that need to be parsed to be identified.
+        '''
+        cached = None
+        with _map_parse_lock, get_rawdata_context(
+                filepath=map_path, writable=False) as f:
             head_sig   = unpack("<I", f.peek(4))[0]
             map_header = get_map_header(f, True)
             engine     = get_map_version(map_header)
 
-        is_halo1_rsrc = False
-        if engine is None and head_sig in (1, 2, 3):
+        if engine is None and tag_index_cache is not None:
+            cached = tag_index_cache.get(map_path)
+
+        if engine is None and cached and cached.is_resource:
+            # already know what engine this resource map is for
+            return cached.engine, cached.map_name, Halo1RsrcMap, cached
+        elif engine is None and head_sig in (1, 2, 3):
             # gotta do some hacky shit to figure out this engine
             rsrc_map = Halo1RsrcMap({})
-            rsrc_map.load_map(map_path)
-            engine = rsrc_map.engine
-            is_halo1_rsrc = True
-
+            with _map_parse_lock:
+                rsrc_map.load_map(map_path)
             map_name = {1: "bitmaps", 2: "sounds", 3: "loc"}[head_sig]
+            return rsrc_map.engine, map_name, Halo1RsrcMap, cached
         elif engine in halo_map_wrappers_by_engine:
-            map_name = map_header.map_name
+            return (engine, map_header.map_name,
+                    halo_map_wrappers_by_engine[engine], cached)
+
+        raise EngineDetectionError(
+            'Could not determine map engine for "%s"' % map_path)
+
+    def read_map(self, map_path, **kw):
+        '''
+        Reads the map at map_path without adding it to the loaded maps.
+        This doesn't touch the loaded maps, so several maps can be read
+        on separate threads at once. Pass the returned map to load_map
+        as halo_map to add it to the loaded maps.
+        '''
+        tag_index_cache = None
+        if kw.pop("use_tag_index_cache", self.use_tag_index_cache):
+            tag_index_cache = TagIndexCache(self.tag_index_cache_dir)
+
+        engine, map_name, map_class, cached = self.identify_map(
+            map_path, tag_index_cache)
+        # the map is moved into its engine's collection when it's added
+        return self._read_map(
+            map_path, map_class({}), cached, tag_index_cache, **kw)
+
+    def _read_map(self, map_path, new_map, cached=None,
+                  tag_index_cache=None, prefetch=False, **kw):
+        if prefetch:
+            prefetch_map_file(map_path)
+
+        with _map_parse_lock:
+            new_map.load_map(map_path, **kw)
+        if tag_index_cache and not cached and new_map.is_resource:
+            try:
+                tag_index_cache.put(map_path, new_map)
+            except Exception:
+                print(format_exc())
+
+        return new_map
+
+    def read_maps(self, map_paths, **kw):
+        '''
+        Reads the maps at map_paths using up to load_workers threads.
+        Yields a (map_path, halo_map, error) tuple for each map in the
+        order given, where error is the exception raised reading the map,
+        or None if it was read. The maps are not added to the loaded maps.
+
+        The threads only overlap reading map files from disk. Maps are
+        parsed one at a time, and all of them are read before any are
+        yielded, so nothing done with a yielded map can overlap a parse.
+        '''
+        map_paths = tuple(Path(map_path) for map_path in map_paths)
+        do_printout = kw.get("do_printout", self.do_printout)
+        workers = get_worker_count(kw.pop("load_workers", self.load_workers))
+        workers = min(workers, len(map_paths))
+
+        if workers <= 1:
+            for map_path in map_paths:
+                if do_printout:
+                    print("Loading %s..." % map_path.name)
+                try:
+                    yield map_path, self.read_map(map_path, **kw), None
+                except Exception as e:
+                    yield map_path, None, e
+            return
+
+        tag_index_cache = None
+        if kw.pop("use_tag_index_cache", self.use_tag_index_cache):
+            tag_index_cache = TagIndexCache(self.tag_index_cache_dir)
+
+        results = []
+        with ThreadPoolExecutor(workers) as executor:
+            futures = []
+            for map_path in map_paths:
+                if do_printout:
+                    print("Loading %s..." % map_path.name)
+                try:
+                    engine, map_name, map_class, cached = self.identify_map(
+                        map_path, tag_index_cache)
+                    # creating the map sets up the definitions for its
+                    # class, which isn't safe to do on several threads
+                    new_map = map_class({})
+                    futures.append(executor.submit(
+                        self._read_map, map_path, new_map, cached,
+                        tag_index_cache, prefetch=True, **kw))
+                except Exception as e:
+                    futures.append(e)
+
+            for map_path, future in zip(map_paths, futures):
+                try:
+                    if isinstance(future, Exception):
+                        raise future
+                    results.append((map_path, future.result(), None))
+                except Exception as e:
+                    results.append((map_path, None, e))
+
+        yield from results
+
+    def load_maps(self, map_paths, replace_if_same_name=False, **kw):
+        '''
+        Loads the maps at map_paths, reading them on up to load_workers
+        threads and adding them to the loaded maps in the order given.
+        Returns a list of the maps loaded, with None for any that failed.
+        '''
+        read_kw = {k: kw[k] for k in ("do_printout", "load_workers",
+                                      "use_tag_index_cache") if k in kw}
+        kw.pop("load_workers", None)
+        kw.pop("use_tag_index_cache", None)
+
+        loaded = []
+        for map_path, new_map, error in self.read_maps(map_paths, **read_kw):
+            halo_map = None
+            try:
+                if error is not None:
+                    raise error
+
+                halo_map = self.load_map(
+                    map_path, replace_if_same_name, halo_map=new_map, **kw)
+            except RefineryError:
+                print(format_exc(0))
+            except Exception:
+                print(format_exc())
+
+            if halo_map is None:
+                self.discard_read_map(new_map)
+
+            loaded.append(halo_map)
+
+        return loaded
+
+    def discard_read_map(self, halo_map):
+        '''
+        Unloads a map returned by read_map if it was never added to
+        the loaded maps. Does nothing if it was added or is None.
+        '''
+        if halo_map is None:
+            return
+
+        if halo_map.maps is not self.maps_by_engine.get(halo_map.engine):
+            halo_map.unload_map()
+
+    def load_map(self, map_path, replace_if_same_name=False, **kw):
+        '''
+        Loads the map at map_path and adds it to the loaded maps. If
+        halo_map is provided, it must be a map read from map_path by
+        read_map, and it will be added rather than reading the map again.
+        If it can't be added, it's left to the caller to unload it.
+        '''
+        make_active        = kw.pop("make_active", None)
+        do_printout        = kw.get("do_printout", self.do_printout)
+        autoload_resources = kw.pop("autoload_resources", self.autoload_resources)
+        lazy_load_resources = kw.pop(
+            "lazy_load_resources", self.lazy_load_resources)
+        new_map = kw.pop("halo_map", None)
+
+        tag_index_cache = None
+        if new_map is not None:
+            engine, map_name = new_map.engine, new_map.map_name
+            kw.pop("use_tag_index_cache", None)
         else:
-            raise EngineDetectionError(
-                'Could not determine map engine for "%s"' % map_path)
+            if do_printout:
+                print("Loading %s..." % map_path.name)
+
+            if kw.pop("use_tag_index_cache", self.use_tag_index_cache):
+                tag_index_cache = TagIndexCache(self.tag_index_cache_dir)
+
+            identity = self.identify_map(map_path, tag_index_cache)
+            engine, map_name = identity[:2]
 
         maps = self.maps_by_engine.setdefault(engine, {})
         if not(maps.get(map_name) is None or replace_if_same_name):
@@ -569,15 +1079,15 @@ def load_map(self, map_path, replace_if_same_name=False, **kw):
         if maps.get(map_name) is not None:
             self.unload_maps(None, (engine, ), (map_name, ))
 
-        if is_halo1_rsrc:
-            new_map = Halo1RsrcMap(maps)
-        elif engine in halo_map_wrappers_by_engine:
-            new_map = halo_map_wrappers_by_engine[engine](maps)
-        else:
-            raise EngineDetectionError(
-                'Could not determine map engine for "%s"' % map_path)
+        if new_map is None:
+            new_map = self._read_map(
+                map_path, identity[2]({}), identity[3], tag_index_cache, **kw)
 
-        new_map.load_map(map_path, **kw)
+        # move the map into its engine's collection of maps, along with
+        # any other names the map registered itself under while being read
+        maps.update(new_map.maps)
+        new_map.maps = maps
+        maps[map_name] = new_map
 
         if make_active:
             maps[ACTIVE_INDEX] = new_map
@@ -589,7 +1099,8 @@ def load_map(self, map_path, replace_if_same_name=False, **kw):
             self.active_engine_name = engine
 
         if autoload_resources:
-            self.load_resource_maps(new_map)
+            self.load_resource_maps(
+                new_map, lazy_load_resources=lazy_load_resources)
 
         return new_map
 
@@ -600,23 +1111,127 @@ def load_resource_maps(self, halo_map=None, maps_dir="", map_paths=(), **kw):
         if not halo_map:
             return set()
 
+        if (kw.pop("lazy_load_resources", self.lazy_load_resources) and
+                not halo_map.is_resource):
+            return register_lazy_resource_maps(
+                halo_map, maps_dir, map_paths, **kw)
+
         return halo_map.load_resource_maps(maps_dir, map_paths, **kw)
 
     def deprotect_all(self, **kw):
+        '''
+        Deprotects and saves every loaded Halo 1 map, printing a summary of
+        how it went for each. Returns a list of DeprotectionResult.
+
+        If deprotect_workers is anything other than 1, the maps are unloaded,
+        deprotected in that many worker processes(one per cpu if less than 1)
+        and then loaded again once all of them are finished.
+        '''
+        workers = kw.pop("deprotect_workers", self.deprotect_workers)
+
+        maps_to_deprotect = []
         for engine in self.maps_by_engine:
             if engine not in ("halo1ce", "halo1yelo", "halo1pc", "halo1vap"):
                 continue
 
             maps = self.maps_by_engine[engine]
             for map_name in sorted(maps):
+                halo_map = maps.get(map_name)
+                if halo_map is not None and (map_name != ACTIVE_INDEX and
+                                             not halo_map.is_resource):
+                    maps_to_deprotect.append((engine, map_name, halo_map))
+
+        start = time()
+        if len(maps_to_deprotect) > 1 and get_worker_count(workers) > 1:
+            results = self._deprotect_all_parallel(
+                maps_to_deprotect, workers, **kw)
+        else:
+            results = []
+            for engine, map_name, halo_map in maps_to_deprotect:
+                map_start, error = time(), ""
+                try:
+                    self.deprotect(halo_map.filepath, map_name, engine, **kw)
+                except Exception:
+                    error = format_exc()
+
+                results.append(DeprotectionResult(
+                    engine, map_name, halo_map.filepath, error,
+                    time() - map_start, ""))
+
+        self.print_deprotection_summary(results, time() - start)
+        return results
+
+    def _deprotect_all_parallel(self, maps_to_deprotect, workers, **kw):
+        active_engine_name = self.active_engine_name
+        active_map_name = self.active_map_name
+        settings = {name: getattr(self, name)
+                    for name in DEPROTECTION_SETTING_NAMES}
+
+        maps_info = []
+        for engine, map_name, halo_map in maps_to_deprotect:
+            orig_tag_paths = halo_map.orig_tag_paths
+            tag_index_array = halo_map.tag_index.tag_index
+            for i in range(len(tag_index_array)):
+                if orig_tag_paths[i].lower() != tag_index_array[i].path.lower():
+                    # the workers load the map from the file, so save
+                    # any renames made to it before handing it off
+                    self.save_map(halo_map.filepath, map_name, engine,
+                                  prompt_strings_expand=False,
+                                  prompt_internal_rename=False)
+                    halo_map.cache_original_tag_paths()
+                    break
+
+            crc32 = None
+            if halo_map.force_checksum:
+                crc32 = halo_map.map_header.crc32
+
+            maps_info.append((
+                engine, map_name, halo_map.filepath,
+                get_loaded_resource_map_paths(halo_map), crc32))
+
+        # the workers will be writing to these maps, so they can't stay open
+        for engine, map_name, halo_map in maps_to_deprotect:
+            self.unload_maps(MAP_TYPE_REGULAR, (engine, ), (map_name, ))
+
+        results = []
+        try:
+            for result in deprotect_maps(maps_info, workers, settings, **kw):
+                if result.output:
+                    print(result.output, end="")
+                results.append(result)
+        finally:
+            for engine, map_name, filepath, _, __ in maps_info:
                 try:
-                    halo_map = maps.get(map_name)
-                    if halo_map is not None and (map_name != ACTIVE_INDEX and
-                                                 not halo_map.is_resource):
-                        self.deprotect(halo_map.filepath, map_name, engine, **kw)
+                    self.load_map(filepath, make_active=False,
+                                  autoload_resources=False)
                 except Exception:
                     print(format_exc())
 
+            if active_engine_name and active_map_name:
+                self.set_active_engine(active_engine_name, active_map_name)
+                self.set_active_map(active_map_name)
+
+        # keep the results in the same order a serial run would be in
+        order = {info[:2]: i for i, info in enumerate(maps_info)}
+        results.sort(key=lambda result: order[result[:2]])
+        return results
+
+    def print_deprotection_summary(self, results, duration=None):
+        failed = [result for result in results if result.error]
+        if duration is None:
+            duration = sum(result.duration for result in results)
+
+        print("Deprotected %s of %s maps. Took %s seconds." % (
+            len(results) - len(failed), len(results), round(duration, 1)))
+        for result in results:
+            print("    %-8s%s: %s(%s seconds)" % (
+                "FAILED" if result.error else "OK", result.engine,
+                result.map_name, round(result.duration, 1)))
+
+        for result in failed:
+            print('\nError while deprotecting "%s":\n%s' % (
+                result.filepath, result.error))
+
     def deprotect(self, save_path=None, map_name=ACTIVE_INDEX,
                   engine=ACTIVE_INDEX, **kw):
         halo_map = self.maps_by_engine.get(engine, {}).get(map_name)
@@ -656,8 +1271,8 @@ def deprotect(self, save_path=None, map_name=ACTIVE_INDEX,
                 prompt_internal_rename=False)):
             return
 
-        # get the active map AFTER saving because it WILL have changed
-        halo_map        = self.active_map
+        # get the map AFTER saving because it WILL have changed
+        halo_map        = self.maps_by_engine.get(engine, {}).get(map_name)
         map_type        = halo_map.map_header.map_type.enum_name
         tag_index_array = halo_map.tag_index.tag_index
 
@@ -771,10 +1386,17 @@ def deprotect(self, save_path=None, map_name=ACTIVE_INDEX,
                     raise
                 print(format_exc())
 
+        # the tags were renamed, so they need to be looked up by path again
+        invalidate_tag_path_query_index(halo_map)
+
         # calculate the maps new checksum
         if not halo_map.force_checksum:
-            halo_map.map_header.crc32 = crc_functions.calculate_ce_checksum(
-                halo_map.get_writable_map_data(), halo_map.index_magic)
+            map_header = halo_map.map_header
+            map_header.crc32 = crc_functions.calculate_ce_checksum(
+                halo_map.get_writable_map_data(), halo_map.index_magic,
+                self.checksum_threads, region_crcs=get_map_region_crcs(
+                    halo_map, (map_header.tag_index_header_offset,
+                               map_header.tag_data_size)))
 
         self.save_map(save_path, map_name, engine,
                       prompt_strings_expand=False,
@@ -829,7 +1451,7 @@ def detect_tag_collection_names(self, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX
         for tag_id, tag_cls in tag_classes_by_id.items():
             if tag_cls != "yelo": continue
 
-            yelo_meta = halo_map.get_meta(tag_id)
+            yelo_meta = self.meta_cache.get_meta(halo_map, tag_id)
             if not yelo_meta: continue
 
             if (yelo_meta.scenario_explicit_references.id & 0xFFff) != 0xFFff:
@@ -891,6 +1513,14 @@ def repair_tag_classes(self, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX):
             elif tag_cls == "matg" and b.path == "globals\\globals":
                 repair[tag_id] = tag_cls
 
+        # repairing writes to the tag data and bsps, so
+        # the checksums of those will need recalculating
+        get_map_region_crcs(halo_map).clear()
+        # the tag classes are about to change, so the tags
+        # with rawdata pointers need to be found again
+        halo_map.rawdata_pointer_index = None
+        invalidate_tag_path_query_index(halo_map)
+
         # scan the tags that need repairing and repair them
         while repair:
             next_repair = {}
@@ -979,6 +1609,12 @@ def repair_tag_classes(self, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX):
             tag_index_ref.class_2.data = (classes_int >> 32) & 0xFFffFFff
             tag_index_ref.class_3.data = (classes_int >> 64) & 0xFFffFFff
 
+        # the tag data was written to, so none of the cached metas can
+        # be trusted. only the repaired tags were re-classed or written
+        # to though, so only their dependencies can have changed
+        self.meta_cache.invalidate(halo_map)
+        update_dependency_graph(halo_map, repaired)
+
         return repaired
 
     def sanitize_resource_tag_paths(self, path_handler, map_name=ACTIVE_INDEX,
@@ -1015,7 +1651,8 @@ def _script_scrape_deprotect(self, path_handler, map_name=ACTIVE_INDEX,
         if not halo_map:
             return
 
-        scnr_meta = halo_map.get_meta(halo_map.tag_index.scenario_tag_id)
+        scnr_meta = self.meta_cache.get_meta(
+            halo_map, halo_map.tag_index.scenario_tag_id)
         if not scnr_meta:
             raise ValueError("Could not get scenario data for script scraping.")
 
@@ -1064,6 +1701,7 @@ def _heuristics_deprotect(self, path_handler, map_name=ACTIVE_INDEX,
             "shallow_ui_widget_nesting", self.shallow_ui_widget_nesting)
         print_name_changes = do_printout and kw.pop(
             "print_heuristic_name_changes", self.print_heuristic_name_changes)
+        use_graph = kw.pop("use_dependency_graph", self.use_dependency_graph)
 
         if halo_map is None:
             halo_map = self.active_map
@@ -1071,6 +1709,12 @@ def _heuristics_deprotect(self, path_handler, map_name=ACTIVE_INDEX,
         if not halo_map:
             return
 
+        # the heuristics read the same metas many times over, so
+        # give them a map that reads its metas through the cache
+        meta_cache = self.meta_cache
+        meta_cache.reset_stats()
+        halo_map = MetaCachedMap(halo_map, meta_cache)
+
         tag_index_array = halo_map.tag_index.tag_index
         matg_meta = halo_map.matg_meta
         hudg_id = 0xFFFF if not matg_meta else\
@@ -1102,66 +1746,86 @@ def _heuristics_deprotect(self, path_handler, map_name=ACTIVE_INDEX,
             if tag_type in ids_to_deprotect_by_class:
                 ids_to_deprotect_by_class[tag_type].append(i)
 
-        # NOTE: These are ordered in this way to allow the most logical sorting
-        for tag_type in (
-                "scenario_structure_bsp", "vehicle", "weapon", "equipment",
-                "actor_variant", "biped",
-                "ui_widget_collection", "ui_widget_definition", "hud_globals",
-                "project_yellow", "globals", "scenario", "tag_collection"):
-            if do_printout:
-                print("Renaming %s tags" % tag_type)
-                if print_name_changes:
-                    print("tag_id\tweight\ttag_path\n")
+        def_priority = path_handler.def_priority
+        def get_actor_variant_depth(tag_id):
+            return INF if path_handler.get_priority(tag_id) == def_priority else 1
 
+        def get_scenery_depth(tag_id):
+            return INF if path_handler.get_priority(tag_id) == def_priority else 0
+
+        # rather than visiting each tag in fixed passes, tags are visited
+        # from a worklist. actor_variants are revisited when their path or
+        # a dependency's path changes, and scenery is visited last.
+        # NOTE: These are ordered in this way to allow the most logical sorting
+        tag_types = (
+            "scenario_structure_bsp", "vehicle", "weapon", "equipment",
+            "actor_variant", "biped",
+            "ui_widget_collection", "ui_widget_definition", "hud_globals",
+            "project_yellow", "globals", "scenario", "tag_collection")
+        actor_variant_revisit_priority, scenery_priority = 1, 0
+
+        # without the graph, which tags a rename affects isn't known, so
+        # each actor_variant is revisited once after the other classes
+        dependency_graph = None
+        if use_graph:
+            dependency_graph = self.get_dependency_graph(map_name, engine)
+        worklist = HeuristicWorklist(path_handler, dependency_graph)
+
+        pass_names = {
+            actor_variant_revisit_priority: "Revisiting actor_variant tags",
+            scenery_priority: "Renaming scenery tags",
+            }
+        for i, tag_type in enumerate(tag_types):
+            sched_priority = len(tag_types) + 1 - i
+            pass_names[sched_priority] = "Renaming %s tags" % tag_type
+            depth = 0 if tag_type == "ui_widget_collection" else INF
             for tag_id in ids_to_deprotect_by_class[tag_type]:
-                if tag_id is None:
-                    continue
+                worklist.push(tag_id, sched_priority, depth)
 
-                try:
-                    depth = 0 if tag_type == "ui_widget_collection" else INF
-                    heuristic_deprotect(
-                        tag_id, halo_map, path_handler,
-                        do_printout=print_name_changes, depth=depth,
-                        shallow_ui_widget_nesting=shallow_ui_widget_nesting,
-                        use_minimum_priorities=use_minimum_priorities)
-                except Exception:
-                    if not print_errors:
-                        raise
-                    print(format_exc())
+        for tag_id in ids_to_deprotect_by_class["actor_variant"]:
+            worklist.set_revisitable(
+                tag_id, actor_variant_revisit_priority,
+                get_actor_variant_depth)
 
-        if do_printout:
-            print("Final actor_variant rename pass")
-            if print_name_changes:
-                print("tag_id\tweight\ttag_path\n")
+        for tag_id in scen_ids:
+            worklist.push(tag_id, scenery_priority, get_scenery_depth)
+
+        curr_pass_name = None
+        while worklist:
+            tag_id, depth, sched_priority = worklist.pop()
+            pass_name = pass_names.get(sched_priority)
+            if do_printout and pass_name != curr_pass_name:
+                print(pass_name)
+                if print_name_changes:
+                    print("tag_id\tweight\ttag_path\n")
 
-        for tag_id in ids_to_deprotect_by_class["actor_variant"]:
-            if tag_id is None: continue
+            curr_pass_name = pass_name
+            deprotect_kw = dict(do_printout=print_name_changes, depth=depth)
+            if sched_priority > actor_variant_revisit_priority:
+                # revisiting actor_variants and renaming scenery have
+                # always been done with the default for these settings
+                deprotect_kw.update(
+                    shallow_ui_widget_nesting=shallow_ui_widget_nesting,
+                    use_minimum_priorities=use_minimum_priorities)
             try:
-                depth = INF if (path_handler.get_priority(tag_id) ==
-                                path_handler.def_priority) else 1
-                heuristic_deprotect(tag_id, halo_map, path_handler, depth=depth,
-                                 do_printout=print_name_changes)
+                heuristic_deprotect(tag_id, halo_map, path_handler,
+                                    **deprotect_kw)
             except Exception:
                 if not print_errors:
                     raise
                 print(format_exc())
 
         if do_printout:
-            print("Final scenery rename pass")
+            print(worklist.get_visits_string())
             if print_name_changes:
-                print("tag_id\tweight\ttag_path\n")
+                print("tag_id\tvisits\ttag_path")
+                for tag_id, visits in sorted(worklist.visits.items()):
+                    if visits > 1:
+                        print(tag_id, visits, path_handler.get_path(tag_id),
+                              sep="\t")
 
-        for tag_id in scen_ids:
-            if tag_id is None: continue
-            try:
-                depth = INF if (path_handler.get_priority(tag_id) ==
-                                path_handler.def_priority) else 0
-                heuristic_deprotect(tag_id, halo_map, path_handler, depth=depth,
-                                 do_printout=print_name_changes)
-            except Exception:
-                if not print_errors:
-                    raise
-                print(format_exc())
+        if do_printout:
+            print(meta_cache.get_stats_string())
 
     def extract_cheape(self, filepath=Path(""), map_name=ACTIVE_INDEX,
                        engine=ACTIVE_INDEX):
@@ -1201,23 +1865,47 @@ def process_queue(self, **kw):
                           data_extracted_by_map=data_extracted_by_map,
                           cheapes_extracted=cheapes_extracted)
 
+        progress = self.extraction_progress
+        if progress is not None:
+            progress.start(len(self._extract_queue))
+
         item = self.dequeue()
+        pre_read = []
         while item:
+            if progress is not None and progress.cancelled:
+                del self._extract_queue[:]
+                if kw.get("do_printout", self.do_printout):
+                    print("Cancelled processing the queue.\n")
+                break
+
+            item_kw = dict(extract_kw)
+            if item.operation == "load_map":
+                if not pre_read:
+                    pre_read = self.read_queued_maps(item, **kw)
+
+                if pre_read and pre_read[0][0] is item:
+                    item_kw["halo_map"] = pre_read.pop(0)[1]
+
+            engine = getattr(item, "engine", None)
+            map_name = getattr(item, "map_name", None)
+
+            halo_map = self.maps_by_engine.get(engine, {}).get(map_name)
+            item_name = "%s: " % item.operation
+            if halo_map:
+                item_name += "%s: %s" % (halo_map.engine, halo_map.map_name)
+            elif engine:
+                item_name += str(item.engine)
+            elif map_name:
+                item_name += str(item.map_name)
+
             if kw.get("do_printout", self.do_printout):
-                engine = getattr(item, "engine", None)
-                map_name = getattr(item, "map_name", None)
-
-                halo_map = self.maps_by_engine.get(engine, {}).get(map_name)
-                print("%s: " % item.operation, end="")
-                if halo_map:
-                    print("%s: %s" % (halo_map.engine, halo_map.map_name))
-                elif engine:
-                    print(item.engine)
-                elif map_name:
-                    print(item.map_name)
+                print(item_name)
+
+            if progress is not None:
+                progress.start_item(item_name)
 
             try:
-                self.process_queue_item(item, **extract_kw)
+                self.process_queue_item(item, **item_kw)
                 if kw.get("do_printout", self.do_printout):
                     print()  # print a new line to separate operations
             except RefineryError:
@@ -1225,8 +1913,19 @@ def process_queue(self, **kw):
             except Exception:
                 print(format_exc())
 
+            if progress is not None:
+                progress.finish_item()
+
+            if not isinstance(item_kw.get("halo_map"), Exception):
+                self.discard_read_map(item_kw.get("halo_map"))
             item = self.dequeue(0)
 
+        # processing was cancelled before getting to the items these
+        # maps were read for, so nothing else will unload them
+        for _, halo_map in pre_read:
+            if not isinstance(halo_map, Exception):
+                self.discard_read_map(halo_map)
+
         if kw.get("do_printout", self.do_printout) and (tags_extracted_by_map or
                                                         data_extracted_by_map):
             tags_extracted = data_extracted = 0
@@ -1241,6 +1940,30 @@ def process_queue(self, **kw):
 
         return tags_extracted_by_map, data_extracted_by_map
 
+    def read_queued_maps(self, item, **kw):
+        '''
+        Reads the map of the given load_map queue item along with the maps
+        of any load_map items queued right after it, so they can be read on
+        several threads at once. Returns a list of (item, halo_map) tuples
+        in queue order, where halo_map is the exception raised reading the
+        map if it couldn't be read. Returns an empty list if there's
+        nothing to gain from reading the maps together.
+        '''
+        items = [item]
+        for next_item in self._extract_queue:
+            if next_item.operation != "load_map":
+                break
+            items.append(next_item)
+
+        if (len(items) < 2 or
+                get_worker_count(kw.get("load_workers", self.load_workers)) == 1):
+            return []
+
+        map_paths = [Path(item.filepath) for item in items]
+        return [(item, halo_map if error is None else error)
+                for item, (_, halo_map, error) in
+                zip(items, self.read_maps(map_paths, **kw))]
+
     def process_queue_item(self, queue_item, **kw):
         tags_by_map = kw.pop("tags_extracted_by_map", {})
         data_by_map = kw.pop("data_extracted_by_map", {})
@@ -1290,6 +2013,9 @@ def process_queue_item(self, queue_item, **kw):
             kw["extract_mode"] = "tags"
             ignore = tags_by_map.setdefault((engine, map_name), set())
 
+            if self.extraction_progress is not None:
+                self.extraction_progress.add_tags_total(1)
+
             if tag_ids[0] not in ignore:
                 self.extract_tag(tag_ids[0], map_name, engine, **kw)
                 ignore.add(tag_ids[0])
@@ -1304,6 +2030,9 @@ def process_queue_item(self, queue_item, **kw):
         elif op == "deprotect_map":
             self.deprotect(filepath, map_name, engine, **kw)
         elif op == "load_map":
+            if isinstance(kw.get("halo_map"), Exception):
+                # the map was read ahead of time and failed to read
+                raise kw["halo_map"]
             self.load_map(filepath, **kw)
         elif op == "unload_map":
             self.unload_map(map_name, engine, **kw)
@@ -1327,6 +2056,7 @@ def process_queue_item(self, queue_item, **kw):
             if len(tag_ids) == 0:
                 return
             halo_map.rename_tag_by_id(tag_ids[0], queue_item.new_path)
+            invalidate_tag_path_query_index(halo_map)
         elif op == "print_dir":
             kw.setdefault("do_printout", True)
             halo_map.print_tag_index(**kw)
@@ -1349,10 +2079,17 @@ def process_queue_item(self, queue_item, **kw):
             print(halo_map.get_file_names(dir_path))
         elif op == "print_map_info":
             print(halo_map.generate_map_info_string())
+        elif op == "print_refs_to":
+            tag_ids = TagPathDetokenizer((tag_id,)).get_filtered_tag_ids(halo_map)
+            for tag_id in tag_ids:
+                print(self.generate_refs_to_string(
+                    tag_id, map_name, engine, **kw))
         elif op == "rename_tag":
             halo_map.rename_tag(queue_item.tag_path, queue_item.new_path)
+            invalidate_tag_path_query_index(halo_map)
         elif op == "rename_dir":
             halo_map.rename_dir(queue_item.dir_path, queue_item.new_path)
+            invalidate_tag_path_query_index(halo_map)
         elif op == "switch_map_by_filepath":
             engine = map_name = None
             for curr_engine in sorted(self.maps_by_engine):
@@ -1376,11 +2113,90 @@ def process_queue_item(self, queue_item, **kw):
         else:
             raise ValueError('Unknown queue operation "%s"' % op)
 
+    def get_dependency_graph(self, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw):
+        '''
+        Returns the DependencyGraph of the specified map, building it if
+        needed. The graph is cached to disk alongside the tag index cache
+        if use_tag_index_cache is True. Returns None if the graph can't be
+        built for the map, in which case dependencies must be found by
+        extracting each tag.
+        '''
+        halo_map = self.maps_by_engine.get(engine, {}).get(map_name)
+        if halo_map is None:
+            raise MapNotLoadedError(
+                '"%s" is not loaded under engine "%s".' % (map_name, engine))
+
+        tag_index_cache = None
+        if kw.pop("use_tag_index_cache", self.use_tag_index_cache):
+            tag_index_cache = TagIndexCache(self.tag_index_cache_dir)
+
+        try:
+            return get_dependency_graph(
+                halo_map, tag_index_cache, self.meta_cache)
+        except Exception:
+            print(format_exc())
+
+        return None
+
+    def get_tag_dependents(self, tag_id, map_name=ACTIVE_INDEX,
+                           engine=ACTIVE_INDEX, recursive=False, **kw):
+        '''
+        Returns a sorted list of the ids of the tags in the specified map
+        that reference the given tag. If recursive is True, the tags that
+        reference those tags are included, and so on.
+        '''
+        halo_map = self.maps_by_engine.get(engine, {}).get(map_name)
+        graph = self.get_dependency_graph(map_name, engine, **kw)
+        if graph is None:
+            raise RefineryError(
+                'Cannot find tag references in "%s" maps.' %
+                getattr(halo_map, "engine", engine))
+
+        return list(graph.get_dependents(tag_id & 0xFFff, recursive))
+
+    def generate_refs_to_string(self, tag_id, map_name=ACTIVE_INDEX,
+                                engine=ACTIVE_INDEX, **kw):
+        halo_map = self.maps_by_engine.get(engine, {}).get(map_name)
+        if halo_map is None:
+            raise MapNotLoadedError(
+                '"%s" is not loaded under engine "%s".' % (map_name, engine))
+
+        tag_index_array = halo_map.tag_index.tag_index
+        tag_id &= 0xFFff
+        if tag_id not in range(len(tag_index_array)):
+            raise InvalidTagIdError('tag_id "%s" is not in the tag index.' %
+                                    tag_id)
+
+        recursive = kw.pop("recursive", False)
+        dependent_ids = self.get_tag_dependents(
+            tag_id, map_name, engine, recursive, **kw)
+
+        tag_index_ref = tag_index_array[tag_id]
+        string = "%s tags reference %s.%s" % (
+            len(dependent_ids), PureWindowsPath(tag_index_ref.path),
+            tag_index_ref.class_1.enum_name)
+        for dep_id in dependent_ids:
+            tag_index_ref = tag_index_array[dep_id]
+            string += "\n    %s.%s" % (PureWindowsPath(tag_index_ref.path),
+                                       tag_index_ref.class_1.enum_name)
+
+        return string
+
     def extract_tags(self, tag_ids, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw):
         '''
         Extracts multiple tags from the specified map as either a tag or data.
         If recursive == True and extract_mode == "tags", all dependent tags
         will be extracted as well. Returns a set() of all tag ids extracted.
+
+        If extract_workers is anything other than 1, Halo 1 tags will be
+        extracted by that many worker processes(one per cpu if less than 1).
+
+        If use_dependency_graph is True and tags aren't being overwritten,
+        every tag a recursive extraction could need is planned up front from
+        the map's DependencyGraph. Tags that were already extracted are then
+        skipped without reading them, and the dependencies of each tag are
+        looked up in the graph rather than found in its meta. The tags
+        extracted are otherwise the same as without it.
         '''
         extract_mode = kw.setdefault("extract_mode", "tags")
         assert extract_mode in ("tags", "data")
@@ -1389,6 +2205,8 @@ def extract_tags(self, tag_ids, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw
         recursive     = kw.pop("recursive", self.recursive)
         do_printout   = kw.get("do_printout", self.do_printout)
         tagslist_path = Path(kw.pop("tagslist_path", self.tagslist_path))
+        workers       = kw.pop("extract_workers", self.extract_workers)
+        use_graph     = kw.pop("use_dependency_graph", self.use_dependency_graph)
 
         if isinstance(tag_ids, int):
             tag_ids = (tag_ids, )
@@ -1414,33 +2232,94 @@ def extract_tags(self, tag_ids, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw
                    "shadowrun" in halo_map.engine)
         recursive &= is_gen1 and (extract_mode == "tags")
 
+        progress = self.extraction_progress
+        dependency_graph = None
+        if recursive and use_graph and not kw.get("overwrite", self.overwrite):
+            # when overwriting, every tag's meta has to be read to extract
+            # it anyway, so there's nothing to gain from having the graph
+            dependency_graph = self.get_dependency_graph(map_name, engine)
+
+        # the tags that need extracting, or None if they aren't known
+        # until the dependencies of the tags before them are found
+        planned_ids = None
+        if dependency_graph is not None:
+            planned_ids, skip_ids = self._plan_recursive_extraction(
+                halo_map, dependency_graph, tag_ids, tags_to_ignore,
+                out_dir, kw.get("force_lower_case_paths"))
+            # nothing those tags depend on is needed through them
+            tags_to_ignore.update(skip_ids)
+            if progress is not None:
+                progress.add_tags_total(len(planned_ids))
+
+        pool = None
+        if workers != 1 and is_gen1 and not halo_map.is_resource:
+            # use a pool of processes to extract tags in parallel
+            pool = TagExtractionPool(self, halo_map, workers,
+                                     dependency_graph=dependency_graph)
+            if pool.workers == 1:
+                pool = None
+
+        tag_count = len(halo_map.tag_index.tag_index)
         curr_tag_ids = set(tag_ids)
-        while curr_tag_ids:
-            next_tag_ids = set()
-            if recursive:
-                kw["dependency_ids"] = next_tag_ids
+        try:
+            while curr_tag_ids:
+                if progress is not None and progress.cancelled:
+                    break
+
+                next_tag_ids = set()
+                if recursive:
+                    kw["dependency_ids"] = next_tag_ids
+                    kw["dependency_graph"] = dependency_graph
+
+                layer_tag_ids = [tag_id for tag_id in sorted(curr_tag_ids)
+                                 if tag_id not in tags_to_ignore]
+
+                if planned_ids is not None:
+                    # tags that aren't planned to be extracted are only
+                    # visited to find their dependencies, which doesn't
+                    # need their metas to be read. tags that fail to be
+                    # extracted never have their dependencies found, so
+                    # anything only needed through them isn't extracted
+                    tags_to_visit = layer_tag_ids
+                    layer_tag_ids = []
+                    for tag_id in tags_to_visit:
+                        if tag_id in planned_ids or tag_id not in range(
+                                tag_count):
+                            layer_tag_ids.append(tag_id)
+                        else:
+                            next_tag_ids.update(
+                                dependency_graph.get_dependencies(tag_id))
+
+                    planned_ids.difference_update(layer_tag_ids)
+                elif progress is not None:
+                    progress.add_tags_total(len(layer_tag_ids))
+
+                if pool is None:
+                    extracted_ids = self._extract_tags(
+                        layer_tag_ids, map_name, engine, **kw)
+                else:
+                    extracted_ids = pool.extract_tags(
+                        layer_tag_ids, map_name, engine, **kw)
 
-            for tag_id in sorted(curr_tag_ids):
-                if tag_id in tags_to_ignore:
-                    continue
+                extracted.update(extracted_ids)
+                for tag_id in extracted_ids:
+                    if is_path_empty(tagslist_path):
+                        continue
 
-                try:
-                    if self.extract_tag(tag_id, map_name, engine, **kw):
-                        extracted.add(tag_id)
-                        if is_path_empty(tagslist_path):
-                            continue
-
-                        tag_index_ref = halo_map.tag_index.tag_index[tag_id]
-                        tag_path = "%s.%s" % (PureWindowsPath(tag_index_ref.path),
-                                              tag_index_ref.class_1.enum_name)
-                        tagslist += "%s: %s\n" % (extract_mode, tag_path)
-                except RefineryError:
-                    print(format_exc(0)) # only last line for RefineryErrors
-                except Exception:
-                    print(format_exc())
+                    tag_index_ref = halo_map.tag_index.tag_index[tag_id]
+                    tag_path = "%s.%s" % (PureWindowsPath(tag_index_ref.path),
+                                          tag_index_ref.class_1.enum_name)
+                    tagslist += "%s: %s\n" % (extract_mode, tag_path)
 
-            tags_to_ignore.update(curr_tag_ids)
-            curr_tag_ids = next_tag_ids
+                tags_to_ignore.update(curr_tag_ids)
+                curr_tag_ids = next_tag_ids
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        if planned_ids and progress is not None:
+            # these were only needed through tags that failed to extract
+            progress.add_tags_total(-len(planned_ids))
 
         for rsrc_map in halo_map.maps.values():
             if rsrc_map.is_resource or rsrc_map is halo_map:
@@ -1457,11 +2336,79 @@ def extract_tags(self, tag_ids, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw
 
         return extracted
 
+    def _plan_recursive_extraction(self, halo_map, dependency_graph, tag_ids,
+                                   tags_to_ignore, out_dir,
+                                   force_lower_case_paths=None):
+        '''
+        Finds every tag a recursive extraction of the given tags could reach
+        in the map's DependencyGraph, not counting tags in tags_to_ignore or
+        anything only reachable through them. Asks about overwriting an
+        existing globals tag now, rather than once it's reached.
+
+        Returns a set of the ids of the tags reached that need extracting,
+        and a set of the ids of the globals tags not to be overwritten. What
+        the globals depend on isn't needed through them if they aren't.
+        '''
+        tag_index_array = halo_map.tag_index.tag_index
+
+        skip_ids = set()
+        reached_ids = dependency_graph.get_closure(tag_ids, tags_to_ignore)
+        for tag_id in reached_ids:
+            tag_index_ref = tag_index_array[tag_id]
+            if (int_to_fourcc(tag_index_ref.class_1.data) == "matg" and
+                    out_dir.joinpath(self.get_tag_extract_path(
+                        tag_index_ref, force_lower_case_paths)).is_file() and
+                    not self.get_globals_overwrite(halo_map, tag_id)):
+                skip_ids.add(tag_id)
+
+        if skip_ids:
+            reached_ids = dependency_graph.get_closure(
+                tag_ids, skip_ids.union(tags_to_ignore))
+
+        planned_ids = set()
+        for tag_id in reached_ids:
+            tag_index_ref = tag_index_array[tag_id]
+            if tag_index_ref.class_1.enum_name in (supyr_constants.INVALID,
+                                                   "NONE"):
+                # let extracting it report that it can't be extracted
+                planned_ids.add(tag_id)
+            elif (int_to_fourcc(tag_index_ref.class_1.data) in
+                  halo_map.tag_headers and not out_dir.joinpath(
+                      self.get_tag_extract_path(
+                          tag_index_ref, force_lower_case_paths)).is_file()):
+                planned_ids.add(tag_id)
+
+        return planned_ids, skip_ids
+
+    def _extract_tags(self, tag_ids, map_name=ACTIVE_INDEX,
+                      engine=ACTIVE_INDEX, **kw):
+        '''
+        Extracts the tags in the order given, printing any errors that occur.
+        Returns a list of the tag ids extracted.
+        '''
+        extracted = []
+        progress = self.extraction_progress
+        for tag_id in tag_ids:
+            if progress is not None and progress.cancelled:
+                break
+
+            try:
+                if self.extract_tag(tag_id, map_name, engine, **kw):
+                    extracted.append(tag_id)
+            except RefineryError:
+                print(format_exc(0)) # only last line for RefineryErrors
+            except Exception:
+                print(format_exc())
+
+        return extracted
+
     def extract_tag(self, tag_id, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw):
         '''
         Extracts a single tag from the specified map as either a tag or data.
         If dependency_ids is provided as a set(), it will be filled with the
-        tag index ids of any dependencies of this tag.
+        tag index ids of any dependencies of this tag. If dependency_graph
+        is also provided, the dependencies are looked up in it rather than
+        found in the tag's meta, though only once the meta has been read.
 
         Returns either True or False, indicating whether or not the
         tag was extracted. True indicates extraction success, with False
@@ -1487,6 +2434,7 @@ def extract_tag(self, tag_id, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw):
 
 
         dependency_ids = kw.pop("dependency_ids", None)
+        dependency_graph = kw.pop("dependency_graph", None)
 
         get_dependencies = isinstance(dependency_ids, set)
 
@@ -1513,9 +2461,8 @@ def extract_tag(self, tag_id, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw):
             return False
 
         full_tag_class = tag_index_ref.class_1.enum_name
-        tag_path = str(tag_path) + "." + full_tag_class
-        if force_lower_case_paths:
-            tag_path = tag_path.lower()
+        tag_path = self.get_tag_extract_path(
+            tag_index_ref, force_lower_case_paths)
 
         tag_cls = int_to_fourcc(tag_index_ref.class_1.data)
         if extract_mode == "tags":
@@ -1538,25 +2485,17 @@ def extract_tag(self, tag_id, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw):
                    "shadowrun" in halo_map.engine)
 
         if tag_cls == "matg" and filepath.is_file() and is_gen1:
-            # determine if we should overwrite the globals tag
-            mode = self.globals_overwrite_mode
-            prompt = (mode == 0)
-            overwrite = (mode == 1)
-            map_type = halo_map.map_header.map_type.enum_name
-            if mode == 3 and map_type in ("sp", "ui"):
-                prompt = True
-            elif mode in (3, 4) and map_type == "mp":
-                overwrite = True
-
-            if prompt:
-                overwrite = self.prompt_globals_overwrite(halo_map, tag_id)
-
+            overwrite = self.get_globals_overwrite(halo_map, tag_id)
             if not overwrite:
                 return
 
         if do_printout:
             print("%s: %s" % (extract_mode, tag_path))
 
+        progress = self.extraction_progress
+        if progress is not None:
+            progress.set_current_tag(tag_path)
+
         meta = halo_map.get_meta(
             tag_id, True, disable_safe_mode=disable_safe_mode,
             disable_tag_cleaning=disable_tag_cleaning,)
@@ -1597,7 +2536,8 @@ def extract_tag(self, tag_id, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw):
                 for i in range(24, 32):
                     extract_kw["hsc_node_strings_by_type"][i] = strings
 
-        tag_refs = () if not (get_dependencies or force_lower_case_paths) else\
+        find_dependencies = get_dependencies and dependency_graph is None
+        tag_refs = () if not (find_dependencies or force_lower_case_paths) else\
                    halo_map.get_dependencies(meta, tag_id, tag_cls)
 
         if force_lower_case_paths:
@@ -1608,8 +2548,11 @@ def extract_tag(self, tag_id, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw):
         if get_dependencies:
             # add dependencies to list to be extracted
             index_len = len(tag_index_array)
-            dependency_ids.update(ref.id & 0xFFff for ref in tag_refs if
-                                  ref.id & 0xFFff in range(index_len))
+            if dependency_graph is not None:
+                dependency_ids.update(dependency_graph.get_dependencies(tag_id))
+            else:
+                dependency_ids.update(ref.id & 0xFFff for ref in tag_refs if
+                                      ref.id & 0xFFff in range(index_len))
 
             if not do_extract:
                 return False
@@ -1623,19 +2566,24 @@ def extract_tag(self, tag_id, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw):
             error_str = halo_map.extract_tag_data(meta, tag_index_ref, **extract_kw)
             if error_str:
                 raise DataExtractionError(error_str)
+
+            if progress is not None:
+                progress.add_tags_done(1)
             return True
 
         try:
             filepath.parent.mkdir(exist_ok=True, parents=True)
             with filepath.open('r+b' if filepath.is_file() else 'w+b') as f:
                 f.truncate(0)
-                f.write(halo_map.tag_headers[tag_cls])
+                tag_header = halo_map.tag_headers[tag_cls]
+                f.write(tag_header)
                 if is_gen1:
                     with FieldType.force_big:
-                        f.write(meta.serialize(calc_pointers=False))
+                        tag_data = meta.serialize(calc_pointers=False)
                 else:
                     with FieldType.force_normal:
-                        f.write(meta.serialize(calc_pointers=False))
+                        tag_data = meta.serialize(calc_pointers=False)
+                f.write(tag_data)
         except PermissionError:
             raise RefineryError(
                 "Refinery does not have permission to save here. "
@@ -1645,8 +2593,42 @@ def extract_tag(self, tag_id, map_name=ACTIVE_INDEX, engine=ACTIVE_INDEX, **kw):
                 raise
             raise RefineryError("Filepath is over the Windows 260 character limit.")
 
+        if progress is not None:
+            progress.add_tags_done(1, len(tag_header) + len(tag_data))
         return True
 
+    def get_tag_extract_path(self, tag_index_ref, force_lower_case_paths=None):
+        '''
+        Returns the path, relative to the directory being extracted to,
+        that the tag with the given tag index entry is extracted to.
+        '''
+        if force_lower_case_paths is None:
+            force_lower_case_paths = self.force_lower_case_paths
+
+        tag_path = "%s.%s" % (Path(PureWindowsPath(tag_index_ref.path)),
+                              tag_index_ref.class_1.enum_name)
+        return tag_path.lower() if force_lower_case_paths else tag_path
+
+    def get_globals_overwrite(self, halo_map, tag_id):
+        '''
+        Returns whether the globals tag of the given map should overwrite the
+        one already extracted, prompting for it if globals_overwrite_mode
+        says to ask.
+        '''
+        mode = self.globals_overwrite_mode
+        prompt = (mode == 0)
+        overwrite = (mode == 1)
+        map_type = halo_map.map_header.map_type.enum_name
+        if mode == 3 and map_type in ("sp", "ui"):
+            prompt = True
+        elif mode in (3, 4) and map_type == "mp":
+            overwrite = True
+
+        if prompt:
+            overwrite = self.prompt_globals_overwrite(halo_map, tag_id)
+
+        return overwrite
+
     def prompt_globals_overwrite(self, halo_map, tag_id):
         map_name = halo_map.map_name
         tag_name = halo_map.tag_index.tag_index[tag_id & 0xFFff].path
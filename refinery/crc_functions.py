@@ -7,8 +7,9 @@
 # See LICENSE for more information.
 #
 
-import refinery, zlib, gc
+import refinery, zlib
 
+from concurrent.futures import ThreadPoolExecutor
 from random import seed as P, getrandbits as Q
 from traceback import format_exc
 
@@ -66,7 +67,90 @@ def O(l=[0,0,0]):
  while l[1][0]==l[1][-1]:l[1][:]=[l[-1][('pV'""'us''Qe')[4]](31)for w in'#$}{!']
  return (l[1][0]^sum(l[1])^l[1][-1]|_crc)&((1<<32)-1)
 
-def calculate_ce_checksum(file, index_magic):
+# number of bytes handed to the crc function at a time. keeps the
+# amount of memory needed for non-mmap files from scaling with map size
+CRC_WINDOW_SIZE = 4*1024**2
+
+# the reversed crc32 polynomial and x^(2^n) mod p for n in range(32)
+CRC32_POLYNOMIAL = 0xEDB88320
+_X2N_TABLE = [1 << 30]
+
+
+def _multmodp(a, b):
+    # multiply a and b modulo the crc32 polynomial
+    m, p = 1 << 31, 0
+    while m:
+        if a & m:
+            p ^= b
+            if not a & (m - 1):
+                break
+        m >>= 1
+        b = (b >> 1) ^ CRC32_POLYNOMIAL if b & 1 else b >> 1
+    return p
+
+
+for _ in range(31):
+    _X2N_TABLE.append(_multmodp(_X2N_TABLE[-1], _X2N_TABLE[-1]))
+del _
+
+
+def _x2nmodp(n, k):
+    # x^(n * 2^k) modulo the crc32 polynomial
+    p = 1 << 31
+    while n:
+        if n & 1:
+            p = _multmodp(_X2N_TABLE[k & 31], p)
+        n >>= 1
+        k += 1
+    return p
+
+
+def crc32_combine(crc1, crc2, len2):
+    '''
+    Returns the crc32 of two pieces of data joined together, given the
+    crc32 of each piece(both started from 0) and the length of the second.
+    '''
+    if len2 <= 0:
+        return crc1 & 0xFFffFFff
+    return (_multmodp(_x2nmodp(len2, 3), crc1 & 0xFFffFFff) ^ crc2) & 0xFFffFFff
+
+
+def crc32_region(file, offset, size, crc=0, crc32_func=zlib.crc32,
+                 window_size=CRC_WINDOW_SIZE):
+    '''
+    Continues calculating the crc32 of the file over the given region.
+    Reads are done in windows of window_size, using memoryview slices
+    of the file rather than copies if it supports the buffer protocol.
+    '''
+    try:
+        view = memoryview(file)
+    except TypeError:
+        view = None
+
+    if view is None:
+        file.seek(offset)
+        while size > 0:
+            data = file.read(min(size, window_size))
+            if not data:
+                break
+            crc = crc32_func(data, crc)
+            size -= len(data)
+        return crc
+
+    # the view must be released, or mmaps will refuse to close or resize
+    with view:
+        end = min(offset + size, len(view))
+        for off in range(offset, end, window_size):
+            with view[off: min(off + window_size, end)] as window:
+                crc = crc32_func(window, crc)
+    return crc
+
+
+def get_ce_checksum_regions(file, index_magic):
+    '''
+    Returns a list of the (offset, size) of each region of the map that
+    is checksummed, in the order they are checksummed in.
+    '''
     file.seek(16)
     tagdata_offset = int.from_bytes(file.read(4), 'little') ###
     tagdata_size = int.from_bytes(file.read(4), 'little') ###
@@ -92,24 +176,79 @@ def calculate_ce_checksum(file, index_magic):
     bsps_offset += tagdata_offset - index_magic
 
 
-    chunk_offsets = [] ###
-    chunk_sizes = [] ###
-
-
+    regions = []
     file.seek(bsps_offset)
     for i in range(bsp_count):
-        chunk_offsets.append(int.from_bytes(file.read(4), 'little'))
-        chunk_sizes.append(int.from_bytes(file.read(4), 'little'))
+        regions.append((int.from_bytes(file.read(4), 'little'),
+                        int.from_bytes(file.read(4), 'little')))
         file.seek(24, 1)
 
-    chunk_offsets += [modeldata_offset, tagdata_offset]
-    chunk_sizes   += [modeldata_size, tagdata_size]
+    regions.append((modeldata_offset, modeldata_size))
+    regions.append((tagdata_offset, tagdata_size))
+    return [(off, size) for off, size in regions if size]
+
+
+def calculate_region_crcs(file, regions, threads=1, crc32_func=zlib.crc32):
+    '''
+    Returns a dict of the crc32 of each (offset, size) region of the file.
+    If threads is greater than 1, the regions are split into that many
+    pieces which are checksummed in parallel and then combined.
+    crc32_func can be any function with the same signature as zlib.crc32.
+    '''
+    regions = list(set(regions))
+    total_size = sum(size for off, size in regions)
+    try:
+        memoryview(file).release()
+    except TypeError:
+        # can't read different parts of an ordinary file at the same time
+        threads = 1
+
+    if threads <= 1 or total_size < CRC_WINDOW_SIZE * 2:
+        return {(off, size): crc32_region(file, off, size, 0, crc32_func)
+                for off, size in regions}
+
+    # split the regions into roughly evenly sized pieces
+    piece_size = max(CRC_WINDOW_SIZE, -(-total_size // threads))
+    pieces = []
+    for off, size in regions:
+        for piece_off in range(off, off + size, piece_size):
+            pieces.append((piece_off, min(piece_size, off + size - piece_off)))
+
+    # zlib releases the gil while calculating, so threads run in parallel
+    with ThreadPoolExecutor(threads) as executor:
+        piece_crcs = iter(executor.map(
+            lambda piece: crc32_region(file, *piece, 0, crc32_func),
+            pieces))
+
+        region_crcs = {}
+        for off, size in regions:
+            crc = 0
+            for piece_off in range(off, off + size, piece_size):
+                crc = crc32_combine(crc, next(piece_crcs),
+                                    min(piece_size, off + size - piece_off))
+            region_crcs[(off, size)] = crc
+
+    return region_crcs
+
+
+def calculate_ce_checksum(file, index_magic, threads=1,
+                          crc32_func=zlib.crc32, region_crcs=None):
+    '''
+    Calculates the checksum Halo CE would calculate for the map.
+    If region_crcs is provided as a dict, the crc of any region already
+    in it is reused rather than calculated, and the crcs of the regions
+    that are calculated are added to it, keyed by (offset, size).
+    '''
+    regions = get_ce_checksum_regions(file, index_magic)
+    if region_crcs is None:
+        region_crcs = {}
+
+    region_crcs.update(calculate_region_crcs(
+        file, [region for region in regions if region not in region_crcs],
+        threads, crc32_func))
 
     crc = 0
-    for i in range(len(chunk_offsets)):
-        if chunk_sizes[i]:
-            file.seek(chunk_offsets[i])
-            crc = zlib.crc32(file.read(chunk_sizes[i]), crc)
-            gc.collect()
+    for off, size in regions:
+        crc = crc32_combine(crc, region_crcs[(off, size)], size)
 
     return crc ^ 0xFFffFFff
@@ -51,6 +51,9 @@ def get():
         Bit("debug_mode"),
         Bit("do_printout"),
         Bit("autoload_resources"),
+        Bit("use_tag_index_cache"),
+        Bit("lazy_load_resources"),
+        Bit("lazy_explorer_trees"),
         SIZE=4
         ),
     Bool32("extraction_flags",
@@ -72,6 +75,7 @@ def get():
         # upper 16 bits
         "disable_safe_mode",
         "disable_tag_cleaning",
+        "use_dependency_graph",
         ),
     Bool32("deprotection_flags",
         "fix_tag_classes",
@@ -84,6 +88,7 @@ def get():
         "shallow_ui_widget_nesting",
         "rename_cached_tags",
         "print_heuristic_name_changes",
+        "patch_tag_paths_in_place",
         ),
     Bool32("preview_flags",
         "show_all_fields",
@@ -99,8 +104,12 @@ def get():
                GUI_NAME=globals_overwrite_gui_names[i])
           for i in range(len(globals_overwrite_modes)))
         ),
+    # 0 is what older configs have in these, so it means 1 process and
+    # negative means one per cpu
+    SInt8("extract_workers"),
+    SInt8("deprotect_workers"),
 
-    Pad(128 - 48 - 2*1 - 4*2),
+    Pad(128 - 48 - 4*1 - 4*2),
     Timestamp32("date_created", EDITABLE=False),
     Timestamp32("date_modified", EDITABLE=False),
 
@@ -0,0 +1,407 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+import zlib
+
+from struct import Struct as PyStruct, pack, unpack, unpack_from
+from traceback import format_exc
+
+from reclaimer.meta.wrappers.halo1_map import Halo1Map
+from supyr_struct.util import int_to_fourcc
+
+__all__ = ("DependencyGraph", "build_dependency_graph",
+           "can_build_dependency_graph", "get_dependency_graph",
+           "get_dependency_layout", "invalidate_dependency_graph",
+           "update_dependency_graph", )
+
+
+DEPENDENCY_GRAPH_SIG = b"rdep"
+DEPENDENCY_GRAPH_VERSION = 3
+DEPENDENCY_GRAPH_EXT = ".deps"
+
+# sig, version, tag_count, edge count, crc of the tag classes
+_graph_header = PyStruct("<4sH2xIII")
+
+# the tag references and reflexives in the tag references layout
+# of each meta descriptor, keyed by the id of the descriptor
+_dependency_layouts = {}
+
+
+def _contains_tag_refs(desc):
+    if not isinstance(desc, dict) or "TYPE" not in desc:
+        return False
+    elif desc["TYPE"].name == "TagRef":
+        return True
+
+    return any(_contains_tag_refs(desc.get(key)) for key in
+               (*range(desc.get("ENTRIES", 0)), "STEPTREE", "SUB_STRUCT"))
+
+
+def _build_dependency_layout(desc, base_off=0):
+    layout = []
+    if _contains_tag_refs(desc.get("STEPTREE")):
+        raise TypeError("Cannot locate tag references in a steptree.")
+
+    for i in range(desc.get("ENTRIES", 0)):
+        sub_desc = desc[i]
+        type_name = sub_desc["TYPE"].name
+        off = base_off + desc["ATTR_OFFS"][i]
+        if type_name == "TagRef":
+            layout.append(off)
+        elif type_name == "Struct":
+            layout.extend(_build_dependency_layout(sub_desc, off))
+        elif type_name == "Reflexive":
+            sub_struct = sub_desc["STEPTREE"]["SUB_STRUCT"]
+            sub_layout = _build_dependency_layout(sub_struct)
+            if sub_layout:
+                layout.append((off, sub_struct["SIZE"], sub_layout))
+        elif _contains_tag_refs(sub_desc):
+            raise TypeError("Cannot locate tag references in a %s." %
+                            type_name)
+
+    return tuple(layout)
+
+
+def get_dependency_layout(desc):
+    '''
+    Returns the offsets of the tag references in structs described by the
+    given meta descriptor, laid out the same as RAWDATA_REF_LAYOUTS. Tag
+    references inside reflexives are (reflexive offset, struct size,
+    sub layout) tuples. Returns None if the tag references can't be
+    located without parsing the meta.
+    '''
+    cached = _dependency_layouts.get(id(desc))
+    if cached is None:
+        try:
+            layout = _build_dependency_layout(desc)
+        except Exception:
+            layout = None
+        # keep the descriptor so its id can't be reused by another
+        cached = _dependency_layouts[id(desc)] = (desc, layout)
+
+    return cached[1]
+
+
+def _iter_dependency_ids(map_data, struct_ptr, layout, pointer_converter):
+    v_ptr_to_f_ptr = pointer_converter.v_ptr_to_f_ptr
+    map_size = len(map_data)
+    for entry in layout:
+        if not isinstance(entry, tuple):
+            yield unpack_from("<I", map_data,
+                              v_ptr_to_f_ptr(struct_ptr + entry + 12))[0]
+            continue
+
+        refl_off, struct_size, sub_layout = entry
+        count, ptr = unpack_from(
+            "<2I", map_data, v_ptr_to_f_ptr(struct_ptr + refl_off))
+        if not count:
+            continue
+
+        start = v_ptr_to_f_ptr(ptr)
+        if start < 0 or start + count * struct_size > map_size:
+            raise ValueError("Reflexive points outside the map.")
+
+        for sub_ptr in range(ptr, ptr + count * struct_size, struct_size):
+            yield from _iter_dependency_ids(
+                map_data, sub_ptr, sub_layout, pointer_converter)
+
+
+def get_tag_classes_crc(tag_index_array):
+    '''
+    Returns a crc of the classes of every tag in the tag index. The
+    dependencies found depend on the tag classes, so this tells if a
+    cached dependency graph was built with the same classes.
+    '''
+    classes = [ref.class_1.data & 0xFFffFFff for ref in tag_index_array]
+    return zlib.crc32(pack("<%dI" % len(classes), *classes))
+
+
+class DependencyGraph:
+    '''
+    The tags each tag in a map depends on, and the tags that depend on
+    each tag, indexed by tag id. Built once per map so dependencies can
+    be looked up without reading the metas of the tags again.
+    '''
+    tag_count = 0
+    # sorted tuples of the ids of the tags each tag references
+    dependencies = ()
+    # the inverse of dependencies. a set of the ids of the tags that
+    # reference each tag. this is only made once dependents are needed
+    _dependents = None
+
+    def __init__(self, dependencies):
+        self.dependencies = list(map(tuple, dependencies))
+        self.tag_count = len(self.dependencies)
+
+    def get_dependencies(self, tag_id):
+        if tag_id not in range(self.tag_count):
+            return ()
+        return self.dependencies[tag_id]
+
+    def set_dependencies(self, tag_id, dependency_ids):
+        '''
+        Replaces the ids of the tags the given tag references, updating
+        the tags that reference each tag to match.
+        '''
+        dependency_ids = tuple(sorted(set(dependency_ids)))
+        old_dependency_ids = self.dependencies[tag_id]
+        if dependency_ids == old_dependency_ids:
+            return
+
+        self.dependencies[tag_id] = dependency_ids
+        if self._dependents is None:
+            return
+
+        for dep_id in old_dependency_ids:
+            self._dependents[dep_id].discard(tag_id)
+        for dep_id in dependency_ids:
+            self._dependents[dep_id].add(tag_id)
+
+    def get_dependents(self, tag_id, recursive=False):
+        '''
+        Returns a sorted tuple of the ids of the tags that reference
+        the given tag. If recursive is True, tags that reference those
+        tags are included, and so on.
+        '''
+        if self._dependents is None:
+            self._dependents = dependents = [
+                set() for i in range(self.tag_count)]
+            for i, dependency_ids in enumerate(self.dependencies):
+                for dep_id in dependency_ids:
+                    dependents[dep_id].add(i)
+
+        if tag_id not in range(self.tag_count):
+            return ()
+        elif not recursive:
+            return tuple(sorted(self._dependents[tag_id]))
+
+        seen, next_ids = set(), [tag_id]
+        while next_ids:
+            curr_ids, next_ids = next_ids, []
+            for curr_id in curr_ids:
+                for dep_id in self._dependents[curr_id]:
+                    if dep_id not in seen:
+                        seen.add(dep_id)
+                        next_ids.append(dep_id)
+
+        seen.discard(tag_id)
+        return tuple(sorted(seen))
+
+    def get_closure(self, tag_ids, skip=()):
+        '''
+        Returns a list of the given tag ids and every tag they depend on,
+        directly or not, ordered the same as recursive extraction finds
+        them: each layer of dependencies sorted and after the one before.
+        Tags in skip are left out, and their dependencies aren't followed.
+        '''
+        tag_id_range = range(self.tag_count)
+        seen = set(skip)
+        closure, curr_ids = [], set(tag_ids)
+        while curr_ids:
+            layer = sorted(i for i in curr_ids
+                           if i not in seen and i in tag_id_range)
+            seen.update(layer)
+            closure.extend(layer)
+
+            curr_ids = set()
+            for tag_id in layer:
+                curr_ids.update(self.dependencies[tag_id])
+
+        return closure
+
+    def serialize(self, classes_crc):
+        edges = [dep_id for dependency_ids in self.dependencies
+                 for dep_id in dependency_ids]
+        offsets, off = [], 0
+        for dependency_ids in self.dependencies:
+            offsets.append(off)
+            off += len(dependency_ids)
+        offsets.append(off)
+
+        return b"".join((
+            _graph_header.pack(DEPENDENCY_GRAPH_SIG, DEPENDENCY_GRAPH_VERSION,
+                               self.tag_count, len(edges), classes_crc),
+            pack("<%dI" % len(offsets), *offsets),
+            pack("<%dI" % len(edges), *edges),
+            ))
+
+    @classmethod
+    def deserialize(cls, data, tag_count, classes_crc):
+        '''
+        Returns the DependencyGraph serialized in data, or None if it
+        isn't valid or was built for a different tag count or classes.
+        '''
+        try:
+            sig, ver, count, edge_count, crc = _graph_header.unpack_from(data)
+            if (sig != DEPENDENCY_GRAPH_SIG or
+                    ver != DEPENDENCY_GRAPH_VERSION or
+                    count != tag_count or crc != classes_crc):
+                return None
+
+            off = _graph_header.size
+            offsets = unpack("<%dI" % (count + 1),
+                             data[off: off + (count + 1) * 4])
+            off += (count + 1) * 4
+            edges = unpack("<%dI" % edge_count,
+                           data[off: off + edge_count * 4])
+        except Exception:
+            return None
+
+        return cls(edges[offsets[i]: offsets[i + 1]] for i in range(count))
+
+
+def can_build_dependency_graph(halo_map):
+    '''
+    Returns whether the dependencies of the map's tags can be found by
+    reading their tag references where they sit in the map.
+    '''
+    return (isinstance(halo_map, Halo1Map) and not halo_map.is_resource and
+            type(halo_map).get_dependencies is Halo1Map.get_dependencies)
+
+
+def _get_tag_dependency_ids(halo_map, tag_id, meta_cache=None):
+    tag_index = halo_map.tag_index
+    tag_index_ref = tag_index.tag_index[tag_id]
+    if tag_id == tag_index.scenario_tag_id & 0xFFff:
+        tag_cls = "scnr"
+    elif tag_index_ref.class_1.enum_name in ("<INVALID>", "NONE"):
+        return ()
+    else:
+        tag_cls = int_to_fourcc(tag_index_ref.class_1.data)
+
+    desc = halo_map.get_meta_descriptor(tag_cls)
+    if desc is None:
+        return ()
+    elif halo_map.is_indexed(tag_id):
+        if tag_cls != "snd!":
+            # indexed tags other than sounds never have dependencies
+            return ()
+    elif not (halo_map.handler and
+              halo_map.handler.tag_ref_cache.get(tag_cls)):
+        # get_dependencies only finds the tag references the handler
+        # located in the tag definition, so it wouldn't find any
+        return ()
+
+    layout = None
+    if tag_cls != "scnr" and not halo_map.is_indexed(tag_id):
+        # scenarios also reference tags in their scripts, and indexed
+        # sounds need their promotion sound looked up in sounds.map
+        layout = get_dependency_layout(desc)
+
+    if layout is not None:
+        try:
+            return tuple(_iter_dependency_ids(
+                halo_map.map_data, tag_index_ref.meta_offset, layout,
+                halo_map.bsp_pointer_converters.get(
+                    tag_id, halo_map.map_pointer_converter)))
+        except Exception:
+            # the meta is probably malformed. let get_meta handle it
+            pass
+
+    # read the meta the same way extract_tag does, so the dependencies
+    # found are the ones extracting the tag would find
+    if meta_cache is None:
+        meta = halo_map.get_meta(tag_id, True)
+    else:
+        meta = meta_cache.get_meta(halo_map, tag_id, True)
+
+    if not meta:
+        return ()
+
+    return tuple(ref.id for ref in
+                 halo_map.get_dependencies(meta, tag_id, tag_cls))
+
+
+def _find_dependencies(halo_map, tag_id, print_errors=True, meta_cache=None):
+    tag_count = len(halo_map.tag_index.tag_index)
+    dependency_ids = ()
+    try:
+        dependency_ids = _get_tag_dependency_ids(halo_map, tag_id, meta_cache)
+    except Exception:
+        if print_errors:
+            print(format_exc())
+
+    return tuple(sorted(set(
+        dep_id & 0xFFff for dep_id in dependency_ids
+        if (dep_id & 0xFFff) in range(tag_count) and
+        (dep_id & 0xFFff) != tag_id)))
+
+
+def build_dependency_graph(halo_map, print_errors=True, meta_cache=None):
+    '''
+    Builds a DependencyGraph of the tags in the given map. Tag references
+    are read straight from the map where their location can be worked out
+    from the tag definitions, and by parsing the tag's meta otherwise.
+    Metas are read through meta_cache if one is given.
+    '''
+    return DependencyGraph(
+        _find_dependencies(halo_map, tag_id, print_errors, meta_cache)
+        for tag_id in range(len(halo_map.tag_index.tag_index)))
+
+
+def get_dependency_graph(halo_map, tag_index_cache=None, meta_cache=None):
+    '''
+    Returns the DependencyGraph of the given map, building it if the map
+    doesn't have one yet. If a TagIndexCache is given, the graph is read
+    from it if it's cached there, and cached there after it's built.
+    Returns None if a graph can't be built for this kind of map.
+    '''
+    graph = getattr(halo_map, "dependency_graph", None)
+    if graph is not None or not can_build_dependency_graph(halo_map):
+        return graph
+
+    tag_index_array = halo_map.tag_index.tag_index
+    classes_crc = get_tag_classes_crc(tag_index_array)
+    if tag_index_cache is not None:
+        data = tag_index_cache.get_cache_data(
+            halo_map.filepath, DEPENDENCY_GRAPH_EXT)
+        if data:
+            graph = DependencyGraph.deserialize(
+                data, len(tag_index_array), classes_crc)
+
+    if graph is None:
+        graph = build_dependency_graph(halo_map, meta_cache=meta_cache)
+        if tag_index_cache is not None:
+            try:
+                tag_index_cache.put_cache_data(
+                    halo_map.filepath, DEPENDENCY_GRAPH_EXT,
+                    graph.serialize(classes_crc))
+            except Exception:
+                print(format_exc())
+
+    halo_map.dependency_graph = graph
+    return graph
+
+
+def update_dependency_graph(halo_map, tag_ids):
+    '''
+    Finds the dependencies of the given tags again and updates the
+    map's DependencyGraph with them, if the map has one. Call this
+    after re-classing tags or changing their tag references. Renaming
+    tags needs no update, as the graph only stores tag ids.
+    '''
+    graph = getattr(halo_map, "dependency_graph", None)
+    if graph is None:
+        return
+    elif graph.tag_count != len(halo_map.tag_index.tag_index):
+        halo_map.dependency_graph = None
+        return
+
+    for tag_id in tag_ids:
+        if tag_id in range(graph.tag_count):
+            graph.set_dependencies(
+                tag_id, _find_dependencies(halo_map, tag_id))
+
+
+def invalidate_dependency_graph(halo_map):
+    '''
+    Drops the DependencyGraph of the given map.
+    '''
+    if halo_map is not None:
+        halo_map.dependency_graph = None
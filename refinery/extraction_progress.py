@@ -0,0 +1,148 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+from threading import Event, Lock
+from time import time
+
+__all__ = ("ExtractionProgress", "format_byte_count", "format_duration", )
+
+
+def format_byte_count(byte_count):
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if byte_count < 1024 or unit == "GB":
+            break
+        byte_count /= 1024
+
+    if unit == "bytes":
+        return "%d %s" % (byte_count, unit)
+    return "%.1f %s" % (byte_count, unit)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, (seconds // 60) % 60,
+                             seconds % 60)
+
+
+class ExtractionProgress:
+    '''
+    Tracks how far along processing the extraction queue is, so it can
+    be shown by another thread than the one processing the queue. Every
+    method can be called from any thread.
+
+    The estimated time left assumes each remaining queue item will take
+    as long as the average item so far, and that each tag in the current
+    item takes as long as the ones before it.
+    '''
+    start_time = 0.0
+    items_total = 0
+    items_done = 0
+    tags_done = 0
+    bytes_written = 0
+    current_item = ""
+    current_tag = ""
+
+    # the number of tags found to extract for the current queue item, and
+    # how many of them are done. recursive extractions add to the total
+    # as the dependencies of each layer of tags are found
+    item_tags_total = 0
+    item_tags_done = 0
+
+    def __init__(self):
+        self._lock = Lock()
+        self._cancelled = Event()
+        self.start_time = time()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def start(self, items_total):
+        with self._lock:
+            self.start_time = time()
+            self.items_total = items_total
+            self.items_done = 0
+
+    def start_item(self, item_name):
+        with self._lock:
+            self.current_item = item_name
+            self.current_tag = ""
+            self.item_tags_total = self.item_tags_done = 0
+
+    def finish_item(self):
+        with self._lock:
+            self.items_done += 1
+            self.current_item = self.current_tag = ""
+            self.item_tags_total = self.item_tags_done = 0
+
+    def add_tags_total(self, tag_count):
+        with self._lock:
+            self.item_tags_total += tag_count
+
+    def set_current_tag(self, tag_path):
+        self.current_tag = tag_path
+
+    def add_tags_done(self, tag_count=1, byte_count=0):
+        with self._lock:
+            self.tags_done += tag_count
+            self.item_tags_done += tag_count
+            self.bytes_written += byte_count
+
+    def add_bytes_written(self, byte_count):
+        with self._lock:
+            self.bytes_written += byte_count
+
+    def get_fraction_done(self):
+        with self._lock:
+            if self.items_total <= 0:
+                return 0.0
+
+            items_done = self.items_done
+            if self.item_tags_total > 0:
+                items_done += min(
+                    1.0, self.item_tags_done / self.item_tags_total)
+
+            return min(1.0, items_done / self.items_total)
+
+    def get_time_left(self):
+        '''
+        Returns the estimated number of seconds until the queue is done,
+        or None if too little of it is done to tell.
+        '''
+        fraction_done = self.get_fraction_done()
+        if fraction_done <= 0:
+            return None
+        return (time() - self.start_time) * (1 - fraction_done) / fraction_done
+
+    def get_status_string(self):
+        with self._lock:
+            status = "%s tags, %s written" % (
+                self.tags_done, format_byte_count(self.bytes_written))
+            if self.current_item:
+                status = "Item %s of %s: %s | %s" % (
+                    min(self.items_done + 1, self.items_total),
+                    self.items_total, self.current_item, status)
+            current_tag = self.current_tag
+
+        time_left = self.get_time_left()
+        if time_left is not None:
+            status += " | %s left" % format_duration(time_left)
+        if current_tag:
+            status += " | %s" % current_tag
+
+        return status
+
+    def get_summary_string(self):
+        return "%s %s tags(%s) in %s" % (
+            "Cancelled after extracting" if self.cancelled else "Extracted",
+            self.tags_done, format_byte_count(self.bytes_written),
+            format_duration(time() - self.start_time))
@@ -7,6 +7,6 @@
 # See LICENSE for more information.
 #
 
-from refinery.heuristic_deprotection import constants, functions, util
+from refinery.heuristic_deprotection import constants, functions, util, worklist
 
-__all__ = ("constants", "functions", "util")
+__all__ = ("constants", "functions", "util", "worklist")
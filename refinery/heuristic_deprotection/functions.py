@@ -31,8 +31,13 @@ def heuristic_deprotect(tag_id, halo_map, tag_path_handler,
 
     min_priority = MinPriority()
     curr_min_prio = tag_path_handler.get_priority_min(tag_index_id)
-    if tag_index_id in seen or kw["depth"] < 0:
-        # do nothing if tag already seen or already at max depth
+    if tag_index_id in seen:
+        # do nothing if tag already seen. anything above this
+        # that led back here depends on this being skipped
+        tag_path_handler.mark_subtree_cycle(tag_index_id)
+        return curr_min_prio
+    elif kw["depth"] < 0:
+        # do nothing if already at max depth
         return curr_min_prio
     elif kw.get("use_minimum_priorities") and (priority is not None and
                                                curr_min_prio > priority):
@@ -40,26 +45,59 @@ def heuristic_deprotect(tag_id, halo_map, tag_path_handler,
         # of any tag referenced by this tag or its dependencies
         return curr_min_prio
 
+    # if this subtree was already walked with these same arguments and
+    # nothing in it has changed since, walking it again would do nothing
+    memo_key = get_subtree_memo_key(
+        tag_index_id, root_dir, sub_dir, name, kw)
+    if memo_key is not None:
+        memo_prio = tag_path_handler.get_subtree_memo(memo_key, seen)
+        if memo_prio is not None:
+            return memo_prio
+
     kw.update(depth=kw["depth"] - 1, min_priority=min_priority)
     seen.add(tag_index_id)
+    tag_path_handler.begin_subtree_memo(tag_index_id)
+    try:
+        rename_func = recursive_rename_functions.get(
+            halo_map.tag_index.tag_index[tag_index_id].class_1.enum_name)
+        if rename_func:
+            try:
+                rename_func(tag_id, halo_map, tag_path_handler,
+                            root_dir, sub_dir, name, **kw)
+            except Exception:
+                print(format_exc())
+        else:
+            min_priority.val = tag_path_handler.set_path_by_priority(
+                tag_id, root_dir + sub_dir + name, priority,
+                kw.get("override"), kw.get("do_printout"))
+
+        # remove the tag_id so this tag can be revisited by higher up references
+        seen.remove(tag_index_id)
+        tag_path_handler.set_priority_min(tag_index_id, min_priority.val)
+    except BaseException:
+        # don't memoize a walk that didn't finish
+        tag_path_handler.end_subtree_memo(None, min_priority.val)
+        raise
+
+    tag_path_handler.end_subtree_memo(memo_key, min_priority.val)
+    return min_priority.val
 
-    rename_func = recursive_rename_functions.get(
-        halo_map.tag_index.tag_index[tag_index_id].class_1.enum_name)
-    if rename_func:
-        try:
-            rename_func(tag_id, halo_map, tag_path_handler,
-                        root_dir, sub_dir, name, **kw)
-        except Exception:
-            print(format_exc())
-    else:
-        min_priority.val = tag_path_handler.set_path_by_priority(
-            tag_id, root_dir + sub_dir + name, priority,
-            kw.get("override"), kw.get("do_printout"))
 
-    # remove the tag_id so this tag can be revisited by higher up references
-    seen.remove(tag_index_id)
-    tag_path_handler.set_priority_min(tag_index_id, min_priority.val)
-    return min_priority.val
+def get_subtree_memo_key(tag_index_id, root_dir, sub_dir, name, kw):
+    '''
+    Returns a key for memoizing a heuristic_deprotect call with these
+    arguments, or None if the arguments can't be used as a key.
+    '''
+    # seen and min_priority are per-call bookkeeping, and do_printout
+    # only decides if changes are printed, so none affect the result
+    key = (tag_index_id, root_dir, sub_dir, name, tuple(sorted(
+        (k, v) for k, v in kw.items()
+        if k not in ("seen", "min_priority", "do_printout"))))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
 
 
 def rename_scnr(tag_id, halo_map, tag_path_handler,
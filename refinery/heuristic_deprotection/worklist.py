@@ -0,0 +1,162 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+from heapq import heappush, heappop
+
+from refinery.constants import INF
+
+__all__ = ("HeuristicWorklist", "MAX_HEURISTIC_VISITS", )
+
+# the most times any one tag will be started from. this keeps tags
+# whose names keep changing each other from being revisited forever
+MAX_HEURISTIC_VISITS = 3
+
+
+class HeuristicWorklist:
+    '''
+    Tags to start heuristic deprotection from, visited in descending
+    order of scheduling priority, then rename priority, then tag id.
+
+    Tags can be revisited once their path or the paths of the tags they
+    depend on, directly or not, are changed by visiting another tag, but
+    only if their own path could still be improved on, they aren't already
+    waiting to be visited, and they haven't been visited max_visits times
+    already. Revisits are never scheduled ahead of the tag last visited,
+    so tags are still visited in passes of descending scheduling priority.
+
+    Without a dependency graph, each revisitable tag is revisited once,
+    after the first change made since it was last visited.
+    '''
+    path_handler = None
+    dependency_graph = None
+    max_visits = MAX_HEURISTIC_VISITS
+
+    # number of times each tag was visited
+    visits = None
+    # the depth each waiting tag will be visited to, keyed by tag id
+    _pending = None
+    _heap = None
+    # maps the tags that may be revisited to the scheduling
+    # priority and depth to revisit them at
+    _revisitable = None
+    _path_changes_seen = 0
+    _last_visited = None
+    _last_sched_priority = INF
+
+    def __init__(self, path_handler, dependency_graph=None,
+                 max_visits=MAX_HEURISTIC_VISITS):
+        self.path_handler = path_handler
+        self.dependency_graph = dependency_graph
+        self.max_visits = max_visits
+        self.visits = {}
+        self._pending = {}
+        self._heap = []
+        self._revisitable = {}
+        self._path_changes_seen = path_handler.get_path_change_count()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def push(self, tag_id, sched_priority, depth=INF):
+        '''
+        Adds the tag to be visited. Does nothing if the tag is already
+        waiting to be visited, or has been visited too many times.
+        depth may be a function to call with the tag id when the
+        tag is popped to decide the depth to visit it to.
+        '''
+        if (tag_id in self._pending or
+                self.visits.get(tag_id, 0) >= self.max_visits):
+            return False
+
+        self._pending[tag_id] = depth
+        heappush(self._heap, (-sched_priority,
+                              -self.path_handler.get_priority(tag_id),
+                              tag_id))
+        return True
+
+    def pop(self):
+        '''
+        Returns the tag id, depth and scheduling priority of the next tag
+        to visit, and counts the visit. Any tags depending on tags whose
+        paths have changed since the last pop are scheduled to be revisited
+        first.
+        '''
+        self.schedule_revisits()
+        sched_priority, _, tag_id = heappop(self._heap)
+        depth = self._pending.pop(tag_id)
+        if callable(depth):
+            depth = depth(tag_id)
+
+        self.visits[tag_id] = self.visits.get(tag_id, 0) + 1
+        self._last_visited = tag_id
+        self._last_sched_priority = -sched_priority
+        return tag_id, depth, -sched_priority
+
+    def set_revisitable(self, tag_id, sched_priority, depth=INF):
+        '''
+        Allows the tag to be revisited at the given scheduling priority
+        and depth once it or any tag it depends on is renamed.
+        '''
+        self._revisitable[tag_id] = (sched_priority, depth)
+
+    def schedule_revisits(self):
+        '''
+        Schedules revisiting the revisitable tags that were renamed, or
+        that depend on tags that were renamed, since this was last called.
+        '''
+        path_handler = self.path_handler
+        changed = path_handler.get_path_changes(self._path_changes_seen)
+        self._path_changes_seen += len(changed)
+        if not changed or not self._revisitable:
+            return
+
+        dependency_graph = self.dependency_graph
+        if dependency_graph is None:
+            # dependencies aren't known, so anything might have changed
+            dependent_ids = set(self._revisitable)
+        else:
+            # renaming a tag can change the names given to anything that
+            # depends on it, so follow the dependents all the way up
+            dependent_ids = set(changed)
+            next_ids = list(dependent_ids)
+            while next_ids:
+                for dep_id in dependency_graph.get_dependents(next_ids.pop()):
+                    if dep_id not in dependent_ids:
+                        dependent_ids.add(dep_id)
+                        next_ids.append(dep_id)
+
+        # the tag just visited made these changes itself, so
+        # visiting it again wouldn't find anything new
+        dependent_ids.discard(self._last_visited)
+        for tag_id in sorted(dependent_ids):
+            revisit = self._revisitable.get(tag_id)
+            if (revisit is None or tag_id in self._pending or
+                    path_handler.get_priority(tag_id) >= INF or
+                    revisit[0] > self._last_sched_priority):
+                # not revisitable, already waiting, can't be improved,
+                # or its pass has already been finished
+                continue
+
+            sched_priority, depth = revisit
+            if (self.push(tag_id, sched_priority, depth) and
+                    dependency_graph is None):
+                del self._revisitable[tag_id]
+
+    def get_visits_string(self):
+        '''
+        Returns a summary of how many tags were visited how many times.
+        '''
+        counts = {}
+        for visits in self.visits.values():
+            counts[visits] = counts.get(visits, 0) + 1
+
+        return "Visited %s tags %s times in total (%s)" % (
+            len(self.visits), sum(self.visits.values()),
+            ", ".join("%s tags %s times" % (counts[visits], visits)
+                      for visits in sorted(counts)))
@@ -0,0 +1,122 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+from pathlib import Path
+from traceback import format_exc
+
+__all__ = ("LazyResourceMap", "register_lazy_resource_maps", )
+
+
+class LazyResourceMap:
+    '''
+    Stands in for a resource map in a map collection until something
+    needs more from it than its name and filepath. At that point the
+    resource map is loaded and replaces this in the map collection, and
+    the attribute is fetched from it.
+    '''
+    is_resource = True
+    map_name = ""
+    engine = ""
+    filepath = decomp_filepath = Path("")
+    maps = None
+    resource_map_class = None
+    load_kwargs = None
+
+    def __init__(self, maps, map_name, filepath, resource_map_class,
+                 engine, **kwargs):
+        self.maps = maps
+        self.map_name = map_name
+        self.filepath = self.decomp_filepath = Path(filepath)
+        self.resource_map_class = resource_map_class
+        self.engine = engine
+        self.load_kwargs = kwargs
+        maps[map_name] = self
+
+    def __getattr__(self, attr_name):
+        # only called for attributes this class doesn't define
+        rsrc_map = self.load()
+        if rsrc_map is None:
+            raise AttributeError(
+                "%s.map could not be loaded from '%s'" %
+                (self.map_name, self.filepath))
+
+        return getattr(rsrc_map, attr_name)
+
+    @property
+    def is_loaded(self):
+        return self.maps.get(self.map_name) is not self
+
+    def load(self):
+        '''
+        Loads the resource map and puts it in the map collection in place
+        of this. Returns the loaded map, or None if it couldn't be loaded.
+        '''
+        maps = self.maps
+        if self.is_loaded:
+            rsrc_map = maps.get(self.map_name)
+            return None if isinstance(rsrc_map, LazyResourceMap) else rsrc_map
+
+        do_printout = self.load_kwargs.get("do_printout", False)
+        maps.pop(self.map_name, None)
+        new_map = None
+        try:
+            new_map = self.resource_map_class(maps)
+            if do_printout:
+                print("Loading %s..." % self.map_name)
+
+            new_map.load_map(self.filepath, **self.load_kwargs)
+            if new_map.engine != self.engine:
+                if do_printout:
+                    print("Incorrect engine for this map.")
+                maps.pop(new_map.map_name, None)
+        except Exception:
+            if do_printout:
+                print(format_exc())
+
+            # make sure to clear out any potentially bad maps
+            for name in sorted(maps):
+                if maps[name] is new_map:
+                    maps.pop(name, None)
+
+        return maps.get(self.map_name)
+
+    # these are called on every map in a collection, so they're
+    # defined here to keep them from loading the resource map.
+    def unload_map(self):
+        if not self.is_loaded:
+            self.maps.pop(self.map_name, None)
+
+    def clear_map_cache(self):
+        pass
+
+    def ensure_sound_maps_valid(self):
+        # resource maps dont have sounds to map to the sounds.map
+        pass
+
+
+def register_lazy_resource_maps(halo_map, maps_dir="", map_paths=(), **kw):
+    '''
+    Puts a LazyResourceMap in the map's collection for each resource map
+    it uses that can be found and isn't already loaded. Returns the names
+    of the resource maps that couldn't be found.
+    '''
+    detected_map_paths = halo_map.get_resource_map_paths(maps_dir)
+    if isinstance(map_paths, dict):
+        for name in detected_map_paths:
+            if name in map_paths:
+                detected_map_paths[name] = map_paths[name]
+
+    maps = halo_map.maps
+    for map_name in sorted(detected_map_paths):
+        map_path = detected_map_paths[map_name]
+        if maps.get(map_name) is None and map_path:
+            LazyResourceMap(maps, map_name, map_path,
+                            halo_map.resource_map_class, halo_map.engine, **kw)
+
+    return set(name for name in detected_map_paths if not maps.get(name))
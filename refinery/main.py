@@ -13,9 +13,11 @@
 import sys
 import webbrowser
 
-from refinery.core import RefineryCore
+from refinery.core import RefineryCore, get_tag_path_string_slack
 
 from pathlib import Path
+from queue import Empty, Queue
+from threading import Event, Thread, current_thread, main_thread
 from time import time
 from tkinter import messagebox
 from traceback import format_exc
@@ -30,6 +32,7 @@
 from refinery.constants import ACTIVE_INDEX, MAP_TYPE_ANY,\
      MAP_TYPE_REGULAR, MAP_TYPE_RESOURCE
 from refinery.exceptions import MapAlreadyLoadedError, EngineDetectionError
+from refinery.extraction_progress import ExtractionProgress
 from refinery.defs.config_def import config_def, bitmap_file_formats
 from refinery.widgets.explorer_hierarchy_tree import ExplorerHierarchyTree
 from refinery.widgets.explorer_class_tree import ExplorerClassTree
@@ -47,6 +50,10 @@
 VALID_DISPLAY_MODES = frozenset(("hierarchy", "class", "hybrid"))
 VALID_EXTRACT_MODES = frozenset(("tags", "data"))
 
+# how many milliseconds to wait between updating the extraction
+# progress and running the calls the extraction thread is waiting on
+EXTRACTION_POLL_INTERVAL = 100
+
 
 class Refinery(tk.Tk, BinillaWidget, RefineryCore):
     config_file = None
@@ -76,6 +83,13 @@ class Refinery(tk.Tk, BinillaWidget, RefineryCore):
     class_tree     = None
 
     _running = False
+    # the thread processing the extraction queue
+    extraction_thread = None
+    # the values of the tkinter settings variables when the extraction
+    # started, so the extraction thread doesn't need to read them
+    _tk_var_values = None
+    # calls the extraction thread needs made on the main thread
+    _ui_calls = None
     _initialized = False
     _window_geometry_initialized = False
     _display_mode = "hierarchy"
@@ -109,6 +123,7 @@ def __init__(self, *args, **kwargs):
         self.print_errors = self.do_printout = True
 
         tk.Tk.__init__(self, *args, **kwargs)
+        self._ui_calls = Queue()
         self._tags_dir = tk.StringVar(self)
         self._data_dir = tk.StringVar(self)
         self._tagslist_path = tk.StringVar(self)
@@ -144,6 +159,9 @@ def __init__(self, *args, **kwargs):
         self._active_engine_name = tk.StringVar(self)
 
         self._autoload_resources = tk.IntVar(self, 1)
+        self._use_tag_index_cache = tk.IntVar(self)
+        self._lazy_load_resources = tk.IntVar(self)
+        self._lazy_explorer_trees = tk.IntVar(self)
         self._do_printout  = tk.IntVar(self, 1)
 
         self._force_lower_case_paths = tk.IntVar(self, 1)
@@ -160,7 +178,10 @@ def __init__(self, *args, **kwargs):
         self._skip_seen_tags_during_queue_processing = tk.IntVar(self, 1)
         self._disable_safe_mode = tk.IntVar(self, 0)
         self._disable_tag_cleaning = tk.IntVar(self, 0)
+        self._use_dependency_graph = tk.IntVar(self, 0)
         self._globals_overwrite_mode = tk.IntVar(self, 0)
+        self._extract_workers = tk.IntVar(self, 1)
+        self._deprotect_workers = tk.IntVar(self, 1)
 
         self._bitmap_extract_format = tk.StringVar(self)
 
@@ -174,6 +195,7 @@ def __init__(self, *args, **kwargs):
         self._shallow_ui_widget_nesting = tk.IntVar(self, 1)
         self._rename_cached_tags = tk.IntVar(self, 1)
         self._print_heuristic_name_changes = tk.IntVar(self)
+        self._patch_tag_paths_in_place = tk.IntVar(self)
 
         self.tk_vars = dict(
             extract_mode=self.extract_mode,
@@ -188,6 +210,9 @@ def __init__(self, *args, **kwargs):
 
             do_printout=self._do_printout,
             autoload_resources=self._autoload_resources,
+            use_tag_index_cache=self._use_tag_index_cache,
+            lazy_load_resources=self._lazy_load_resources,
+            lazy_explorer_trees=self._lazy_explorer_trees,
 
             force_lower_case_paths=self._force_lower_case_paths,
             extract_yelo_cheape=self._extract_yelo_cheape,
@@ -203,7 +228,10 @@ def __init__(self, *args, **kwargs):
             skip_seen_tags_during_queue_processing=self._skip_seen_tags_during_queue_processing,
             disable_safe_mode=self._disable_safe_mode,
             disable_tag_cleaning=self._disable_tag_cleaning,
+            use_dependency_graph=self._use_dependency_graph,
             globals_overwrite_mode=self._globals_overwrite_mode,
+            extract_workers=self._extract_workers,
+            deprotect_workers=self._deprotect_workers,
 
             bitmap_extract_format=self._bitmap_extract_format,
 
@@ -217,6 +245,7 @@ def __init__(self, *args, **kwargs):
             shallow_ui_widget_nesting=self._shallow_ui_widget_nesting,
             rename_cached_tags=self._rename_cached_tags,
             print_heuristic_name_changes=self._print_heuristic_name_changes,
+            patch_tag_paths_in_place=self._patch_tag_paths_in_place,
             )
 
         if self.config_file is not None:
@@ -333,10 +362,14 @@ def __init__(self, *args, **kwargs):
             command=self.deprotect_all)
         self.deprotect_button = tk.Button(
             self.map_action_frame, text="Deprotect current",
-            command=self.deprotect)
+            command=self.deprotect_clicked)
         self.begin_button = tk.Button(
             self.map_action_frame, text="Run extraction",
             command=self.start_extraction)
+        self.cancel_button = tk.Button(
+            self.map_action_frame, text="Cancel extraction",
+            command=self.cancel_extraction, state='disabled')
+        self.extraction_status_label = tk.Label(self.queue_frame, anchor='w')
 
 
         self.add_button = tk.Button(
@@ -354,14 +387,15 @@ def __init__(self, *args, **kwargs):
 
         self.engine_select_menu = ScrollMenu(
             self.map_action_frame, str_variable=self._active_engine_name,
-            callback=self.set_active_engine, menu_width=15)
+            callback=self.select_active_engine, menu_width=15)
         self.map_select_menu = ScrollMenu(
             self.map_action_frame, str_variable=self._active_map_name,
-            callback=self.set_active_map, menu_width=15)
+            callback=self.select_active_map, menu_width=15)
         self.reload_engine_select_options()
         self.reload_map_select_options()
 
         # pack everything
+        self.cancel_button.pack(side='right', padx=4, pady=4)
         self.begin_button.pack(side='right', padx=4, pady=4)
         self.deprotect_button.pack(side='right', padx=4, pady=4)
         self.deprotect_all_button.pack(side='right', padx=4, pady=4)
@@ -380,6 +414,7 @@ def __init__(self, *args, **kwargs):
 
         self.explorer_frame.pack(fill='both', padx=1, expand=True)
         self.add_del_frame.pack(fill='y', side='right', anchor='center')
+        self.extraction_status_label.pack(fill='x', side='bottom', padx=2)
         self.queue_tree.pack(fill='both', side='right', expand=True)
         self.queue_frame.pack(fill='both', padx=1, expand=True)
 
@@ -471,7 +506,11 @@ def __getattribute__(self, attr_name):
         # tkinter settings variables if I didn't overload __getattribute__
         try:
             if attr_name in object.__getattribute__(self, "tk_vars",):
-                val = object.__getattribute__(self, "_" + attr_name).get()
+                tk_var_values = object.__getattribute__(self, "_tk_var_values")
+                if tk_var_values is not None:
+                    val = tk_var_values[attr_name]
+                else:
+                    val = object.__getattribute__(self, "_" + attr_name).get()
                 if attr_name in self.path_property_names:
                     val = Path(val)
 
@@ -539,7 +578,9 @@ def apply_config(self):
         self.last_dir = paths.last_dir.path
 
         self._display_mode = header.flags.display_mode.enum_name
-        for name in ("do_printout", "autoload_resources"):
+        for name in ("do_printout", "autoload_resources",
+                     "use_tag_index_cache", "lazy_load_resources",
+                     "lazy_explorer_trees"):
             setattr(self, name, bool(getattr(header.flags, name)))
 
         for attr_name in header.preview_flags.NAME_MAP:
@@ -564,6 +605,10 @@ def apply_config(self):
         if header.globals_overwrite_mode.enum_name == supyr_constants.INVALID:
             self.globals_overwrite_mode = 0
 
+        for name in ("extract_workers", "deprotect_workers"):
+            workers = getattr(header, name)
+            setattr(self, name, 0 if workers < 0 else max(1, workers))
+
         for i in range(len(fonts)):
             try:
                 self.set_font_config(
@@ -604,7 +649,9 @@ def update_config(self, config_file=None):
         paths.last_dir.path = "" if is_path_empty(self.last_dir) else str(self.last_dir)
 
         header.flags.display_mode.set_to(self._display_mode)
-        for attr_name in ("do_printout", "autoload_resources"):
+        for attr_name in ("do_printout", "autoload_resources",
+                          "use_tag_index_cache", "lazy_load_resources",
+                          "lazy_explorer_trees"):
             setattr(header.flags, attr_name, getattr(self, attr_name))
 
         for attr_name in header.preview_flags.NAME_MAP:
@@ -624,6 +671,10 @@ def update_config(self, config_file=None):
         if header.globals_overwrite_mode.enum_name == supyr_constants.INVALID:
             header.globals_overwrite_mode.data = 0
 
+        for name in ("extract_workers", "deprotect_workers"):
+            workers = getattr(self, name)
+            setattr(header, name, -1 if workers < 1 else min(workers, 127))
+
         try:
             active_tree = self.tree_frames[self._display_mode + "_tree"]
             tree = active_tree.tags_tree
@@ -799,6 +850,9 @@ def show_checksum_edit(self, e=None):
         self.place_window_relative(self.checksum_window)
 
     def destroy(self, e=None):
+        if self.extraction_progress is not None:
+            self.extraction_progress.cancel()
+
         self._running = False
         self.unload_maps(None, None, None)
         FieldType.force_normal()
@@ -843,7 +897,7 @@ def queue_add_all(self, e=None):
         tree_frame.activate_all()
 
     def queue_add_all_maps(self, e=None):
-        if not self.map_loaded:
+        if not self.map_loaded or self.running:
             return
 
         # Store the current map for convinience.
@@ -867,7 +921,7 @@ def queue_add_all_maps(self, e=None):
         self.set_active_map(name_or_index=starting_map)
 
     def queue_del_all(self, e=None):
-        if not self.map_loaded:
+        if not self.map_loaded or self.running:
             return
 
         ans = messagebox.askyesno(
@@ -879,6 +933,22 @@ def queue_del_all(self, e=None):
 
         self.queue_tree.remove_items()
 
+    def select_active_engine(self, name_or_index=None):
+        if self.running:
+            # the extraction thread is using the maps, so put the
+            # menu back to the engine that's still active
+            self.reload_engine_select_options()
+            return
+
+        self.set_active_engine(name_or_index)
+
+    def select_active_map(self, name_or_index=None):
+        if self.running:
+            self.reload_map_select_options()
+            return
+
+        self.set_active_map(name_or_index)
+
     def set_active_engine(self, name_or_index=None, map_name=None,
                           force_reload=False):
         engine = None
@@ -997,11 +1067,14 @@ def unload_maps(self, map_type=False, engines_to_unload=(ACTIVE_INDEX, ),
 
     def load_map(self, map_path, make_active=True, ask_close_open=False, **kw):
         autoload_resources = kw.pop("autoload_resources", self.autoload_resources)
+        # the map may have already been read by read_maps
+        halo_map = kw.pop("halo_map", None)
         new_map = prev_active_engine = prev_active_map = None
         try:
             new_map = RefineryCore.load_map(
                 self, map_path, not ask_close_open, make_active=False,
-                autoload_resources=False, decompress_overwrite=True)
+                autoload_resources=False, decompress_overwrite=True,
+                halo_map=halo_map)
         except MapAlreadyLoadedError:
             if not(ask_close_open and messagebox.askyesno(
                     "A map with that name is already loaded!",
@@ -1009,13 +1082,14 @@ def load_map(self, map_path, make_active=True, ask_close_open=False, **kw):
                      "Close that map and load this one instead?") %
                     Path(map_path).stem, icon='warning', parent=self)):
                 print("    Skipped")
+                self.discard_read_map(halo_map)
                 return
 
             prev_active_engine = self.active_engine_name
             prev_active_map = self.active_map_name
             new_map = RefineryCore.load_map(
                 self, map_path, True, make_active=False,
-                autoload_resources=False)
+                autoload_resources=False, halo_map=halo_map)
 
             if (new_map.engine == prev_active_engine and
                 new_map.map_name == prev_active_map):
@@ -1024,6 +1098,7 @@ def load_map(self, map_path, make_active=True, ask_close_open=False, **kw):
                 make_active = True
         except Exception:
             try:
+                self.discard_read_map(halo_map)
                 self.unload_maps(None)
             except Exception:
                 print(format_exc())
@@ -1043,9 +1118,15 @@ def load_maps(self, map_paths, make_active=False, ask_close_open=False, **kw):
             return
 
         first_map = None
-        for map_path in map_paths:
+        # read the maps up front, on several threads if load_workers allows
+        for map_path, halo_map, error in self.read_maps(
+                map_paths, decompress_overwrite=True):
             try:
-                new_map = self.load_map(map_path, False, ask_close_open, **kw)
+                if error is not None:
+                    raise error
+
+                new_map = self.load_map(map_path, False, ask_close_open,
+                                        halo_map=halo_map, **kw)
 
                 if new_map is not None and first_map is None:
                     first_map = new_map
@@ -1157,8 +1238,50 @@ def deprotect_all(self):
         except Exception:
             print(format_exc())
 
+        try:
+            # maps deprotected in worker processes are unloaded and then
+            # loaded again, so nothing can keep using the old ones
+            self.reload_engine_select_options()
+            self.reload_queue_maps()
+            self.reload_explorers()
+        except Exception:
+            print(format_exc())
+
         self._running = False
 
+    def reload_queue_maps(self):
+        '''
+        Points queue items at the currently loaded map with the same engine
+        and name as the map they were queued from, in case it was reloaded.
+        Items whose map is no longer loaded are removed from the queue.
+        '''
+        for queue_item_iid in self.queue_tree.get_item_names():
+            settings = self.queue_tree.get_item(queue_item_iid)
+            old_map = settings.get('halo_map')
+            if old_map is None:
+                continue
+
+            new_map = self._maps_by_engine.get(old_map.engine, {}).get(
+                old_map.map_name)
+            if new_map is old_map:
+                continue
+            elif new_map is None:
+                self.queue_tree.remove_items(queue_item_iid)
+                continue
+
+            tag_index_array = new_map.tag_index.tag_index
+            settings['halo_map'] = new_map
+            settings['tag_index_refs'] = [
+                tag_index_array[b.id & 0xFFff] for b in
+                settings['tag_index_refs']
+                if (b.id & 0xFFff) in range(len(tag_index_array))]
+
+    def deprotect_clicked(self):
+        if self.running:
+            return
+
+        self.deprotect()
+
     def deprotect(self, save_path=None, map_name=ACTIVE_INDEX,
                   engine=ACTIVE_INDEX, **kw):
         halo_map = self._maps_by_engine.get(engine, {}).get(map_name)
@@ -1328,9 +1451,19 @@ def save_map(self, save_path=None, map_name=ACTIVE_INDEX,
 
         orig_tag_paths = halo_map.orig_tag_paths
         index_array    = halo_map.tag_index.STEPTREE
+        changed_tag_ids = [
+            i for i in range(len(index_array))
+            if orig_tag_paths[i].lower() != index_array[i].path.lower()]
+
+        patched_offs = {}
+        if (changed_tag_ids and self.patch_tag_paths_in_place and
+            not self.fix_tag_index_offset):
+            patched_offs, _ = get_tag_path_string_slack(
+                halo_map, halo_map.map_data, changed_tag_ids)
+
         new_strings_size = 0
-        for i in range(len(index_array)):
-            if orig_tag_paths[i].lower() != index_array[i].path.lower():
+        for i in changed_tag_ids:
+            if i not in patched_offs:
                 new_strings_size += len(index_array[i].path) + 1
 
         if ((new_strings_size and prompt_strings_expand) and
@@ -1370,6 +1503,10 @@ def save_map(self, save_path=None, map_name=ACTIVE_INDEX,
         return save_path
 
     def start_extraction(self, e=None):
+        '''
+        Processes the extraction queue on another thread, so the window
+        stays responsive. How far along it is shows under the queue.
+        '''
         if self.running:
             return
 
@@ -1382,12 +1519,87 @@ def start_extraction(self, e=None):
 
         self._running = True
         try:
-            self.process_queue()
+            self.queue_extraction_items()
         except Exception:
             print(format_exc())
+            self._running = False
+            return
+
+        # the extraction thread can't use the tkinter variables
+        self._tk_var_values = {name: getattr(self, name)
+                               for name in self.tk_vars}
+        self.extraction_progress = ExtractionProgress()
+        self.cancel_button.config(state='normal')
+        self.extraction_status_label.config(text="Starting extraction")
+
+        self.extraction_thread = Thread(
+            target=self._process_extraction_queue, daemon=True)
+        self.extraction_thread.start()
+        self.after(EXTRACTION_POLL_INTERVAL, self._poll_extraction)
+
+    def cancel_extraction(self, e=None):
+        '''
+        Stops the extraction after the tags being extracted are done.
+        '''
+        if self.extraction_progress is None or not self.running:
+            return
+
+        self.extraction_progress.cancel()
+        self.cancel_button.config(state='disabled')
+        self.extraction_status_label.config(text="Cancelling extraction")
+
+    def _poll_extraction(self):
+        self.process_ui_calls()
+        progress = self.extraction_progress
+        if self.extraction_thread.is_alive():
+            if not progress.cancelled:
+                self.extraction_status_label.config(
+                    text=progress.get_status_string())
+            self.after(EXTRACTION_POLL_INTERVAL, self._poll_extraction)
+            return
+
+        # run anything queued right before the thread finished
+        self.process_ui_calls()
+        self.extraction_thread = None
+        self._tk_var_values = None
         self._running = False
+        self.cancel_button.config(state='disabled')
+        self.extraction_status_label.config(
+            text=progress.get_summary_string())
+
+    def run_on_ui_thread(self, func, *args, wait=True, **kwargs):
+        '''
+        Calls func with the given arguments on the main thread, as tkinter
+        can only be used from there. If wait is True, waits for it to be
+        called and returns what it returns.
+        '''
+        if current_thread() is main_thread():
+            return func(*args, **kwargs)
+
+        call = [func, args, kwargs, None, Event()]
+        self._ui_calls.put(call)
+        if wait:
+            call[4].wait()
+            return call[3]
+
+    def process_ui_calls(self):
+        while True:
+            try:
+                call = self._ui_calls.get_nowait()
+            except Empty:
+                break
+
+            try:
+                call[3] = call[0](*call[1], **call[2])
+            except Exception:
+                print(format_exc())
+            call[4].set()
 
     def process_queue(self, **kw):
+        self.queue_extraction_items()
+        self._process_extraction_queue(**kw)
+
+    def queue_extraction_items(self):
         # lets be a lazy fuck and generate self._extract_queue
         # on the fly rather than reworking a lot of the widgets
         # module to work with RefineryQueueItem
@@ -1418,17 +1630,26 @@ def process_queue(self, **kw):
                          queue_item_iid=queue_item_iid, tag_ids=tag_ids,
                          **op_kw)
 
-        tags_by_map, data_by_map = RefineryCore.process_queue(self, **kw)
+    def _process_extraction_queue(self, **kw):
+        try:
+            tags_by_map, data_by_map = RefineryCore.process_queue(self, **kw)
+        except Exception:
+            print(format_exc())
+            return
+
         items_extracted = sum(len(item) for item in tags_by_map.values()) +\
                           sum(len(item) for item in data_by_map.values())
 
-        if not items_extracted:
+        cancelled = (self.extraction_progress is not None and
+                     self.extraction_progress.cancelled)
+        if not items_extracted and not cancelled:
             print("Nothing was extracted. This might be a permissions issue.")
 
     def prompt_globals_overwrite(self, halo_map, tag_id):
         map_name = halo_map.map_name
         tag_name = halo_map.tag_index.tag_index[tag_id & 0xFFff].path
-        ans = messagebox.askyesno(
+        ans = self.run_on_ui_thread(
+            messagebox.askyesno,
             "Attempting to overwrite existing globals",
             ('The tag "%s.globals" already exists in the extraction directory. '
              'Do you want to overwrite it with the globals from the map "%s"?') %
@@ -1436,17 +1657,20 @@ def prompt_globals_overwrite(self, halo_map, tag_id):
         return bool(ans)
 
     def process_queue_item(self, queue_item, **kw):
-        self.update_idletasks()
+        queue_item_iid = queue_item.operation_kwargs.get("queue_item_iid")
+        if queue_item_iid is not None:
+            self.run_on_ui_thread(self.remove_queue_tree_item,
+                                  queue_item_iid, wait=False)
+
+        RefineryCore.process_queue_item(self, queue_item, **kw)
+
+    def remove_queue_tree_item(self, queue_item_iid):
         try:
-            del self.queue_tree.queue_info[queue_item.queue_item_iid]
-            self.queue_tree.tags_tree.delete(queue_item.queue_item_iid)
-            self.update()
+            del self.queue_tree.queue_info[queue_item_iid]
+            self.queue_tree.tags_tree.delete(queue_item_iid)
         except Exception:
             pass
 
-        self.update_idletasks()
-        RefineryCore.process_queue_item(self, queue_item, **kw)
-
     def reload_explorers(self):
         for name, tree in self.tree_frames.items():
             if name.startswith(self._display_mode):
@@ -0,0 +1,155 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+from collections import OrderedDict
+from threading import Lock
+
+__all__ = ("MetaCache", "MetaCachedMap", )
+
+# the size to count a meta as if its size can't be calculated
+DEFAULT_META_SIZE = 4096
+
+
+def get_meta_size(meta):
+    '''
+    Returns the approximate number of bytes the given meta takes up.
+    This is its serialized size, which is less than the memory the
+    parsed meta uses, but is proportional enough to budget with.
+    '''
+    try:
+        return max(meta.binsize, 1)
+    except Exception:
+        return DEFAULT_META_SIZE
+
+
+class MetaCache:
+    '''
+    A least recently used cache of parsed metas, keyed by the map, tag id
+    and the arguments get_meta was called with. The oldest metas are
+    evicted once the metas cached take up more than max_size bytes.
+
+    Metas returned from this are shared, so they must not be modified.
+    Invalidate a map's metas whenever its tag data is written to.
+    '''
+    max_size = 0
+    size = 0
+    hits = 0
+    misses = 0
+    evictions = 0
+
+    def __init__(self, max_size=0):
+        self.max_size = max_size
+        # maps each key to a (meta, size) tuple, oldest used first
+        self._metas = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._metas)
+
+    def get_meta(self, halo_map, tag_id, *args, **kwargs):
+        '''
+        Returns the meta halo_map.get_meta would return for these
+        arguments, parsing it only if it isn't already cached.
+        '''
+        if tag_id is None or self.max_size <= 0:
+            return halo_map.get_meta(tag_id, *args, **kwargs)
+
+        try:
+            key = (halo_map, tag_id & 0xFFff, args,
+                   tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            # one of the arguments can't be used as a key
+            return halo_map.get_meta(tag_id, *args, **kwargs)
+
+        with self._lock:
+            cached = self._metas.get(key)
+            if cached is not None:
+                self._metas.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+
+            self.misses += 1
+
+        meta = halo_map.get_meta(tag_id, *args, **kwargs)
+        if meta is None:
+            return meta
+
+        size = get_meta_size(meta)
+        if size > self.max_size:
+            return meta
+
+        with self._lock:
+            old = self._metas.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+
+            self._metas[key] = (meta, size)
+            self.size += size
+            while self.size > self.max_size and self._metas:
+                _, (_, old_size) = self._metas.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+
+        return meta
+
+    def invalidate(self, halo_map=None, tag_ids=None):
+        '''
+        Drops the cached metas of the given map, or of every map if
+        halo_map is None. If tag_ids is given, only the metas of those
+        tags are dropped.
+        '''
+        if tag_ids is not None:
+            tag_ids = set(tag_id & 0xFFff for tag_id in tag_ids)
+
+        with self._lock:
+            for key in tuple(self._metas):
+                if halo_map is not None and key[0] is not halo_map:
+                    continue
+                elif tag_ids is not None and key[1] not in tag_ids:
+                    continue
+
+                self.size -= self._metas.pop(key)[1]
+
+    def clear(self):
+        self.invalidate()
+
+    def reset_stats(self):
+        self.hits = self.misses = self.evictions = 0
+
+    def get_stats_string(self):
+        lookups = self.hits + self.misses
+        return ("Meta cache: %s hits, %s misses(%.1f%% hit rate), "
+                "%s evictions, %s metas using %s of %s bytes") % (
+                    self.hits, self.misses,
+                    100 * self.hits / lookups if lookups else 0,
+                    self.evictions, len(self._metas), self.size,
+                    self.max_size)
+
+
+class MetaCachedMap:
+    '''
+    Stands in for a map, reading metas through a MetaCache. Everything
+    other than get_meta is read from and written to the map itself.
+    '''
+    __slots__ = ("halo_map", "meta_cache", )
+
+    def __init__(self, halo_map, meta_cache):
+        object.__setattr__(self, "halo_map", halo_map)
+        object.__setattr__(self, "meta_cache", meta_cache)
+
+    def __getattr__(self, attr_name):
+        # only called for attributes this class doesn't define
+        return getattr(self.halo_map, attr_name)
+
+    def __setattr__(self, attr_name, new_val):
+        setattr(self.halo_map, attr_name, new_val)
+
+    def get_meta(self, tag_id, *args, **kwargs):
+        return self.meta_cache.get_meta(self.halo_map, tag_id, *args, **kwargs)
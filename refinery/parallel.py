@@ -0,0 +1,321 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+import io
+import os
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from time import time
+from traceback import format_exc
+
+from refinery.constants import ACTIVE_INDEX, MAP_TYPE_ANY
+from refinery.extraction_progress import ExtractionProgress
+from refinery.util import int_to_fourcc
+
+__all__ = ("TagExtractionPool", "DeprotectionResult", "deprotect_maps",
+           "get_loaded_resource_map_paths", "get_worker_count", )
+
+
+# settings copied from the parent RefineryCore into each worker's
+# RefineryCore so the workers extract exactly like the parent would
+EXTRACTION_SETTING_NAMES = (
+    "do_printout", "print_errors", "overwrite", "force_lower_case_paths",
+    "rename_scnr_dups", "decode_adpcm", "generate_uncomp_verts",
+    "generate_comp_verts", "use_tag_index_for_script_names",
+    "use_scenario_names_for_script_names", "bitmap_extract_keep_alpha",
+    "bitmap_extract_format", "globals_overwrite_mode",
+    "disable_safe_mode", "disable_tag_cleaning", "checksum_threads",
+    "use_tag_index_cache", "tag_index_cache_dir",
+    )
+
+# settings copied from the parent RefineryCore into each deprotection worker
+DEPROTECTION_SETTING_NAMES = EXTRACTION_SETTING_NAMES + (
+    "fix_tag_classes", "fix_tag_index_offset", "use_minimum_priorities",
+    "use_heuristics", "valid_tag_paths_are_accurate",
+    "scrape_tag_paths_from_scripts", "limit_tag_path_lengths",
+    "shallow_ui_widget_nesting", "rename_cached_tags",
+    "print_heuristic_name_changes", "patch_tag_paths_in_place",
+    "meta_cache_size", "use_dependency_graph",
+    )
+
+# error is an empty string if the map was deprotected successfully
+DeprotectionResult = namedtuple(
+    "DeprotectionResult",
+    ("engine", "map_name", "filepath", "error", "duration", "output"))
+
+# the RefineryCore each worker process extracts with
+_worker_refinery = None
+
+
+def get_worker_count(workers):
+    '''
+    Returns the number of worker processes to use.
+    Anything less than 1 means use one worker per cpu.
+    '''
+    workers = int(workers or 0)
+    if workers < 1:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def get_loaded_resource_map_paths(halo_map):
+    '''
+    Returns the filepaths of the resource maps the given map has loaded,
+    keyed by name, so worker processes can load the same resource maps.
+    '''
+    return {name: path for name, path in
+            halo_map.get_resource_map_paths().items()
+            if path and halo_map.maps.get(name) is not None}
+
+
+def _create_worker_refinery(settings):
+    # imported here since core imports this module
+    from refinery.core import RefineryCore
+
+    refinery = RefineryCore()
+    for name, value in settings.items():
+        setattr(refinery, name, value)
+
+    return refinery
+
+
+def _init_extraction_worker(map_path, rsrc_map_paths, tag_index_info,
+                            settings, dependency_graph=None):
+    global _worker_refinery
+    refinery = _create_worker_refinery(settings)
+    halo_map = refinery.load_map(
+        map_path, make_active=True, autoload_resources=False,
+        do_printout=False)
+    if rsrc_map_paths:
+        refinery.load_resource_maps(
+            halo_map, map_paths=rsrc_map_paths, do_printout=False)
+
+    # the parent may have renamed or re-classed tags without saving
+    # them to the map, so make this copy of the tag index match it.
+    tag_index_array = halo_map.tag_index.tag_index
+    for i, (path, cls_1, cls_2, cls_3) in enumerate(tag_index_info):
+        tag_index_ref = tag_index_array[i]
+        tag_index_ref.path = path
+        tag_index_ref.class_1.data = cls_1
+        tag_index_ref.class_2.data = cls_2
+        tag_index_ref.class_3.data = cls_3
+
+    # the parent's graph, so dependencies are looked up the same in both
+    halo_map.dependency_graph = dependency_graph
+    _worker_refinery = refinery
+
+
+def _extract_tags_chunk(tag_ids, get_dependencies, kw):
+    refinery = _worker_refinery
+    dependency_ids = set() if get_dependencies else None
+    dependency_graph = getattr(refinery.active_map, "dependency_graph", None)
+    # count what this chunk extracts for the parent to add to its progress
+    progress = refinery.extraction_progress = ExtractionProgress()
+    output = io.StringIO()
+    with redirect_stdout(output):
+        extracted = refinery._extract_tags(
+            tag_ids, ACTIVE_INDEX, ACTIVE_INDEX, dependency_ids=dependency_ids,
+            dependency_graph=dependency_graph, **kw)
+
+    # keep memory usage from climbing as each worker extracts more tags
+    halo_map = refinery.active_map
+    for rsrc_map in halo_map.maps.values():
+        if rsrc_map.is_resource or rsrc_map is halo_map:
+            rsrc_map.clear_map_cache()
+
+    return (extracted, dependency_ids, output.getvalue(),
+            progress.tags_done, progress.bytes_written)
+
+
+class TagExtractionPool:
+    '''
+    Extracts tags from a map using a pool of worker processes.
+    Each worker opens its own read-only copy of the map and its
+    resource maps, so the parent only needs to merge the results.
+    '''
+    refinery = None
+    halo_map = None
+    # looked up by the workers for the dependencies of the tags they
+    # extract, rather than finding them in the tags' metas
+    dependency_graph = None
+    workers = 1
+    chunks_per_worker = 4
+
+    _executor = None
+
+    def __init__(self, refinery, halo_map, workers, **kw):
+        self.refinery = refinery
+        self.halo_map = halo_map
+        self.workers = get_worker_count(workers)
+        self.dependency_graph = kw.pop("dependency_graph", None)
+        self.chunks_per_worker = kw.pop(
+            "chunks_per_worker", self.chunks_per_worker)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *a):
+        self.shutdown()
+
+    def start(self):
+        if self._executor is not None:
+            return
+
+        halo_map = self.halo_map
+        rsrc_map_paths = get_loaded_resource_map_paths(halo_map)
+        tag_index_info = tuple(
+            (ref.path, ref.class_1.data, ref.class_2.data, ref.class_3.data)
+            for ref in halo_map.tag_index.tag_index)
+        settings = {name: getattr(self.refinery, name)
+                    for name in EXTRACTION_SETTING_NAMES}
+
+        self._executor = ProcessPoolExecutor(
+            self.workers, initializer=_init_extraction_worker,
+            initargs=(halo_map.decomp_filepath, rsrc_map_paths,
+                      tag_index_info, settings, self.dependency_graph))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        self._executor = None
+
+    def extract_tags(self, tag_ids, map_name=ACTIVE_INDEX,
+                     engine=ACTIVE_INDEX, **kw):
+        '''
+        Extracts the tags in the order given, printing any output from
+        the workers in that same order. If dependency_ids is provided
+        as a set(), it will be filled the same as it would by extract_tag.
+        Returns a list of the tag ids extracted.
+        '''
+        self.start()
+        dependency_ids = kw.pop("dependency_ids", None)
+        # the workers were given the graph when they started
+        dependency_graph = kw.pop("dependency_graph", None)
+        get_dependencies = isinstance(dependency_ids, set)
+        tag_index_array = self.halo_map.tag_index.tag_index
+
+        # globals tags may need to prompt about being overwritten, so
+        # they're extracted by the parent when their turn comes around.
+        jobs, run = [], []
+        for tag_id in tag_ids:
+            if tag_id not in range(len(tag_index_array)):
+                tag_cls = None
+            else:
+                tag_cls = int_to_fourcc(tag_index_array[tag_id].class_1.data)
+
+            if tag_cls == "matg":
+                jobs.extend(self._submit_run(run, get_dependencies, kw))
+                jobs.append(tag_id)
+                run = []
+            else:
+                run.append(tag_id)
+
+        jobs.extend(self._submit_run(run, get_dependencies, kw))
+
+        extracted = []
+        progress = self.refinery.extraction_progress
+        for job in jobs:
+            if progress is not None and progress.cancelled:
+                if isinstance(job, int) or job.cancel():
+                    continue
+                # the chunk is already being extracted. wait for it
+
+            if isinstance(job, int):
+                extracted.extend(self.refinery._extract_tags(
+                    (job, ), map_name, engine, dependency_ids=dependency_ids,
+                    dependency_graph=dependency_graph, **kw))
+                continue
+
+            (chunk_extracted, chunk_dependency_ids, output,
+             tags_done, bytes_written) = job.result()
+            if output:
+                print(output, end="")
+            if progress is not None:
+                progress.add_tags_done(tags_done, bytes_written)
+
+            extracted.extend(chunk_extracted)
+            if get_dependencies:
+                dependency_ids.update(chunk_dependency_ids)
+
+        return extracted
+
+    def _submit_run(self, tag_ids, get_dependencies, kw):
+        if not tag_ids:
+            return ()
+
+        chunk_count = self.workers * self.chunks_per_worker
+        chunk_size = max(1, -(-len(tag_ids) // chunk_count))
+        return [self._executor.submit(
+                    _extract_tags_chunk, tag_ids[i: i + chunk_size],
+                    get_dependencies, kw)
+                for i in range(0, len(tag_ids), chunk_size)]
+
+
+def _deprotect_map(map_path, rsrc_map_paths, settings, crc32, kw):
+    start = time()
+    error = ""
+    output = io.StringIO()
+    with redirect_stdout(output):
+        refinery = None
+        try:
+            refinery = _create_worker_refinery(settings)
+            halo_map = refinery.load_map(
+                map_path, make_active=True, autoload_resources=False)
+            if rsrc_map_paths:
+                refinery.load_resource_maps(halo_map, map_paths=rsrc_map_paths)
+
+            if crc32 is not None:
+                # keep spoofing the checksum the parent was going to spoof
+                halo_map.map_header.crc32 = crc32
+                halo_map.force_checksum = True
+
+            refinery.deprotect(map_path, **kw)
+        except Exception:
+            error = format_exc()
+
+        try:
+            if refinery is not None:
+                refinery.unload_maps(MAP_TYPE_ANY, None, None)
+        except Exception:
+            pass
+
+    return error, time() - start, output.getvalue()
+
+
+def deprotect_maps(maps_info, workers, settings, **kw):
+    '''
+    Deprotects and saves each map in its own worker process. maps_info
+    is an iterable of (engine, map_name, filepath, rsrc_map_paths, crc32)
+    tuples, where crc32 is None unless the checksum is to be spoofed.
+    The maps should not be loaded by this process while this runs.
+
+    Yields a DeprotectionResult for each map as it finishes.
+    '''
+    maps_info = tuple(maps_info)
+    workers = min(get_worker_count(workers), max(1, len(maps_info)))
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {}
+        for engine, map_name, filepath, rsrc_map_paths, crc32 in maps_info:
+            future = executor.submit(
+                _deprotect_map, filepath, rsrc_map_paths, settings, crc32, kw)
+            futures[future] = (engine, map_name, filepath)
+
+        for future in as_completed(futures):
+            engine, map_name, filepath = futures[future]
+            try:
+                error, duration, output = future.result()
+            except Exception:
+                # the worker itself died, so there's no output to show
+                error, duration, output = format_exc(), 0.0, ""
+
+            yield DeprotectionResult(
+                engine, map_name, filepath, error, duration, output)
@@ -27,6 +27,7 @@ def __init__(self, operation, **kwargs):
             required = ()
 
         elif op == "extract_tag": required = ("tag_id", )
+        elif op == "print_refs_to": required = ("tag_id", )
         elif op == "switch_map":  required = ("map_name", )
         elif op == "switch_engine": required = ("engine", )
         elif op == "spoof_crc": required = ("new_crc", )
@@ -30,7 +30,8 @@
         "extract_tags", "extract_data", "extract_tag", "extract_cheape",
         "deprotect_map", "load_map", "unload_map", "save_map", "rename_map",
         "spoof_crc", "rename_tag_by_id", "rename_tag", "rename_dir",
-        "set_vars", "get_vars", "map_info", "tag_id_tokens", "tag_id_macros",
+        "set_vars", "get_vars", "map_info", "refs_to",
+        "tag_id_tokens", "tag_id_macros",
         "switch_map", "switch_map_by_filepath", "switch_engine",
         "dir", "files", "dir_ct", "file_ct", "dir_names", "file_names",
         "quit", "maps", "engines", "verbose", "prompt", "cls")):
@@ -91,7 +92,7 @@
         'dir', default=None, nargs="?",
         help=command_arg_strings[name]['dir'])
 
-for name in ("rename_tag_by_id", "extract_tag"):
+for name in ("rename_tag_by_id", "extract_tag", "refs_to"):
     _ops[name].add_argument(
         'tag-id', help=command_arg_strings[name]['tag-id'])
 
@@ -106,7 +107,7 @@
         "unload_map", "save_map", "deprotect_map", "rename_map",
         "spoof_crc", "rename_tag_by_id", "rename_tag", "rename_dir",
         "dir", "files", "map_info", "dir_ct", "file_ct",
-        "dir_names", "file_names"):
+        "dir_names", "file_names", "refs_to"):
     _ops[name].add_argument(
         'map-name', default=None, nargs="?",
         help=command_arg_strings[name]['map-name'])
@@ -118,6 +119,10 @@
 #########################################################################
 # add the optional arguments
 #########################################################################
+_ops["refs_to"].add_argument(
+    '-r', '--recursive', default=None, choices=(0, 1), type=int,
+    help=command_arg_strings["refs_to"]['recursive'])
+
 for name in ("deprotect_map", "load_map"):
     _ops[name].add_argument(
         '-p', '--do-printout', default=None, choices=(0, 1), type=int,
@@ -130,6 +135,9 @@
     _ops[name].add_argument(
         '--meta-data-expansion', default=None, type=int,
         help=command_arg_strings[name]['meta-data-expansion'])
+    _ops[name].add_argument(
+        '--patch-tag-paths-in-place', default=None, choices=(0, 1), type=int,
+        help=command_arg_strings[name]['patch-tag-paths-in-place'])
     _ops[name].add_argument(
         '--raw-data-expansion', default=None, type=int,
         help=command_arg_strings[name]['raw-data-expansion'])
@@ -203,9 +211,15 @@
     _ops[name].add_argument(
         '-r', '--recursive', default=None, choices=(0, 1), type=int,
         help=command_arg_strings[name]['recursive'])
+    _ops[name].add_argument(
+        '--use-dependency-graph', default=None, choices=(0, 1), type=int,
+        help=command_arg_strings[name]['use-dependency-graph'])
     _ops[name].add_argument(
         '--tag-ids', nargs="*", default=(tag_path_tokens.TOKEN_ALL, ),
         help=command_arg_strings[name]['tag-ids'])
+    _ops[name].add_argument(
+        '-w', '--extract-workers', default=None, type=int,
+        help=command_arg_strings[name]['extract-workers'])
 
 for op_name in (
         "autoload-resources", "do-printout", "print-errors",
@@ -218,7 +232,8 @@
         "limit-tag-path-lengths", "print-heuristic-name-changes",
         "use-heuristics", "shallow-ui-widget-nesting", "rename-cached-tags",
         "disable-safe-mode", "disable-tag-cleaning",
-        "skip-seen-tags-during-queue-processing"):
+        "skip-seen-tags-during-queue-processing", "patch-tag-paths-in-place",
+        "use-tag-index-cache", "lazy-load-resources", "use-dependency-graph"):
     # these dont get shorthand settings because there are too damn many of them
     _ops["set_vars"].add_argument(
         '--%s' % op_name, default=None, choices=(0, 1), type=int,
@@ -234,7 +249,29 @@
     '--globals-overwrite-mode', const=True, default=False, action="store_const",
     help=command_arg_strings["get_vars"]["globals-overwrite-mode"])
 
-for op_name in ("tags-dir", "data-dir", "tagslist-path", "bitmap-extract-format"):
+_ops["set_vars"].add_argument(
+    '--extract-workers', default=None, type=int,
+    help=command_arg_strings["set_vars"]["extract-workers"])
+_ops["get_vars"].add_argument(
+    '--extract-workers', const=True, default=False, action="store_const",
+    help=command_arg_strings["get_vars"]["extract-workers"])
+
+_ops["set_vars"].add_argument(
+    '--load-workers', default=None, type=int,
+    help=command_arg_strings["set_vars"]["load-workers"])
+_ops["get_vars"].add_argument(
+    '--load-workers', const=True, default=False, action="store_const",
+    help=command_arg_strings["get_vars"]["load-workers"])
+
+_ops["set_vars"].add_argument(
+    '--meta-cache-size', default=None, type=int,
+    help=command_arg_strings["set_vars"]["meta-cache-size"])
+_ops["get_vars"].add_argument(
+    '--meta-cache-size', const=True, default=False, action="store_const",
+    help=command_arg_strings["get_vars"]["meta-cache-size"])
+
+for op_name in ("tags-dir", "data-dir", "tagslist-path", "bitmap-extract-format",
+                "tag-index-cache-dir"):
     _ops["set_vars"].add_argument(
         '--%s' % op_name, default=None,
         help=command_arg_strings["set_vars"][op_name])
@@ -259,6 +296,9 @@
 _ops["load_map"].add_argument(
     '-a', '--autoload-resources', default=None, choices=(0, 1), type=int,
     help=command_arg_strings["load_map"]['autoload-resources'])
+_ops["load_map"].add_argument(
+    '-l', '--lazy-load-resources', default=None, choices=(0, 1), type=int,
+    help=command_arg_strings["load_map"]['lazy-load-resources'])
 _ops["load_map"].add_argument(
     '-m', '--make-active', default=None, choices=(0, 1), type=int,
     help=command_arg_strings["load_map"]['make-active'])
@@ -97,6 +97,8 @@
     get_vars="Displays the current values of default variables. \
 If no variable names are provided, all variables are printed.",
     map_info="Displays map header and tag index information.",
+    refs_to="Displays the tags that reference the specified tag. \
+The first time this is used on a map, every tag's references must be found.",
     tag_id_tokens="Displays the available tag-id tokens and what they represent. \
 Tokens may be used whenever a tag-id is needed. \
 Any provided prefix string will be used to filter which tokens are displayed.",
@@ -135,11 +137,18 @@
 to lowercase the path they are extracted to.",
     "generate-comp-verts": "Whether to generate compressed lightmap vertices when extracting bsps.",
     "generate-uncomp-verts": "Whether to generate uncompressed lightmap vertices when extracting bsps.",
+    "lazy-load-resources": "Whether to wait until a resource map is needed before loading it, \
+rather than loading all of them along with the map.",
     "limit-tag-path-lengths": "Whether to shorten tag paths to the Win32 limit of 254 characters.",
     "overwrite": "Whether to overwrite existing files when extracting.",
+    "patch-tag-paths-in-place": "Whether to write changed tag paths over the old tag path strings \
+when saving, if there is room, rather than expanding the map to fit them.",
     "print-errors": "Whether to print exceptions as they occur, rather than letting them stop the operation.",
     "print-heuristic-name-changes": "Whether to print a tags name each time it changes during heuristic deprotection",
     "recursive": "Whether to extract ALL tags needed by each tag being extracted.",
+    "use-dependency-graph": "Whether recursive extraction should find every tag it \
+needs from a graph of the map's tag references before extracting any of them. \
+The graph isn't used when overwriting. The graph is cached with the tag index cache if that is enabled.",
     "rename-cached-tags": "Whether to rename indexed tags using names taken from the loaded resource maps.",
     "rename-scnr-dups": "Whether to rename scenario names to remove unused duplicates. \
 Duplicates can prevent scripts from being recompiled.",
@@ -147,7 +156,10 @@
     "shallow-ui-widget-nesting": "Whether to use shallow nesting for ui_widget_definition tags \
 and their children. If set, ui_widget_definition tags will be flatly stored in ui\\shell\\",
     "tags-dir": "The default directory to extract tags to.",
+    "tag-index-cache-dir": "The directory to cache what identifying loaded resource maps found in.",
     "tagslist-path": "Filepath to a text file to record tag and data extractions.",
+    "use-tag-index-cache": "Whether to cache what identifying loaded resource maps found to disk, \
+so reloading an unchanged resource map doesn't need to parse it twice.",
     "use-heuristics": "Whether to use heuristics based deprotection. \
 Heuristics assumes most tag paths are protecetd, and generates new ones based on how tags are used. \
 Use this when deprotecting the most heavily protected maps.",
@@ -168,10 +180,24 @@
         "4 == overwrite for MP maps(dont otherwise)."
         ),
     "skip-seen-tags-during-queue-processing": "Whether to skip extracting any tags that were \
-already extracted during a previous queued extraction."
+already extracted during a previous queued extraction.",
+    "extract-workers": "The number of processes to extract Halo 1 tags with. \
+1 extracts everything in this process. Less than 1 uses one process per cpu.",
+    "load-workers": "The number of threads to read maps with when several \
+load-map commands are queued one after another. Less than 1 uses one thread per cpu.",
+    "meta-cache-size": "The number of bytes of tag metas to keep cached while deprotecting \
+and finding tag references, so they don't need to be read again. 0 disables the cache.",
     }
 
 
+tag_selector_help_str = (
+    "Tag paths containing * or ? are globs matched against the tag's "
+    "path and class, such as levels\\*\\bitmaps\\*_d.bitmap. * and ? don't "
+    "match across directories, but ** does. Tag paths starting with re: "
+    "are regular expressions searched for in the tag's path and class."
+    )
+
+
 command_arg_strings = dict(
     extract_tags={
         "map-name": "Name of the map to extract from. Defaults to <active>",
@@ -185,11 +211,13 @@
         "generate-uncomp-verts": default_var_help_strs["generate-uncomp-verts"],
         "overwrite": default_var_help_strs["overwrite"],
         "recursive": default_var_help_strs["recursive"],
+        "use-dependency-graph": default_var_help_strs["use-dependency-graph"],
         "rename-scnr-dups": default_var_help_strs["rename-scnr-dups"],
         "tagslist-path": default_var_help_strs["tagslist-path"],
         "out-dir": "The directory to extract tags to.",
         "macros": "Whether to check for macros in the tag-ids.",
-        "tag-ids": "The tag-ids of the tags to extract. May also include tag-id macros.",
+        "tag-ids": "The tag-ids of the tags to extract. May also include tag-id macros.\n" + tag_selector_help_str,
+        "extract-workers": default_var_help_strs["extract-workers"],
         },
     extract_data={
         "map-name": "Name of the map to extract from. Defaults to <active>",
@@ -203,6 +231,7 @@
         "generate-uncomp-verts": default_var_help_strs["generate-uncomp-verts"],
         "overwrite": default_var_help_strs["overwrite"],
         "recursive": default_var_help_strs["recursive"],
+        "use-dependency-graph": default_var_help_strs["use-dependency-graph"],
         "rename-scnr-dups": default_var_help_strs["rename-scnr-dups"],
         "tagslist-path": default_var_help_strs["tagslist-path"],
         "decode-adpcm": default_var_help_strs["decode-adpcm"],
@@ -210,7 +239,8 @@
         "bitmap-extract-keep-alpha": default_var_help_strs["bitmap-extract-keep-alpha"],
         "out-dir": "The directory to extract data to.",
         "macros": "Whether to check for macros in the tag-ids.",
-        "tag-ids": "The tag-ids of the data to extract. May also include tag-id macros.",
+        "tag-ids": "The tag-ids of the data to extract. May also include tag-id macros.\n" + tag_selector_help_str,
+        "extract-workers": default_var_help_strs["extract-workers"],
         },
     extract_tag={
         "tag-id": "The tag-id of the tag to extract.",
@@ -240,6 +270,7 @@
 
         "do-printout": default_var_help_strs["do-printout"],
         "fix-tag-index-offset": default_var_help_strs["fix-tag-index-offset"],
+        "patch-tag-paths-in-place": default_var_help_strs["patch-tag-paths-in-place"],
         "print-errors": default_var_help_strs["print-errors"],
         "fix-tag-classes": default_var_help_strs["fix-tag-classes"],
         "limit-tag-path-lengths": default_var_help_strs["limit-tag-path-lengths"],
@@ -262,6 +293,7 @@
 
         "do-printout": default_var_help_strs["do-printout"],
         "autoload-resources": default_var_help_strs["autoload-resources"],
+        "lazy-load-resources": default_var_help_strs["lazy-load-resources"],
         "make-active": "Whether to set this map as the active map.",
         "replace-if-same-name": "Whether to unload any map using the same engine and map-name as this one.",
         },
@@ -275,6 +307,7 @@
         "engine": "Engine of the map to save. Defaults to <active>",
 
         "fix-tag-index-offset": default_var_help_strs["fix-tag-index-offset"],
+        "patch-tag-paths-in-place": default_var_help_strs["patch-tag-paths-in-place"],
         "meta-data-expansion": "The number of bytes to expand the tag data section by.",
         "raw-data-expansion": "The number of bytes to expand the raw data section by.",
         "triangle-data-expansion": "The number of bytes to expand the indices section by.",
@@ -315,6 +348,12 @@
         "map-name": "Name of the map to display. Defaults to <active>",
         "engine": "Engine of the map to display. Defaults to <active>",
         },
+    refs_to={
+        "tag-id": "The tag-id of the tag to find references to.\n" + tag_selector_help_str,
+        "map-name": "Name of the map to search. Defaults to <active>",
+        "engine": "Engine of the map to search. Defaults to <active>",
+        "recursive": "Whether to also display the tags that reference those tags, and so on.",
+        },
     tag_id_tokens={
         "prefix": "The prefix used to filter what tokens to display. \
 It is not necessary to include '<' or '>'.",
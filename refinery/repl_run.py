@@ -12,6 +12,7 @@
 import os
 import sys
 
+from multiprocessing import freeze_support
 from time import time
 from traceback import format_exc
 
@@ -74,7 +75,7 @@ def queue_action(unparsed_command):
     kw.pop("operation", None)
 
     if op in ("dir", "files", "map_info", "dir_ct", "file_ct",
-              "dir_names", "file_names"):
+              "dir_names", "file_names", "refs_to"):
         op = "print_" + op
         kw["do_printout"] = True
     elif op in ("set_bool", "set_str"):
@@ -207,6 +208,8 @@ def main_loop():
 
 
 if __name__ == '__main__':
+    # lets frozen builds start extraction worker processes
+    freeze_support()
     start = time()
     init_arg_parser = argparse.ArgumentParser(
         description=repl.help_strs.refinery_desc_string,
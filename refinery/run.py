@@ -12,7 +12,10 @@
 # Legacy run module, used by older MEKs
 
 from .__main__ import main
-if main():
-    # Input was how the terminal window was kept open on Windows to show the
-    # error.
-    input()
+if __name__ == "__main__":
+    # extraction worker processes import this module again when they
+    # start, so only the process it was run in should open refinery
+    if main():
+        # Input was how the terminal window was kept open on Windows to
+        # show the error.
+        input()
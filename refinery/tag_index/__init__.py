@@ -8,6 +8,7 @@
 #
 
 from refinery.tag_index import tag_path_handler, tag_path_detokenizer,\
-     tag_path_tokens
+     tag_path_tokens, tag_path_query_index, tag_path_trie
 
-__all__ = ("tag_path_handler", "tag_path_detokenizer", "tag_path_tokens")
+__all__ = ("tag_path_handler", "tag_path_detokenizer", "tag_path_tokens",
+           "tag_path_query_index", "tag_path_trie")
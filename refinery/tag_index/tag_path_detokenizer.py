@@ -11,6 +11,8 @@
 
 from pathlib import PureWindowsPath
 
+from refinery.tag_index.tag_path_query_index import get_tag_path_query_index,\
+     is_tag_selector
 from refinery.tag_index.tag_path_tokens import tokens_to_tag_paths,\
      ALL_TOKENS, TOKEN_SCNR, TOKEN_MATG, TOKEN_ALL,\
      TOKEN_XBOX_SOUL, TOKEN_PC_SCNR_MAP_TYPE_TAGC,\
@@ -43,6 +45,7 @@ def get_filtered_tag_ids(self, halo_map):
         tag_index = halo_map.tag_index.STEPTREE
         tag_ids = self
         tag_index_ids = set()
+        query_index = None
 
         tag_ids = self.detokenize_tag_ids(halo_map)
         for tag_id in tag_ids:
@@ -50,8 +53,19 @@ def get_filtered_tag_ids(self, halo_map):
                 tag_index_ids.add(tag_id)
                 continue
 
+            if query_index is None:
+                query_index = get_tag_path_query_index(halo_map)
+
             tag_path = PureWindowsPath(tag_id)
             tag_class = tag_path.suffix
+            if is_tag_selector(tag_id) and not (
+                    len(tag_path.parts) == 1 and set(tag_path.stem) == set("*")
+                    and not is_tag_selector(tag_class)):
+                # a glob or regex, rather than a tag path or
+                # an all asterisk name to match by extension
+                tag_index_ids.update(query_index.get_selector_ids(tag_id))
+                continue
+
             if len(tag_path.parts) > 1:
                 # tag path has multiple parts. use the whole
                 # path as the tag_path, minus the extension.
@@ -66,8 +80,8 @@ def get_filtered_tag_ids(self, halo_map):
                     tag_path = ""
 
             exact = tag_path and tag_class
-            tag_index_ids.update(get_filtered_tag_index_ids(
-                tag_index, tag_path, tag_class.lstrip("."), exact))
+            tag_index_ids.update(query_index.get_tag_ids(
+                tag_path, tag_class.lstrip("."), exact))
 
         # make sure all the tag_ids are valid
         tag_id_range = range(len(tag_index))
@@ -9,43 +9,117 @@
 
 import os
 
+from array import array
 from pathlib import PureWindowsPath
 from refinery.constants import INF
-from refinery.util import sanitize_win32_path, get_unique_name
+from refinery.util import sanitize_win32_path, sanitize_win32_path_str
 from supyr_struct.util import str_to_identifier
+from sys import intern
 
-from queue import LifoQueue, Empty as EmptyQueueException
+
+def get_unique_child_name(children, suffixes, name, ext=""):
+    '''
+    Returns the name get_unique_name would for the given name and
+    extension, but starts probing " #N" suffixes from the one after
+    the last suffix returned for it. suffixes stores that for each
+    name, and must be specific to the children being added to.
+    '''
+    if name + ext not in children:
+        return name
+
+    key = (id(children), name, ext)
+    i = suffixes.get(key, 1)
+    while "%s #%s%s" % (name, i, ext) in children:
+        i += 1
+
+    suffixes[key] = i + 1
+    return "%s #%s" % (name, i)
+
+
+def split_name_suffix(path, ext=""):
+    '''
+    Returns the name and number of a path ending in a " #N" suffix and
+    the given extension, like the ones get_unique_name makes, or None
+    if it doesn't end with one.
+    '''
+    if not path.endswith(ext):
+        return None
+
+    name, sep, num = path[: len(path) - len(ext)].rpartition(" #")
+    if not sep or not num.isdigit() or num[0] == "0":
+        return None
+    return name, int(num)
 
 
 class TagPathHandler():
+    # maps each interned, lowercased "path.ext" to its tag's index,
+    # and holds the key each tag is currently stored under
     _path_map = ()
+    _path_keys = ()
     _index_map = ()
+    _tag_count = 0
+    # per-tag state, indexed by tag index. overwritables are 1 or 0
     _priorities = ()
     _priority_mins = ()
+    _overwritables = ()
 
     _icon_strings = ()
     _item_strings = ()
     _def_priority = 0.0
-    _overwritables = ()
+
+    # memoized heuristic_deprotect results keyed by the arguments they
+    # were found with, and the keys of the results each tag is used by.
+    # a result is dropped once any tag its subtree used is changed
+    _subtree_memos = ()
+    _memo_keys_by_index = ()
+    # a [tag index, indices used, cacheable] list for each
+    # heuristic_deprotect call currently being memoized
+    _memo_frames = ()
+    # the index of each tag whose path changed, in the order they changed
+    _path_changes = ()
+    # maps each (name, ext) set_path made unique to the lowest " #N"
+    # suffix that might not be taken. every suffix below it is taken
+    _name_suffixes = ()
 
     max_object_str_len = 120  # arbitrary limit. Meant to keep tag paths short
 
     def __init__(self, tag_index_array, **kwargs):
         self._def_priority = kwargs.get('def_priority', 0)
-        self._index_map = list(tag_index_array)
-        self._priorities = dict(kwargs.get('priorities', {}))
-        self._priority_mins = dict(kwargs.get('priority_mins', {}))
+        self._index_map = tuple(tag_index_array)
+        self._tag_count = tag_count = len(self._index_map)
+        self._priorities = array("d", (self._def_priority, )) * tag_count
+        self._overwritables = bytearray(b"\x01") * tag_count
         self._path_map = dict()
-        self._overwritables = dict()
-
-        i = 0
-        for ref in self._index_map:
-            path = (ref.path + '.%s' % ref.class_1.enum_name).lower()
-            self._path_map[path] = i
-            priority = INF if ref.indexed else self._def_priority
-            self._priorities[i] = self._priority_mins[i] = priority
-            self._overwritables[i] = False if ref.indexed else True
-            i += 1
+        self._path_keys = [""] * tag_count
+        self._subtree_memos = dict()
+        self._memo_keys_by_index = dict()
+        self._memo_frames = []
+        self._path_changes = []
+        self._name_suffixes = dict()
+
+        self._remake_path_map()
+        for i in range(tag_count):
+            if self._index_map[i].indexed:
+                self._priorities[i] = INF
+                self._overwritables[i] = 0
+
+        self._priority_mins = array("d", self._priorities)
+        for i, priority in kwargs.get('priorities', {}).items():
+            if i in range(tag_count):
+                self._priorities[i] = priority
+        for i, priority in kwargs.get('priority_mins', {}).items():
+            if i in range(tag_count):
+                self._priority_mins[i] = priority
+
+    def _remake_path_map(self):
+        self._path_map.clear()
+        self._name_suffixes.clear()
+        path_keys = self._path_keys
+        for i in range(self._tag_count):
+            ref = self._index_map[i]
+            path_key = intern((ref.path + "." + ref.class_1.enum_name).lower())
+            self._path_map[path_key] = i
+            path_keys[i] = path_key
 
     @property
     def def_priority(self):
@@ -90,10 +164,101 @@ def set_icon_strings(self, strings_body):
 
         self._icon_strings = new_strings
 
+    def _use(self, index):
+        # record that the subtree being memoized depends on this tag
+        if self._memo_frames:
+            self._memo_frames[-1][1].add(index & 0xFFff)
+
+    def _changed(self, index):
+        # drop any memoized subtree results that depended on this tag
+        for key in tuple(self._memo_keys_by_index.get(index, ())):
+            self._drop_subtree_memo(key)
+
+    def _drop_subtree_memo(self, key):
+        # drop the memoized result and forget its key for every tag it used
+        memo = self._subtree_memos.pop(key, None)
+        if memo is None:
+            return
+
+        for i in memo[2]:
+            keys = self._memo_keys_by_index.get(i)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._memo_keys_by_index[i]
+
+    def get_subtree_memo(self, key, seen=()):
+        '''
+        Returns the min priority memoized for a heuristic_deprotect call
+        with the given key, or None if it isn't memoized or any tag its
+        subtree used has changed since. Also returns None if the subtree
+        uses any of the tags in seen, as the walk would stop at them.
+        '''
+        memo = self._subtree_memos.get(key)
+        if memo is None:
+            return None
+
+        min_priority, path, used = memo
+        if self.get_path(key[0]) != path:
+            self._drop_subtree_memo(key)
+            return None
+        elif not used.isdisjoint(seen):
+            return None
+
+        if self._memo_frames:
+            self._memo_frames[-1][1].update(used)
+        return min_priority
+
+    def begin_subtree_memo(self, index):
+        self._memo_frames.append([index & 0xFFff, set(), True])
+
+    def end_subtree_memo(self, key, min_priority):
+        '''
+        Memoizes the min priority found by the heuristic_deprotect call
+        begun with the last call to begin_subtree_memo, unless its result
+        depended on which of its ancestors were being visited.
+        '''
+        index, used, cacheable = self._memo_frames.pop()
+        if self._memo_frames:
+            self._memo_frames[-1][1].update(used)
+
+        if not cacheable or key is None:
+            return
+
+        used.add(index)
+        used = frozenset(used)
+        self._drop_subtree_memo(key)
+        self._subtree_memos[key] = (min_priority, self.get_path(index), used)
+        for i in used:
+            self._memo_keys_by_index.setdefault(i, set()).add(key)
+
+    def mark_subtree_cycle(self, index):
+        '''
+        Marks the subtrees being memoized below the given tag as not
+        cacheable, as they reached the tag again through a cycle.
+        '''
+        index &= 0xFFff
+        for frame in reversed(self._memo_frames):
+            if frame[0] == index:
+                break
+            frame[2] = False
+
+    def get_path_change_count(self):
+        return len(self._path_changes)
+
+    def get_path_changes(self, start=0):
+        '''
+        Returns the indices of the tags whose paths changed,
+        in the order they changed, starting with the start'th.
+        '''
+        return self._path_changes[start:]
+
     def get_index_ref(self, index):
         if index is None: return
         index &= 0xFFff
-        if index not in range(len(self._index_map)): return
+        if index >= self._tag_count: return
+        self._use(index)
         return self._index_map[index]
 
     def get_path(self, index):
@@ -116,15 +281,24 @@ def get_full_tag_path(self, index):
 
     def get_priority(self, index, default=-INF):
         if index is None: return default
-        return self._priorities.get(index & 0xFFff, default)
+        index &= 0xFFff
+        if index >= self._tag_count: return default
+        self._use(index)
+        return self._priorities[index]
 
     def get_priority_min(self, index, default=INF):
         if index is None: return default
-        return self._priority_mins.get(index & 0xFFff, default)
+        index &= 0xFFff
+        if index >= self._tag_count: return default
+        self._use(index)
+        return self._priority_mins[index]
 
     def get_overwritable(self, index):
         if index is None: return False
-        return self._overwritables.get(index & 0xFFff, False)
+        index &= 0xFFff
+        if index >= self._tag_count: return False
+        self._use(index)
+        return self._overwritables[index] != 0
 
     def get_sub_dir(self, index, root=""):
         tag_ref = self.get_index_ref(index)
@@ -153,14 +327,18 @@ def get_will_overwrite(self, index, priority, override=False):
         elif priority is None:
             priority = self._def_priority
 
-        if not self.get_overwritable(index):
+        # this is called for nearly every tag reference the heuristics
+        # visit, so read the columns directly rather than through getters
+        index &= 0xFFff
+        if index >= self._tag_count:
             return False
 
-        tag_ref = self.get_index_ref(index)
-        if self.get_priority(index) > priority:
+        self._use(index)
+        curr_priority = self._priorities[index]
+        if not self._overwritables[index] or curr_priority > priority:
             return False
-        elif (self.get_priority(index) == priority or
-              tag_ref.indexed) and not override:
+        elif (curr_priority == priority or
+              self._index_map[index].indexed) and not override:
             return False
         return True
 
@@ -175,33 +353,42 @@ def set_path(self, index, new_path_no_ext, do_printout=False, ensure_unique_name
             new_path_no_ext += "protected %s" % index
 
         ext = "." + tag_ref.class_1.enum_name.lower()
-        new_path_no_ext = str(sanitize_win32_path(new_path_no_ext.lower())).strip()
+        new_path_no_ext = sanitize_win32_path_str(new_path_no_ext.lower()).strip()
 
         if ensure_unique_name and self._path_map.get(new_path_no_ext + ext) not in (None, index):
-            path_pieces = PureWindowsPath(new_path_no_ext).parts
-            path_basename = path_pieces[-1]
-            try:
-                path_basename_pieces = path_basename.split("#")
-                if len(path_basename_pieces) > 1:
-                    path_basename = "#".join(path_basename_pieces[: -1])
-            except Exception:
-                pass
+            # remove any "#" suffix from the basename before making it unique
+            dir_name, sep, path_basename = new_path_no_ext.rpartition("\\")
+            if "#" in path_basename:
+                path_basename = path_basename[: path_basename.rfind("#")]
+
+            if path_basename.strip(". "):
+                new_path_no_ext = dir_name + sep + path_basename
+            else:
+                # let PureWindowsPath decide what an empty or
+                # dot basename joins to, as it did before
+                new_path_no_ext = str(PureWindowsPath(
+                    *PureWindowsPath(new_path_no_ext).parts[: -1],
+                    path_basename))
 
-            path_pieces = tuple(path_pieces[: -1]) + (path_basename, )
-            new_path_no_ext = get_unique_name(
-                self._path_map, str(PureWindowsPath(*path_pieces)), ext, index)
+            new_path_no_ext = self._get_unique_path(new_path_no_ext, ext, index)
 
-        old_path = tag_ref.path.lower() + ext
-        new_path = new_path_no_ext + ext
+        old_path = self._path_keys[index]
+        new_path = intern(new_path_no_ext + ext)
 
         if self._path_map.get(new_path, None) not in (None, index):
             raise KeyError(
                 'Cannot rename tag to "%s", as that tag already exists.' %
                 new_path)
 
-        self._path_map.pop(old_path, None)
+        if self._path_map.get(old_path) == index and old_path != new_path:
+            del self._path_map[old_path]
+            self._free_unique_path(old_path, ext)
         self._path_map[new_path] = index
+        self._path_keys[index] = new_path
         tag_ref.path = new_path_no_ext
+        if new_path != old_path:
+            self._changed(index)
+            self._path_changes.append(index)
         if do_printout:
             print(index, self.get_priority(index), sep="\t", end="\t")
             try:
@@ -211,6 +398,34 @@ def set_path(self, index, new_path_no_ext, do_printout=False, ensure_unique_name
 
         return new_path
 
+    def _get_unique_path(self, name, ext, index):
+        # returns what get_unique_name(self._path_map, name, ext, index)
+        # would, without probing the suffixes known to be taken
+        path_map = self._path_map
+        if path_map.get(name + ext) in (None, index):
+            return name
+
+        key = (name, ext)
+        i = self._name_suffixes.get(key, 1)
+        curr_name = split_name_suffix(self._path_keys[index], ext)
+        if curr_name is not None and curr_name[0] == name and curr_name[1] < i:
+            # the tag already has the lowest suffix not taken by another tag
+            return "%s #%s" % curr_name
+
+        while path_map.get("%s #%s%s" % (name, i, ext)) not in (None, index):
+            i += 1
+
+        self._name_suffixes[key] = i + 1
+        return "%s #%s" % (name, i)
+
+    def _free_unique_path(self, path, ext):
+        # lets _get_unique_path reuse the suffix of a path no longer taken
+        name = split_name_suffix(path, ext)
+        if name is not None:
+            key = (name[0], ext)
+            if self._name_suffixes.get(key, 0) > name[1]:
+                self._name_suffixes[key] = name[1]
+
     def set_path_by_priority(self, index, new_path_no_ext, priority=None,
                              override=False, do_printout=False):
         tag_ref = self.get_index_ref(index)
@@ -231,36 +446,41 @@ def set_path_by_priority(self, index, new_path_no_ext, priority=None,
     def set_priority(self, index, priority):
         if index is None: return
         index &= 0xFFff
-        if index in range(len(self._index_map)):
+        if (index < self._tag_count and
+                self._priorities[index] != float(priority)):
             self._priorities[index] = float(priority)
+            self._changed(index)
 
     def set_priority_min(self, index, priority):
         if index is None: return
         index &= 0xFFff
-        if index in range(len(self._index_map)):
+        if (index < self._tag_count and
+                self._priority_mins[index] != float(priority)):
             self._priority_mins[index] = float(priority)
+            self._changed(index)
 
     def set_overwritable(self, index, new_val=True):
         if index is None: return
         index &= 0xFFff
-        if index in range(len(self._index_map)):
+        if (index < self._tag_count and
+                self._overwritables[index] != bool(new_val)):
             self._overwritables[index] = bool(new_val)
+            self._changed(index)
 
     def shorten_paths(self, max_len, **kw):
-        paths = {}
-        new_paths = {}
         do_printout = kw.pop("do_printout", False)
         print_errors = kw.pop("print_errors", False)
 
+        # build a tree of the tag paths. directories are dicts, and files
+        # map to the index of the tag to rename, or None if the tag is
+        # below the limit. those are kept so the tag path is still
+        # considered when chosing unique names
+        paths = {}
         for tag_path, index in self._path_map.items():
-            tag_path = sanitize_win32_path(tag_path.lower())
-            if len(str(tag_path.with_suffix(""))) < max_len:
-                # don't rename tags below the limit. use None as the key so
-                # the tag path is still considered when chosing unique names
+            tag_path_pieces = sanitize_win32_path(tag_path.lower()).parts
+            if len(os.path.splitext("\\".join(tag_path_pieces))[0]) < max_len:
                 index = None
 
-            tag_path_pieces = tag_path.parts
-            curr_dir = paths
             # 1 char for \, 1 for potential ~, 1 for potential number,
             # and 1 for at least one name character
             if (len(tag_path_pieces) - 1)*4 > max_len:
@@ -270,136 +490,115 @@ def shorten_paths(self, max_len, **kw):
                 print(err_str)
                 return
 
+            curr_dir = paths
             for dname in tag_path_pieces[: -1]:
                 curr_dir = curr_dir.setdefault(dname, {})
 
-            tag_ref = None
-            if index is not None:
-                tag_ref = self._index_map[index]
-
-            curr_dir[tag_path_pieces[-1]] = tag_ref
+            curr_dir[tag_path_pieces[-1]] = index
 
         # do a preliminary filepath shortening by removing any
         # words the directories and paths start and end with
         # that the parent directory also starts or ends with.
-        stack = LifoQueue()
-        parent = ""
-        curr_paths = paths
-        curr_new_paths = new_paths
-        reparent = {}
-
-        while True:
-            for name in sorted(curr_paths):
-                val = curr_paths[name]
-                if not isinstance(val, dict):
-                    # reached a filename. move the item and continue.
-                    base, ext = os.path.splitext(name)
-                    new_base = base
-                    if val is not None:
-                        new_base = self.shorten_name_to_parent(parent, base)
-
-                    curr_paths.pop(name)
-                    if new_base:
-                        curr_new_paths[new_base + ext] = val
-                    else:
-                        # name was simplified to nothing.
-                        # schedule it to be put it in the parent
-                        reparent.setdefault(parent + ext, []).append(val)
-
-                elif val:
-                    # need to go deeper, as this is a non-empty
-                    # directory. store the current state to
-                    # the stack and jump into this dir.
-                    stack.put([parent, curr_paths, curr_new_paths, reparent])
-                    new_name = get_unique_name(
-                        curr_new_paths,
-                        self.shorten_name_to_parent(parent, name)
-                        )
-                    if new_name:
-                        # if the name doesn't get simplified to nothing,
-                        # create a new directory to store these items in
-                        parent = new_name
-                        if new_name not in curr_new_paths:
-                            curr_new_paths[new_name] = {}
-
-                        curr_new_paths = curr_new_paths[new_name]
-
-                    curr_paths = val
-                    reparent = {}
-                    break
-                else:
-                    # this is an empty directory(already copied all file
-                    # and directory entries from it). remove it.
-                    curr_paths.pop(name)
-
-
-            if curr_paths:
-                # still have paths to copy.
-                continue
-
-
-            # re-parent any paths that needed to be reparented
-            curr_reparent = reparent
-            try:
-                # exhausted the current paths, get the next ones to do
-                parent, curr_paths, curr_new_paths, reparent = stack.get_nowait()
-            except EmptyQueueException:
-                break
-
-            for name in curr_reparent:
-                for item in curr_reparent[name]:
+        # each directory is sorted once, and walked with an explicit
+        # stack of [parent, sorted names, next name, new dir, reparent]
+        new_paths = {}
+        # the next " #N" suffix to try for each name in each new directory
+        suffixes = {}
+        stack = [["", sorted(paths.items()), 0, new_paths, {}]]
+        while stack:
+            frame = stack[-1]
+            parent, items, i, curr_new_paths, reparent = frame
+            if i == len(items):
+                # exhausted this directory. put any files that simplified
+                # to nothing in the directory that this one was walked from
+                stack.pop()
+                outer_new_paths = stack[-1][3] if stack else curr_new_paths
+
+                for name in sorted(reparent):
                     no_ext_name, ext = os.path.splitext(name)
-                    curr_new_paths[
-                        self.get_unique_name(
-                            curr_new_paths, no_ext_name, ext) + ext] = item
-
-            curr_reparent.clear()
+                    for val in reparent[name]:
+                        new_name = get_unique_child_name(
+                            outer_new_paths, suffixes, no_ext_name, ext)
+                        outer_new_paths[new_name + ext] = val
+                continue
 
+            name, val = items[i]
+            frame[2] = i + 1
+            if not isinstance(val, dict):
+                # reached a filename. move the item and continue.
+                base, ext = os.path.splitext(name)
+                new_base = base
+                if val is not None:
+                    new_base = self.shorten_name_to_parent(parent, base)
+
+                if new_base:
+                    new_base = get_unique_child_name(
+                        curr_new_paths, suffixes, new_base, ext)
+                    curr_new_paths[new_base + ext] = val
+                else:
+                    # name was simplified to nothing.
+                    # schedule it to be put it in the parent
+                    reparent.setdefault(parent + ext, []).append(val)
+                continue
 
-        # apply the renames
-        curr_paths = new_paths
-        path_pieces = ()
-        while True:
-            for name in sorted(curr_paths):
-                val = curr_paths.pop(name)
+            # jump into this directory
+            new_name = self.shorten_name_to_parent(parent, name)
+            if new_name:
+                # if the name doesn't get simplified to nothing,
+                # create a new directory to store these items in
+                new_name = get_unique_child_name(
+                    curr_new_paths, suffixes, new_name)
+                curr_new_paths[new_name] = {}
+                curr_new_paths = curr_new_paths[new_name]
+                parent = new_name
+
+            stack.append([parent, sorted(val.items()), 0, curr_new_paths, {}])
+
+        # find where each tag being shortened ended up
+        renames = []
+        stack = [((), new_paths)]
+        while stack:
+            path_pieces, curr_paths = stack.pop()
+            for name, val in curr_paths.items():
                 if isinstance(val, dict):
-                    # This is a directory. Need to jump in it, so we'll break
-                    if val:
-                        # This is a non-empty directory. Store the
-                        # current state to the stack and jump in.
-                        stack.put([path_pieces, curr_paths])
-
-                        curr_paths = val
-                        path_pieces += (name, )
-                    break
-                elif val is None or val.indexed:
-                    continue
-
-                # reached a filename that needs to be renamed. rename the item and continue.
-                tag_path = val.path
-                new_tag_path = PureWindowsPath(
-                    *path_pieces).with_suffix(PureWindowsPath(name).suffix)
-                if do_printout:
-                    print("%s char filepath shortened to %s chars:\n\t%s\n\t%s\n"%
-                          (len(tag_path), len(new_tag_path), tag_path, new_tag_path))
-                val.path = new_tag_path
-
-            if not curr_paths:
-                # exhausted the current paths, get the next ones to do
-                try:
-                    path_pieces, curr_paths = stack.get_nowait()
-                except EmptyQueueException:
-                    break
-
-        # remake the path map
-        self._path_map.clear()
-        for i in range(len(self._index_map)):
-            ref = self._index_map[i]
-            tag_path = ref.path
-            if do_printout and len(tag_path) > max_len:
-                print('WARNING: "%s" is over the length limit.' % tag_path)
-
-            self._path_map[(tag_path + "." + ref.class_1.enum_name).lower()] = i
+                    stack.append((path_pieces + (name, ), val))
+                elif val is not None and not self._index_map[val].indexed:
+                    renames.append((val, "\\".join(
+                        path_pieces + (os.path.splitext(name)[0], ))))
+
+        # apply the renames, making sure none of the new paths
+        # are taken by a tag that isn't being renamed.
+        renames.sort()
+        taken = dict(self._path_map)
+        for index, _ in renames:
+            taken.pop(self._path_keys[index], None)
+
+        suffixes.clear()
+        for index, new_tag_path in renames:
+            tag_ref = self._index_map[index]
+            ext = "." + tag_ref.class_1.enum_name.lower()
+            new_tag_path = get_unique_child_name(
+                taken, suffixes, new_tag_path, ext)
+            taken[new_tag_path + ext] = index
+
+            tag_path = tag_ref.path
+            if do_printout:
+                print("%s char filepath shortened to %s chars:\n\t%s\n\t%s\n"%
+                      (len(tag_path), len(new_tag_path), tag_path, new_tag_path))
+
+            if tag_path.lower() != new_tag_path:
+                tag_ref.path = new_tag_path
+                self._path_changes.append(index)
+
+        # remake the path map. every path may have changed,
+        # so none of the memoized subtree results are valid
+        self._subtree_memos.clear()
+        self._memo_keys_by_index.clear()
+        self._remake_path_map()
+        if do_printout:
+            for ref in self._index_map:
+                if len(ref.path) > max_len:
+                    print('WARNING: "%s" is over the length limit.' % ref.path)
 
     def shorten_name_to_parent(self, parent, name):
         join_char = '_' if '_' in name else ' '
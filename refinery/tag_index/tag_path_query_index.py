@@ -0,0 +1,266 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+import re
+
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+
+__all__ = ("TagPathQueryIndex", "get_tag_path_query_index",
+           "invalidate_tag_path_query_index", "compile_tag_selector",
+           "is_tag_selector", "glob_to_regex", )
+
+# sorts after any character that can be in a tag path, so appending it to
+# a prefix gives the first string past every path starting with the prefix
+PREFIX_END_CHAR = "\U0010ffff"
+
+# tag-ids starting with this are regular expressions rather than tag paths
+REGEX_SELECTOR_PREFIX = "re:"
+GLOB_CHARS = frozenset("*?")
+
+# the most compiled selectors to keep around for reuse
+MAX_COMPILED_TAG_SELECTORS = 256
+
+
+def is_tag_selector(tag_id):
+    '''
+    Returns whether the given tag-id is a regex or glob selector.
+    '''
+    return isinstance(tag_id, str) and (
+        tag_id.startswith(REGEX_SELECTOR_PREFIX) or
+        not GLOB_CHARS.isdisjoint(tag_id))
+
+
+def glob_to_regex(glob):
+    '''
+    Translates a glob over tag paths into a regular expression matching a
+    whole line. "*" and "?" don't match across directories, "**" does,
+    and "[...]" and "[!...]" match one character in or not in a set.
+    '''
+    i, glob_len = 0, len(glob)
+    pieces = ["^"]
+    while i < glob_len:
+        char = glob[i]
+        i += 1
+        if char == "*" and glob[i: i + 1] == "*":
+            pieces.append("[^\\n]*")
+            i += 1
+        elif char == "*":
+            pieces.append("[^\\\\\\n]*")
+        elif char == "?":
+            pieces.append("[^\\\\\\n]")
+        elif char == "[" and glob.find("]", i + 1) >= 0:
+            end = glob.find("]", i + 1)
+            charset = glob[i: end].replace("\\", "\\\\")
+            i = end + 1
+            if charset[: 1] == "!":
+                pieces.append("[^\\\\\\n%s]" % charset[1:])
+            else:
+                pieces.append("[%s]" % charset.replace("^", "\\^", 1))
+        else:
+            pieces.append(re.escape(char))
+
+    pieces.append("$")
+    return "".join(pieces)
+
+
+@lru_cache(maxsize=MAX_COMPILED_TAG_SELECTORS)
+def compile_tag_selector(selector):
+    '''
+    Returns a compiled pattern that matches the lines of
+    a TagPathQueryIndex that the given selector selects.
+    The most recently used selectors are kept compiled.
+    '''
+    if selector.startswith(REGEX_SELECTOR_PREFIX):
+        regex = selector[len(REGEX_SELECTOR_PREFIX):]
+    else:
+        regex = glob_to_regex(selector.replace("/", "\\").lower())
+
+    return re.compile(regex, re.IGNORECASE | re.MULTILINE)
+
+
+def _iter_set_bits(bits):
+    # bin() reversed puts bit 0 first, so the index in
+    # the string of each "1" is the index of the bit
+    bit_str = bin(bits)[:1:-1]
+    i = bit_str.find("1")
+    while i >= 0:
+        yield i
+        i = bit_str.find("1", i + 1)
+
+
+class TagPathQueryIndex:
+    '''
+    Lowercased tag paths of a tag index sorted for bisecting, so tags
+    can be looked up by path prefix, exact path or class without needing
+    to lowercase and compare every path in the tag index for each lookup.
+
+    Build a new one whenever tags are renamed or re-classed.
+    '''
+    tag_count = 0
+    # lowercased tag paths in sorted order, and the tag id and class of each
+    sorted_paths = ()
+    sorted_ids = ()
+    sorted_classes = ()
+    # maps each lowercased tag path to the range of sorted
+    # positions it takes up, since several tags can share a path
+    exact_ranges = None
+    # maps each lowercased class name to an int with a bit set for
+    # each sorted position that has a tag of that class, and to
+    # the tag ids of that class in the order they're in the map
+    class_bitmaps = None
+    class_ids = None
+    # the lowercased "path.class" of each sorted position joined by
+    # newlines, the offset each one starts at, and the tag ids each
+    # selector has matched. these are only made once a selector is used
+    selector_text = None
+    selector_line_starts = None
+    selector_results = None
+
+    def __init__(self, tag_index_array):
+        self.tag_count = len(tag_index_array)
+        entries = sorted(
+            (tag_index_array[i].path.lower(), i)
+            for i in range(self.tag_count))
+        self.sorted_paths = tuple(path for path, _ in entries)
+        self.sorted_ids   = tuple(i for _, i in entries)
+
+        self.exact_ranges = exact_ranges = {}
+        for pos, path in enumerate(self.sorted_paths):
+            start, end = exact_ranges.get(path, (pos, pos))
+            exact_ranges[path] = (start, pos + 1)
+
+        class_positions = {}
+        self.sorted_classes = sorted_classes = []
+        for pos, i in enumerate(self.sorted_ids):
+            tag_class = tag_index_array[i].class_1.enum_name.lower()
+            class_positions.setdefault(tag_class, []).append(pos)
+            sorted_classes.append(tag_class)
+
+        self.selector_results = {}
+        self.class_bitmaps = class_bitmaps = {}
+        self.class_ids = class_ids = {}
+        for tag_class, positions in class_positions.items():
+            bits = 0
+            for pos in positions:
+                bits |= 1 << pos
+            class_bitmaps[tag_class] = bits
+            class_ids[tag_class] = tuple(sorted(
+                self.sorted_ids[pos] for pos in positions))
+
+    def get_prefix_range(self, tag_path):
+        '''
+        Returns the range of sorted positions of the
+        tag paths that start with the given lowercase path.
+        '''
+        paths = self.sorted_paths
+        start = bisect_left(paths, tag_path)
+        return start, bisect_left(paths, tag_path + PREFIX_END_CHAR, start)
+
+    def get_tag_ids(self, tag_path="", tag_class="", exact=False):
+        '''
+        Returns a list of the ids of the tags whose path starts with
+        tag_path(or matches it if exact is True) and whose class is
+        tag_class. An empty tag_class matches any class.
+        '''
+        tag_path  = tag_path.lower()
+        tag_class = tag_class.lower()
+        if not tag_path and not exact:
+            if not tag_class:
+                return list(range(self.tag_count))
+            return list(self.class_ids.get(tag_class, ()))
+
+        if exact:
+            start, end = self.exact_ranges.get(tag_path, (0, 0))
+        else:
+            start, end = self.get_prefix_range(tag_path)
+
+        if not tag_class:
+            return list(self.sorted_ids[start: end])
+
+        # mask the class's bitmap down to the positions in range
+        bits = self.class_bitmaps.get(tag_class, 0)
+        bits = (bits >> start) & ((1 << (end - start)) - 1)
+        sorted_ids = self.sorted_ids
+        return [sorted_ids[start + pos] for pos in _iter_set_bits(bits)]
+
+    def get_selector_ids(self, selector):
+        '''
+        Returns a list of the ids of the tags whose lowercased "path.class"
+        matches the given glob, or regex if it starts with "re:". Regexes
+        only need to match part of the line unless anchored with ^ and $.
+        '''
+        tag_ids = self.selector_results.get(selector)
+        if tag_ids is None:
+            sorted_ids = self.sorted_ids
+            tag_ids = tuple(sorted_ids[pos] for pos in
+                            self._match_selector(compile_tag_selector(selector)))
+            self.selector_results[selector] = tag_ids
+
+        return list(tag_ids)
+
+    def _match_selector(self, pattern):
+        if not self.tag_count:
+            return []
+
+        if self.selector_text is None:
+            lines = ["%s.%s" % (path, tag_class) for path, tag_class in
+                     zip(self.sorted_paths, self.sorted_classes)]
+            starts, start = [], 0
+            for line in lines:
+                starts.append(start)
+                start += len(line) + 1
+            starts.append(start)
+
+            self.selector_text = "\n".join(lines)
+            self.selector_line_starts = starts
+
+        # search the text of every line at once, skipping to the
+        # start of the next line each time a line is matched
+        text, starts = self.selector_text, self.selector_line_starts
+        search = pattern.search
+        positions, pos = [], 0
+        while pos < len(text):
+            match = search(text, pos)
+            if match is None:
+                break
+
+            line = bisect_right(starts, match.start()) - 1
+            line_end = starts[line + 1] - 1
+            # regexes can match across lines, so make
+            # sure those match within just the one line
+            if match.end() <= line_end or search(text, starts[line], line_end):
+                positions.append(line)
+            pos = line_end + 1
+
+        return positions
+
+
+def get_tag_path_query_index(halo_map):
+    '''
+    Returns the TagPathQueryIndex of the given map, building
+    it if the map doesn't have one or it's out of date.
+    '''
+    tag_index_array = halo_map.tag_index.STEPTREE
+    query_index = getattr(halo_map, "tag_path_query_index", None)
+    if (query_index is None or
+            query_index.tag_count != len(tag_index_array)):
+        query_index = TagPathQueryIndex(tag_index_array)
+        halo_map.tag_path_query_index = query_index
+
+    return query_index
+
+
+def invalidate_tag_path_query_index(halo_map):
+    '''
+    Drops the TagPathQueryIndex of the given map. Call this
+    after renaming or re-classing any tags in the map.
+    '''
+    if halo_map is not None:
+        halo_map.tag_path_query_index = None
@@ -0,0 +1,110 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+from pathlib import PureWindowsPath
+
+from refinery.tag_index.tag_path_query_index import get_tag_path_query_index
+
+__all__ = ("TagPathTrie", "TagPathTrieNode", "get_tag_path_trie",
+           "split_tree_key", )
+
+
+def split_tree_key(tree_key):
+    '''
+    Splits a tag tree key into its directory names and basename.
+    '''
+    parts = tree_key.split("\\")
+    if "" in parts:
+        # let PureWindowsPath decide what roots and
+        # repeated backslashes split into, as it did before
+        parts = PureWindowsPath(tree_key).parts
+    return tuple(parts[: -1]), parts[-1] if parts else ""
+
+
+class TagPathTrieNode:
+    __slots__ = ("dirs", "tags", )
+
+    def __init__(self):
+        # maps each subdirectory name to its node
+        self.dirs = {}
+        # (tree key, tag index ref) of each tag in this
+        # directory, in the order they're in the tag index
+        self.tags = []
+
+    def iter_tags(self):
+        '''
+        Yields the (tree key, tag index ref) of every tag in this
+        directory and its subdirectories, directories first.
+        '''
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            for name in sorted(node.dirs, reverse=True):
+                stack.append(node.dirs[name])
+            yield from node.tags
+
+
+class TagPathTrie:
+    '''
+    The tags of a map arranged into nested directories by the keys an
+    explorer tree sorts them by, so explorer trees can fill in each
+    folder as it's opened rather than adding every tag up front.
+    '''
+    root = None
+    tag_count = 0
+
+    def __init__(self, keyed_index_refs):
+        self.root = root = TagPathTrieNode()
+        for tree_key, index_ref in keyed_index_refs:
+            node = root
+            for dir_name in split_tree_key(tree_key)[0]:
+                child = node.dirs.get(dir_name)
+                if child is None:
+                    child = node.dirs[dir_name] = TagPathTrieNode()
+                node = child
+
+            node.tags.append((tree_key, index_ref))
+            self.tag_count += 1
+
+    def get_node(self, dir_parts):
+        '''
+        Returns the node of the directory with the given
+        names, or None if there's no tag in that directory.
+        '''
+        node = self.root
+        for dir_name in dir_parts:
+            node = node.dirs.get(dir_name)
+            if node is None:
+                break
+        return node
+
+
+def get_tag_path_trie(halo_map, trie_key, get_tag_tree_key):
+    '''
+    Returns the TagPathTrie of the given map's tags, keyed by calling
+    get_tag_tree_key on each tag index ref and skipping those it returns
+    None for. Tries are cached on the map by trie_key, so trees with the
+    same keys share one, and rebuilt whenever the map's tags are renamed.
+    '''
+    # renaming tags invalidates the query index, so
+    # any trie made alongside an old one is out of date
+    query_index = get_tag_path_query_index(halo_map)
+    tries = getattr(halo_map, "tag_path_tries", None)
+    if tries is None or tries.get(None) is not query_index:
+        tries = halo_map.tag_path_tries = {None: query_index}
+
+    trie = tries.get(trie_key)
+    if trie is None:
+        tag_index_array = halo_map.tag_index.tag_index
+        trie = tries[trie_key] = TagPathTrie(
+            (key, ref) for key, ref in (
+                (get_tag_tree_key(ref), ref) for ref in tag_index_array)
+            if key is not None)
+
+    return trie
@@ -0,0 +1,153 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+import hashlib
+import os
+import tempfile
+
+from collections import namedtuple
+from pathlib import Path
+from struct import Struct as PyStruct
+
+__all__ = ("CachedMapIdentity", "TagIndexCache", "get_map_cache_key",
+           "get_map_path_key", )
+
+
+TAG_INDEX_CACHE_SIG = b"rtic"
+TAG_INDEX_CACHE_VERSION = 2
+TAG_INDEX_CACHE_EXT = ".tagindex"
+# how much of the start of the map to hash. covers the header of
+# regular maps and the tag table pointers of resource maps.
+MAP_HEADER_HASH_SIZE = 2048
+
+# sig, version, is_resource, engine len, map name len
+_cache_header = PyStruct("<4sHH2H")
+
+# what identifying a map found, so it needn't be parsed to find it again
+CachedMapIdentity = namedtuple("CachedMapIdentity", (
+    "engine", "map_name", "is_resource"))
+
+
+def get_map_cache_key(map_path):
+    '''
+    Returns a sha1 digest identifying the contents of the map at map_path
+    by its size, modification time and a hash of its header.
+    '''
+    map_path = Path(map_path)
+    stat = map_path.stat()
+    with map_path.open("rb") as f:
+        header = f.read(MAP_HEADER_HASH_SIZE)
+
+    key = hashlib.sha1(b"%d:%d:" % (stat.st_size, stat.st_mtime_ns))
+    key.update(header)
+    return key.digest()
+
+
+def get_map_path_key(map_path):
+    '''
+    Returns a hex string identifying where the map at map_path is.
+    '''
+    map_path = os.path.normcase(os.path.abspath(str(map_path)))
+    return hashlib.sha1(map_path.encode("utf-8", "replace")).hexdigest()
+
+
+class TagIndexCache:
+    '''
+    Stores what identifying each resource map found in a small file, so
+    reloading an unchanged map doesn't need to parse it to identify it.
+    Other data about a map can be cached beside it under a different file
+    extension.
+
+    Cache files are named after where their map is, so each map has at
+    most one file of each kind. Each file starts with the cache key of
+    the map it was made from, and is ignored once the map has changed.
+    Caching the changed map replaces it.
+    '''
+    cache_dir = Path("")
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+
+    def get_cache_path(self, map_path, ext=TAG_INDEX_CACHE_EXT):
+        return self.cache_dir.joinpath(get_map_path_key(map_path) + ext)
+
+    def get_cache_data(self, map_path, ext):
+        '''
+        Returns the contents of the cache file with the given extension
+        for the map at map_path, or None if there isn't one or it was
+        made before the map last changed.
+        '''
+        try:
+            key = get_map_cache_key(map_path)
+            data = self.get_cache_path(map_path, ext).read_bytes()
+        except Exception:
+            return None
+
+        if data[: len(key)] != key:
+            return None
+        return data[len(key):]
+
+    def put_cache_data(self, map_path, ext, data):
+        '''
+        Writes data to the cache file with the given extension for
+        the map at map_path, replacing any cached for it before.
+        '''
+        # write to a temp file and swap it in so other processes
+        # caching the same map never see a partially written file
+        data = get_map_cache_key(map_path) + data
+        cache_path = self.get_cache_path(map_path, ext)
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.cache_dir))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, str(cache_path))
+        except Exception:
+            try: os.remove(tmp_path)
+            except Exception: pass
+            raise
+
+    def get(self, map_path):
+        '''
+        Returns the CachedMapIdentity of the map at map_path, or None
+        if it isn't cached or the cache file can't be read.
+        '''
+        try:
+            data = self.get_cache_data(map_path, TAG_INDEX_CACHE_EXT)
+            sig, ver, is_rsrc, engine_len, name_len = \
+                 _cache_header.unpack_from(data)
+            if sig != TAG_INDEX_CACHE_SIG or ver != TAG_INDEX_CACHE_VERSION:
+                return None
+
+            off = _cache_header.size
+            engine = data[off: off + engine_len].decode("latin-1")
+            off += engine_len
+            map_name = data[off: off + name_len].decode("latin-1")
+            if len(map_name) != name_len:
+                return None
+        except Exception:
+            return None
+
+        return CachedMapIdentity(engine, map_name, bool(is_rsrc))
+
+    def put(self, map_path, halo_map):
+        '''
+        Caches the identity of the given map, which was
+        read from map_path. Returns the CachedMapIdentity.
+        '''
+        cached = CachedMapIdentity(
+            halo_map.engine, halo_map.map_name, bool(halo_map.is_resource))
+        engine   = cached.engine.encode("latin-1")
+        map_name = cached.map_name.encode("latin-1")
+        self.put_cache_data(map_path, TAG_INDEX_CACHE_EXT, b"".join((
+            _cache_header.pack(
+                TAG_INDEX_CACHE_SIG, TAG_INDEX_CACHE_VERSION,
+                cached.is_resource, len(engine), len(map_name)),
+            engine, map_name)))
+        return cached
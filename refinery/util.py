@@ -8,6 +8,7 @@
 #
 
 import mmap
+import os
 import re
 import shutil
 import traceback
@@ -18,6 +19,11 @@
      is_reserved_tag, is_protected_tag
 from supyr_struct.util import is_path_empty, int_to_fourcc, fourcc_to_int
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 
 INVALID_WINDOWS_CHAR_SUB = re.compile('[:*?"<>|]')
 
@@ -25,27 +31,9 @@
 def inject_file_padding(file, *off_padsize_pairs, padchar=b'\xCA'):
     file.flush()
     file.seek(0, 2)
-    map_size = file.tell()
-    dcbs = dstoff_cpysize_by_srcoff = dict(off_padsize_pairs)
+    moves, pads, map_size = plan_file_padding(file.tell(), *off_padsize_pairs)
     assert len(padchar) == 1
 
-    off_diff = 0
-    # set up the src offset to dst offset/copysize/padsize mapping
-    for srcoff in sorted(dcbs):
-        section_padsize = dcbs[srcoff]
-        assert section_padsize >= 0
-        off_diff += section_padsize  # bump the dst_off by the length
-        #                              of the padding we are injecting
-        #                     dstoff        cpysize      padsize
-        dcbs[srcoff] = [srcoff + off_diff,     0,    section_padsize]
-
-    last_end = map_size
-    map_size += off_diff
-    # loop over the mapping in reverse to set up the copysize of each section
-    for srcoff in sorted(dcbs)[::-1]:
-        dcbs[srcoff][1] = max(0, last_end - srcoff)
-        last_end = srcoff
-
     close_mmap = False
     try:
         if not isinstance(file, mmap.mmap):
@@ -60,16 +48,80 @@ def inject_file_padding(file, *off_padsize_pairs, padchar=b'\xCA'):
         else:
             file.truncate(map_size)
 
-        intra_file_move(file, dcbs)
-    except Exception:
+        apply_file_padding(file, moves, pads, padchar)
+    finally:
         if close_mmap:
             try: file.close()
             except Exception: pass
-        raise
 
     return map_size
 
 
+def plan_file_padding(file_size, *off_padsize_pairs):
+    '''
+    Plans where everything in a file of the given size ends up when the
+    padding is injected at the offsets given, with padding at the same
+    offset being combined. Returns a list of the (srcoff, dstoff, cpysize)
+    of each section that moves, a list of the (offset, padsize) of each
+    block of padding in the padded file, and the size of the padded file.
+
+    The sections are listed in reverse so moving them in order will never
+    overwrite a section before it's moved, and no byte is moved twice.
+    '''
+    padsizes = {}
+    for off, padsize in off_padsize_pairs:
+        assert padsize >= 0
+        padsizes[off] = padsizes.get(off, 0) + padsize
+
+    offs = sorted(off for off, padsize in padsizes.items() if padsize)
+    moves, pads, off_diff = [], [], 0
+    for i, srcoff in enumerate(offs):
+        pads.append((srcoff + off_diff, padsizes[srcoff]))
+        off_diff += padsizes[srcoff]
+
+        end = offs[i + 1] if i + 1 < len(offs) else file_size
+        moves.append((srcoff, srcoff + off_diff, max(0, end - srcoff)))
+
+    return moves[::-1], pads, file_size + off_diff
+
+
+def apply_file_padding(file, moves, pads, padchar=b'\xCA'):
+    '''
+    Moves the sections and writes the padding planned by plan_file_padding.
+    The file must already be large enough to hold the padded file.
+    '''
+    is_mmap = isinstance(file, mmap.mmap)
+    for srcoff, dstoff, cpysize in moves:
+        if not cpysize:
+            continue
+        elif is_mmap:
+            # mmap.move is much faster than our method below
+            file.move(dstoff, srcoff, cpysize)
+            continue
+
+        # copy in chunks starting at the end of the copy section so
+        # data doesnt get overwritten if  dstoff < srcoff + cpysize
+        copied = 0
+        while copied < cpysize:
+            remainder = cpysize - copied
+            chunksize = min(4*1024**2, remainder)  # copy of 4MB chunks
+
+            file.seek(srcoff + remainder - chunksize)
+            chunk = file.read(chunksize)
+            file.seek(dstoff + remainder - chunksize)
+            file.write(chunk)
+            copied += chunksize
+
+    # make the padding once and write slices of it for every block
+    padding = memoryview(padchar * max([0] + [size for off, size in pads]))
+    for off, padsize in pads:
+        file.seek(off)
+        file.write(padding[: padsize])
+
+    padding.release()
+    file.flush()
+
+
 def intra_file_move(file, dstoff_cpysize_by_srcoff, padchar=b'\xCA'):
     is_mmap = isinstance(file, mmap.mmap)
 
@@ -112,10 +164,90 @@ def intra_file_move(file, dstoff_cpysize_by_srcoff, padchar=b'\xCA'):
     file.flush()
 
 
+# ioctl request to make a file share the extents of another(a reflink)
+FICLONE = 0x40049409
+
+
+def copy_file_data(src_file, dst_file, size, src_off=0, dst_off=0):
+    '''
+    Copies size bytes from src_file at src_off to dst_file at dst_off,
+    letting the os clone or copy the data between the files itself if it
+    can, and falling back to reading and writing in chunks if it can't.
+    Returns the number of bytes copied.
+    '''
+    copied = 0
+    try:
+        src_fd, dst_fd = src_file.fileno(), dst_file.fileno()
+    except Exception:
+        src_fd = dst_fd = None
+
+    # anything buffered needs to be in the files before the os copies it
+    dst_file.flush()
+
+    # try cloning the whole file if that's what's being copied
+    if (src_fd is not None and fcntl is not None and
+            src_off == dst_off == 0 and size == os.fstat(src_fd).st_size and
+            os.fstat(dst_fd).st_size == 0):
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return size
+        except OSError:
+            pass
+
+    # copy_file_range will reflink on filesystems that support it
+    if src_fd is not None and hasattr(os, "copy_file_range"):
+        try:
+            while copied < size:
+                count = os.copy_file_range(
+                    src_fd, dst_fd, size - copied,
+                    src_off + copied, dst_off + copied)
+                if count <= 0:
+                    break
+                copied += count
+        except OSError:
+            pass
+
+    # sendfile writes at the current position of the destination
+    if src_fd is not None and hasattr(os, "sendfile") and copied < size:
+        try:
+            os.lseek(dst_fd, dst_off + copied, os.SEEK_SET)
+            while copied < size:
+                count = os.sendfile(
+                    dst_fd, src_fd, src_off + copied, size - copied)
+                if count <= 0:
+                    break
+                copied += count
+        except OSError:
+            pass
+
+    while copied < size:
+        src_file.seek(src_off + copied)
+        chunk = src_file.read(min(4*1024**2, size - copied))
+        if not chunk:
+            break
+        dst_file.seek(dst_off + copied)
+        dst_file.write(chunk)
+        copied += len(chunk)
+
+    return copied
+
+
 def sanitize_win32_path(name):
     return PureWindowsPath(INVALID_WINDOWS_CHAR_SUB.sub('', name))
 
 
+def sanitize_win32_path_str(name):
+    '''
+    Returns str(sanitize_win32_path(name)), but without making a
+    PureWindowsPath unless the path has separators to normalize.
+    '''
+    name = INVALID_WINDOWS_CHAR_SUB.sub('', name)
+    if (not name or "/" in name or "\\\\" in name or "\\." in name or
+            name[0] in ".\\" or name[-1] == "\\"):
+        return str(PureWindowsPath(name))
+    return name
+
+
 def get_unique_name(collection, name="", ext="", curr_value=object()):
     final_name = name
     i = 1
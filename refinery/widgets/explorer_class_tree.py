@@ -19,6 +19,7 @@
 
 
 class ExplorerClassTree(ExplorerHierarchyTree):
+    trie_key = "class"
 
     def get_tag_tree_key(self, tag_index_ref):
         tag_path_key = ExplorerHierarchyTree.get_tag_tree_key(self, tag_index_ref)
@@ -32,10 +33,25 @@ def get_tag_tree_key(self, tag_index_ref):
 
         return str(PureWindowsPath(tag_cls, tag_path_key))
 
-    def add_tag_index_refs(self, index_refs):
-        if self.active_map is None:
-            return
-
+    def split_tree_key(self, tree_key):
+        # tags are listed directly in their class's folder
+        path_parts = PureWindowsPath(tree_key).parts
+        return path_parts[: 1], str(PureWindowsPath(*path_parts[1:]))
+
+    def get_folder_contents(self, dir_parts):
+        if not dir_parts:
+            return ExplorerHierarchyTree.get_folder_contents(self, dir_parts)
+
+        # the trie is shared with the hybrid tree, so the
+        # tags in a class's folder are in nested folders
+        node = self.get_tag_path_trie().get_node(dir_parts)
+        if node is None:
+            return (), ()
+        return (), list(node.iter_tags())
+
+    def build_tree_rows(self, index_refs):
+        rows = []
+        added_folders = set()
         sorted_index_refs = self.sort_index_refs(index_refs)
 
         # add all the directories before files and have them sorted by name
@@ -46,7 +62,7 @@ def add_tag_index_refs(self, index_refs):
                 tag_classes.add(int_to_fourcc(class_enum.data))
 
         for tag_class in sorted(tag_classes):
-            self.add_folder_path([tag_class])
+            self.add_folder_rows([tag_class], rows, added_folders)
 
         for tag_path, tag_index_ref in sorted_index_refs:
             if is_reserved_tag(tag_index_ref):
@@ -58,7 +74,11 @@ def add_tag_index_refs(self, index_refs):
 
             tag_path = str(PureWindowsPath(
                 *PureWindowsPath(tag_path).parts[1:]))
-            self.add_tag_index_ref([tag_cls], tag_path, tag_index_ref)
+            self.add_tag_row(
+                self.add_folder_rows([tag_cls], rows, added_folders),
+                tag_path, tag_index_ref, rows)
+
+        return rows
 
     def show_actions_dialog(self, item_name, **kwargs):
         path_parts = PureWindowsPath(item_name).parts
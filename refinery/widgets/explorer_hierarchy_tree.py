@@ -13,12 +13,17 @@
 import tkinter as tk
 
 from pathlib import PureWindowsPath
+from threading import Thread
 from traceback import format_exc
 
 from mozzarilla.widgets.directory_frame import HierarchyFrame
 from refinery.constants import MAX_TAG_NAME_LEN, BAD_CLASSES,\
      H1_TAG_SUPERCLASSES
+from refinery.dependency_graph import update_dependency_graph
 from refinery.util import int_to_fourcc, is_reserved_tag
+from refinery.tag_index.tag_path_query_index import \
+     invalidate_tag_path_query_index
+from refinery.tag_index.tag_path_trie import get_tag_path_trie, split_tree_key
 from refinery.windows.actions_window import RefineryActionsWindow
 
 from supyr_struct.defs.frozen_dict import FrozenDict
@@ -35,6 +40,18 @@ def _ensure_backslash_for_folder(folder_path):
 TREE_SORT_METHODS = FrozenDict(
     {0: "name", 4:"pointer", 5:"pointer", 6:"index_id"})
 
+# appended to the iid of a folder that hasn't been filled in yet to make
+# the iid of the empty item that gives the folder an "expand" button.
+# tag iids are numbers and folder iids end with a backslash, so these
+# can't be the same as either
+UNFILLED_FOLDER_PLACEHOLDER = "*"
+
+# how many items to add to a tree in each callback while loading a map,
+# and how many milliseconds to wait between checking if the items to
+# add have been worked out
+TREE_INSERT_BATCH_SIZE = 500
+TREE_LOAD_POLL_INTERVAL = 20
+
 
 class ExplorerHierarchyTree(HierarchyFrame):
     active_map = None
@@ -48,9 +65,33 @@ class ExplorerHierarchyTree(HierarchyFrame):
     sort_by = "name"
     reverse_sorted = False
 
+    # whether to only add the contents of folders once they're opened.
+    # the contents come from a TagPathTrie shared by trees with the same
+    # trie_key, and the iids of the folders not yet filled in are kept
+    lazy = False
+    trie_key = "hierarchy"
+    unfilled_folders = None
+
+    # whether the tree is still adding the items worked out on another
+    # thread. each load is numbered so a reload can stop an older one
+    loading = False
+    _load_number = 0
+
+    # maps each sort method to the rank of each tag item's iid when all
+    # the map's tags are sorted that way. made once per map, and again
+    # after tags are renamed
+    _sort_ranks = None
+
+    # maps the (path, class) of each of the map's tags to its tag index
+    # ref, to check the names tags are renamed to against. made when
+    # tags are first renamed, and kept up to date after that
+    _tag_path_index = None
+
     def __init__(self, *args, **kwargs):
         self.queue_tree = kwargs.pop('queue_tree', self.queue_tree)
         self.tree_id_to_index_ref = {}
+        self.unfilled_folders = set()
+        self._sort_ranks = {}
         kwargs.setdefault('select_mode', 'extended')
         self.sibling_tree_frames = kwargs.pop('sibling_tree_frames', {})
 
@@ -67,11 +108,104 @@ def set_sort_mode(self, event):
             return
         elif new_sort == self.sort_by:
             self.reverse_sorted = not self.reverse_sorted
+            flip_only = True
         else:
             self.reverse_sorted = False
+            flip_only = False
 
         self.sort_by = new_sort
-        self.reload(self.active_map)
+        if self.loading:
+            # the items being added are in the old order
+            self.reload(self.active_map)
+        else:
+            self.sort_tree_items(flip_only)
+
+    def sort_tree_items(self, flip_only=False):
+        '''
+        Moves the tag items in each folder into the current sort order,
+        keeping the folders before them. If flip_only is True, the items
+        are just put in the opposite order to what they're in now.
+        '''
+        ranks = {} if flip_only else self.get_sort_ranks(self.sort_by)
+        folder_iids = [""]
+        while folder_iids:
+            folder_iid = folder_iids.pop()
+            if folder_iid in self.unfilled_folders:
+                # will be filled in the current sort order when opened
+                continue
+
+            folder_iids.extend(
+                self.sort_folder_items(folder_iid, ranks, flip_only))
+
+    def sort_folder_items(self, folder_iid, ranks, flip_only=False):
+        '''
+        Moves the tag items in the given folder into the order of their
+        ranks, or the opposite order if flip_only is True. Returns the
+        iids of the folders in the folder.
+        '''
+        tags_tree = self.tags_tree
+        child_folder_iids, tag_iids = [], []
+        for iid in tags_tree.get_children(folder_iid):
+            if iid.endswith("\\"):
+                child_folder_iids.append(iid)
+            else:
+                tag_iids.append(iid)
+
+        if flip_only:
+            sorted_tag_iids = tag_iids[::-1]
+        else:
+            sorted_tag_iids = sorted(
+                tag_iids, key=lambda iid: ranks.get(iid, -1),
+                reverse=self.reverse_sorted)
+
+        if sorted_tag_iids == tag_iids:
+            return child_folder_iids
+
+        # only move the items past where the orders first differ
+        start = 0
+        while sorted_tag_iids[start] == tag_iids[start]:
+            start += 1
+
+        index = len(child_folder_iids) + start
+        for iid in sorted_tag_iids[start:]:
+            tags_tree.move(iid, folder_iid, index)
+            index += 1
+
+        return child_folder_iids
+
+    def get_sort_ranks(self, sort_by):
+        '''
+        Returns a dict mapping the iid of each of the map's tags to its
+        position when all of them are sorted by the given sort method.
+        '''
+        # get the dict before the map, as reloading sets a new map
+        # and then a new dict while this might be running off thread
+        sort_ranks = self._sort_ranks
+        ranks = sort_ranks.get(sort_by)
+        if ranks is not None or self.active_map is None:
+            return {} if ranks is None else ranks
+
+        keyed_index_refs = []
+        for b in self.active_map.tag_index.tag_index:
+            tag_path_key = self.get_tag_tree_key(b)
+            if tag_path_key is not None:
+                keyed_index_refs.append((tag_path_key, b))
+
+        if sort_by == "index_id":
+            sort_keys = [b.id & 0xFFff for _, b in keyed_index_refs]
+        elif sort_by == "pointer":
+            sort_keys = [b.meta_offset for _, b in keyed_index_refs]
+        else:
+            # default to sorting by name
+            sort_keys = [key for key, _ in keyed_index_refs]
+
+        # sorting is stable, so tags with the same key
+        # stay in the order they are in the tag index
+        order = sorted(range(len(sort_keys)), key=sort_keys.__getitem__)
+        ranks = sort_ranks[sort_by] = {
+            str(self.get_tag_item_id(keyed_index_refs[i][1])): rank
+            for rank, i in enumerate(order)}
+        return ranks
 
     def sort_index_refs(self, index_refs):
         if isinstance(index_refs, dict):
@@ -83,30 +217,15 @@ def sort_index_refs(self, index_refs):
             if tag_path_key is not None:
                 sortable_index_refs.append((tag_path_key, b))
 
-        new_sorting = {}
-        if self.sort_by == "index_id":
-            for index_ref in sortable_index_refs:
-                new_sorting.setdefault(
-                    index_ref[1].id & 0xFFff, []).append(index_ref)
-        elif self.sort_by == "pointer":
-            for index_ref in sortable_index_refs:
-                new_sorting.setdefault(
-                    index_ref[1].meta_offset, []).append(index_ref)
-        else:
-            # default to sorting by name
-            for index_ref in sortable_index_refs:
-                new_sorting.setdefault(
-                    index_ref[0], []).append(index_ref)
-
-        sorted_index_refs = []
-        for key in sorted(new_sorting):
-            for index_ref in new_sorting[key]:
-                sorted_index_refs.append(index_ref)
-
-        if self.reverse_sorted:
-            return list(reversed(sorted_index_refs))
+        return self.sort_keyed_index_refs(sortable_index_refs)
 
-        return sorted_index_refs
+    def sort_keyed_index_refs(self, sortable_index_refs):
+        ranks = self.get_sort_ranks(self.sort_by)
+        get_tag_item_id = self.get_tag_item_id
+        return sorted(
+            sortable_index_refs,
+            key=lambda b: ranks.get(str(get_tag_item_id(b[1])), -1),
+            reverse=self.reverse_sorted)
 
     def setup_columns(self):
         tags_tree = self.tags_tree
@@ -141,11 +260,152 @@ def reload(self, active_map=None):
             tags_tree.delete(child)
             tree_id_to_index_ref.pop(child, None)
 
-        if active_map is not None:
-            # generate the hierarchy
-            # TODO: Do a profile of this to determine where the bottleneck
-            #       is, as it's taking much longer to reload now.
-            self.add_tag_index_refs(active_map.tag_index.tag_index)
+        self.unfilled_folders.clear()
+        self._sort_ranks = {}
+        self._tag_path_index = None
+        self._load_number += 1
+        if self.loading:
+            self.loading = False
+            self.tags_tree.heading("#0", text="name")
+
+        if active_map is None:
+            return
+
+        self.lazy = bool(getattr(self.app_root, "lazy_explorer_trees", self.lazy))
+        if self.lazy:
+            # only add the top level. the rest is added as it's opened
+            self.fill_folder("")
+        else:
+            # generate the hierarchy off the main thread, as sorting
+            # and formatting every tag takes seconds on large maps
+            self.load_tag_index_refs(active_map.tag_index.tag_index)
+
+    def load_tag_index_refs(self, index_refs):
+        '''
+        Adds the given tags to the tree like add_tag_index_refs, but works
+        out the items to add on another thread and adds them in batches
+        between events, so the window stays responsive while loading.
+        '''
+        self._load_number += 1
+        self.loading = True
+        self.tags_tree.heading("#0", text="name (loading)")
+
+        built_rows = []
+        def build_rows():
+            try:
+                built_rows.append(self.build_tree_rows(index_refs))
+            except Exception:
+                print(format_exc())
+                built_rows.append(())
+
+        Thread(target=build_rows, daemon=True).start()
+        self.after(TREE_LOAD_POLL_INTERVAL, self._insert_loaded_rows,
+                   self._load_number, built_rows, 0)
+
+    def _insert_loaded_rows(self, load_number, built_rows, start):
+        if load_number != self._load_number:
+            # the tree was reloaded since this load started
+            return
+        elif not built_rows:
+            self.after(TREE_LOAD_POLL_INTERVAL, self._insert_loaded_rows,
+                       load_number, built_rows, start)
+            return
+
+        rows = built_rows[0]
+        end = min(start + TREE_INSERT_BATCH_SIZE, len(rows))
+        self.insert_tree_rows(rows, start, end)
+        if end < len(rows):
+            self.tags_tree.heading("#0", text="name (loading %d%%)" % (
+                100 * end // len(rows)))
+            self.after(1, self._insert_loaded_rows, load_number,
+                       built_rows, end)
+        else:
+            self.loading = False
+            self.tags_tree.heading("#0", text="name")
+
+    def get_tag_path_trie(self):
+        valid_classes = self.valid_classes
+        if hasattr(valid_classes, "__iter__"):
+            valid_classes = frozenset(valid_classes)
+
+        return get_tag_path_trie(
+            self.active_map, (self.trie_key, valid_classes),
+            self.get_trie_tree_key)
+
+    def get_trie_tree_key(self, tag_index_ref):
+        if is_reserved_tag(tag_index_ref):
+            return None
+        return self.get_tag_tree_key(tag_index_ref)
+
+    def split_tree_key(self, tree_key):
+        '''
+        Returns the names of the folders the tag with the given
+        tree key is in, and the text to display for the tag.
+        '''
+        return split_tree_key(tree_key)
+
+    def get_folder_parts(self, folder_iid):
+        return PureWindowsPath(folder_iid).parts
+
+    def get_folder_contents(self, dir_parts):
+        '''
+        Returns the names of the folders in the given folder, and the
+        (tree key, tag index ref) of the tags in it, from the trie.
+        '''
+        node = self.get_tag_path_trie().get_node(dir_parts)
+        if node is None:
+            return (), ()
+        return sorted(node.dirs), node.tags
+
+    def get_folder_index_refs(self, folder_iid):
+        '''
+        Returns the tag index refs of every tag under the given folder
+        from the trie, including those not added to the tree yet.
+        '''
+        node = self.get_tag_path_trie().get_node(
+            self.get_folder_parts(folder_iid))
+        if node is None:
+            return []
+        return [index_ref for _, index_ref in node.iter_tags()]
+
+    def fill_folder(self, folder_iid):
+        '''
+        Adds the folders and tags in the given folder to the tree.
+        The folders are added empty, to be filled once opened.
+        '''
+        tags_tree = self.tags_tree
+        self.unfilled_folders.discard(folder_iid)
+        placeholder_iid = folder_iid + UNFILLED_FOLDER_PLACEHOLDER
+        if tags_tree.exists(placeholder_iid):
+            tags_tree.delete(placeholder_iid)
+
+        dir_names, keyed_index_refs = self.get_folder_contents(
+            self.get_folder_parts(folder_iid))
+        for dir_name in dir_names:
+            self.add_unfilled_folder(folder_iid, dir_name)
+
+        for tree_key, index_ref in self.sort_keyed_index_refs(keyed_index_refs):
+            self.insert_tag_item(
+                folder_iid, self.split_tree_key(tree_key)[1], index_ref)
+
+    def add_unfilled_folder(self, parent_iid, dir_name, index='end'):
+        folder_iid = _ensure_backslash_for_folder(parent_iid + dir_name)
+        if self.tags_tree.exists(folder_iid):
+            return folder_iid
+
+        # add an empty item to make an "expand" button appear
+        self.tags_tree.insert(
+            parent_iid, index, iid=folder_iid,
+            tags=("item", ), text=dir_name)
+        self.tags_tree.insert(
+            folder_iid, 'end', iid=folder_iid + UNFILLED_FOLDER_PLACEHOLDER)
+        self.unfilled_folders.add(folder_iid)
+        return folder_iid
+
+    def open_selected(self, e=None):
+        folder_iid = self.tags_tree.focus()
+        if folder_iid in self.unfilled_folders:
+            self.fill_folder(folder_iid)
 
     def _compile_list_of_selected(self, parent, selected=None):
         if selected is None:
@@ -153,6 +413,10 @@ def _compile_list_of_selected(self, parent, selected=None):
 
         tags_tree = self.tags_tree
         tree_id_to_index_ref = self.tree_id_to_index_ref
+        if parent in self.unfilled_folders:
+            selected.extend(self.get_folder_index_refs(parent))
+            return selected
+
         for iid in tags_tree.get_children(parent):
             if len(tags_tree.item(iid, 'values')):
                 # tag_index_ref
@@ -167,6 +431,9 @@ def activate_all(self, e=None):
         tags_tree = self.tags_tree
         if self.active_map is None:
             return
+        elif self.loading:
+            print("Wait for the map contents to finish loading.")
+            return
 
         if self.queue_tree is None:
             return
@@ -199,6 +466,9 @@ def activate_item(self, e=None):
         tree_id_to_index_ref = self.tree_id_to_index_ref
         if self.active_map is None or self.queue_tree is None:
             return
+        elif self.loading:
+            print("Wait for the map contents to finish loading.")
+            return
         elif ("halo2" in self.active_map.engine and
               self.active_map.engine != "halo2vista"):
             print("Cannot interact with Halo 2 Xbox maps.")
@@ -229,6 +499,11 @@ def activate_item(self, e=None):
                 item_name, defaults=def_settings, tag_index_ref=tag_index_ref)
 
             if settings['accept_rename'].get():
+                if self.app_root and self.app_root.running:
+                    # extraction was started while the dialog was open
+                    print("Cannot rename tags while extracting.")
+                    continue
+
                 item_name = str(PureWindowsPath(
                     tags_tree.parent(iid),
                     tags_tree.item(iid, 'text')).with_suffix(""))
@@ -288,17 +563,26 @@ def show_actions_dialog(self, item_name, **kwargs):
 
     def rename_tag_index_refs(self, index_refs, old_basename,
                               new_basename, new_cls, rename_other_trees=True):
-        if self.active_map is None: return
+        if self.active_map is None:
+            return
+        elif self.loading:
+            # the items being added are from before the rename
+            self.reload(self.active_map)
+            return
 
         old_basename = old_basename.lower()
         new_basename = new_basename.lower()
 
-        tags_tree = self.tags_tree
+        if not rename_other_trees:
+            # the tags were renamed by a sibling tree
+            self.apply_tag_renames([(b, None) for b in index_refs])
+            return
+
         map_magic = self.active_map.map_magic
-        tree_id_to_index_ref = self.tree_id_to_index_ref
+        tag_path_index = self.get_tag_path_index()
 
-        child_items = []
-        renamed_index_refs = []
+        renames = []
+        reclassed_tag_ids = []
         renaming_multiple = len(index_refs) > 1
         if renaming_multiple:
             new_cls = None
@@ -324,7 +608,7 @@ def rename_tag_index_refs(self, index_refs, old_basename,
             if not old_name.startswith(old_basename):
                 # tag_path doesnt have the base_name in it
                 continue
-            elif not tags_tree.exists(tag_id):
+            elif not self.is_tag_in_tree(tag_id, index_ref):
                 # tag not in the tree
                 continue
             elif not new_name:
@@ -338,66 +622,245 @@ def rename_tag_index_refs(self, index_refs, old_basename,
                 continue
 
             # make sure a tag with that name doesnt already exist
-            already_exists = False
-            for child_id in tags_tree.get_children(tags_tree.parent(tag_id)):
-                try: child_id = int(child_id)
-                except ValueError: continue
-
-                sibling_index_ref = tree_id_to_index_ref.get(child_id)
-                if not sibling_index_ref:
-                    # sibling is being edited. no worry
-                    continue
-                elif sibling_index_ref is index_ref:
-                    # this is the thing we're renaming. no worry
-                    continue
-                elif tag_cls_val != sibling_index_ref.class_1.data:
-                    # classes are different. no worry
-                    continue
-                elif sibling_index_ref.path != new_name:
-                    # names are different. no worry
-                    continue
-                already_exists = True
+            existing_index_ref = tag_path_index.get((new_name, tag_cls_val))
+            if existing_index_ref is not None and (
+                    existing_index_ref is not index_ref):
+                print("'%s' already exists in map. Cannot rename." % new_name)
+                continue
+
+            old_key = (index_ref.path, index_ref.class_1.data)
+            index_ref.path = new_name
+            try:
+                old_cls = index_ref.class_1.enum_name
+            except Exception:
+                old_cls = None
+
+            if new_cls and new_cls != old_cls:
+                index_ref.class_1.set_to(new_cls)
+                cls_2, cls_3 = H1_TAG_SUPERCLASSES.get(new_cls, ("NONE", "NONE"))
+                index_ref.class_2.set_to(cls_2)
+                index_ref.class_3.set_to(cls_3)
+                reclassed_tag_ids.append(tag_id)
+
+            # update the index now so the tags renamed
+            # after this one can't be given the same name
+            renames.append((index_ref, old_key))
+            self.update_tag_path_index(renames[-1:])
+
+        if not renames:
+            return
+
+        invalidate_tag_path_query_index(self.active_map)
+        # the tag references in re-classed tags need to be found again
+        update_dependency_graph(self.active_map, reclassed_tag_ids)
+
+        # every tree is given the same renames, rather
+        # than each working out which tags were renamed
+        self.apply_tag_renames(renames)
+        for tree in self.sibling_tree_frames.values():
+            if tree is not self and hasattr(tree, 'apply_tag_renames'):
+                tree.apply_tag_renames(renames)
+
+    def apply_tag_renames(self, renames):
+        '''
+        Moves and relabels the items of renamed tags in place, rather than
+        removing and adding them again. renames is a list of the tag index
+        ref of each renamed tag and the (path, class) it had before, or
+        None if that isn't known.
+        '''
+        if self.active_map is None or not renames:
+            return
+        elif self.loading:
+            # the items being added are from before the rename
+            self.reload(self.active_map)
+            return
+
+        self.update_tag_path_index(renames)
+        for index_ref, old_key in renames:
+            if old_key is None or old_key[1] != index_ref.class_1.data:
+                # re-classed tags may have been added to or removed
+                # from the tree, so none of the ranks can be reused
+                self._sort_ranks = {}
                 break
+        else:
+            # renaming doesn't change the order of pointers or ids
+            self._sort_ranks = {k: v for k, v in self._sort_ranks.items()
+                                if k in ("pointer", "index_id")}
 
-            if already_exists:
-                print("'%s' already exists in map. Cannot rename." % new_name)
+        tags_tree = self.tags_tree
+        tree_id_to_index_ref = self.tree_id_to_index_ref
+        old_parent_iids = set()
+        # the index of the end of each folder tags are moved to
+        end_indices = {}
+        for index_ref, _ in renames:
+            tag_id = self.get_tag_item_id(index_ref)
+            old_parent_iid = None
+            if tags_tree.exists(tag_id):
+                old_parent_iid = tags_tree.parent(tag_id)
+                old_parent_iids.add(old_parent_iid)
+
+            tree_key = self.get_trie_tree_key(index_ref)
+            parent_iid = None
+            if tree_key is not None:
+                dir_parts, tag_path = self.split_tree_key(tree_key)
+                parent_iid = self.add_renamed_folder_path(dir_parts)
+
+            if parent_iid is None:
+                # the tag isn't in this tree anymore, or it's in a
+                # folder that will get it from the trie when opened
+                if old_parent_iid is not None:
+                    tags_tree.delete(tag_id)
+                    tree_id_to_index_ref.pop(tag_id, None)
+                continue
+            elif old_parent_iid is None:
+                self.insert_tag_item(parent_iid, tag_path, index_ref)
                 continue
 
-            if rename_other_trees:
-                index_ref.path = new_name
-                try:
-                    old_cls = index_ref.class_1.enum_name
-                except Exception:
-                    old_cls = None
-
-                if new_cls and new_cls != old_cls:
-                    index_ref.class_1.set_to(new_cls)
-                    cls_2, cls_3 = H1_TAG_SUPERCLASSES.get(new_cls, ("NONE", "NONE"))
-                    index_ref.class_2.set_to(cls_2)
-                    index_ref.class_3.set_to(cls_3)
-
-            # add this child to the list to be removed
-            child_items.append(tag_id)
-            tree_id_to_index_ref.pop(tag_id, None)
-            renamed_index_refs.append(index_ref)
-
-        # remove the highest parent with only 1 child from the tree.
-        for child in child_items:
-            while len(tags_tree.get_children(tags_tree.parent(child))) <= 1:
-                # only one or less children. can be deleted
-                child = tags_tree.parent(child)
-            tags_tree.delete(child)
+            try:
+                _, values = self.get_tag_item_values(index_ref)
+                tags_tree.item(tag_id, text=tag_path, values=values)
+                if parent_iid != old_parent_iid:
+                    index = end_indices.get(parent_iid)
+                    if index is None:
+                        index = len(tags_tree.get_children(parent_iid))
+                    tags_tree.move(tag_id, parent_iid, index)
+                    end_indices[parent_iid] = index + 1
+            except Exception:
+                print(format_exc())
+
+        # remove the highest parent of each emptied folder with only 1 child
+        for folder_iid in old_parent_iids:
+            if not folder_iid or not tags_tree.exists(folder_iid):
+                continue
+            elif tags_tree.get_children(folder_iid):
+                continue
 
-        # add the newly named tags back to the tree
-        self.add_tag_index_refs(renamed_index_refs)
+            while folder_iid and len(tags_tree.get_children(
+                    tags_tree.parent(folder_iid))) <= 1:
+                folder_iid = tags_tree.parent(folder_iid)
 
-        if not rename_other_trees:
+            if folder_iid:
+                tags_tree.delete(folder_iid)
+
+        if self.lazy:
+            self.remove_empty_unfilled_folders()
+
+        # put the tags back in order in the folders they were moved to
+        ranks = None
+        if self.sort_by in self._sort_ranks:
+            ranks = self.get_sort_ranks(self.sort_by)
+
+        sorted_folder_iids = set()
+        for index_ref, _ in renames:
+            tag_id = self.get_tag_item_id(index_ref)
+            if not tags_tree.exists(tag_id):
+                continue
+
+            folder_iid = tags_tree.parent(tag_id)
+            if folder_iid in sorted_folder_iids:
+                continue
+
+            sorted_folder_iids.add(folder_iid)
+            folder_ranks = ranks
+            if folder_ranks is None:
+                # the tags in a folder sort by name in the same order as
+                # their text, so there's no need to rank the whole map
+                tag_iids = [iid for iid in tags_tree.get_children(folder_iid)
+                            if not iid.endswith("\\")]
+                tag_iids.sort(key=lambda iid: tags_tree.item(iid, 'text'))
+                folder_ranks = {iid: i for i, iid in enumerate(tag_iids)}
+
+            self.sort_folder_items(folder_iid, folder_ranks)
+
+    def add_renamed_folder_path(self, dir_parts):
+        '''
+        Adds the given folders that aren't in the tree yet, each among
+        its sibling folders in order of name. Returns the iid of the last
+        folder, or None if it's in a folder that hasn't been filled yet.
+        '''
+        tags_tree = self.tags_tree
+        parent_iid = ""
+        for dir_name in dir_parts:
+            if parent_iid in self.unfilled_folders:
+                return None
+            elif not dir_name:
+                break
+
+            folder_iid = _ensure_backslash_for_folder(parent_iid + dir_name)
+            if not tags_tree.exists(folder_iid):
+                # folders come before tags, sorted by name
+                index = 0
+                for iid in tags_tree.get_children(parent_iid):
+                    if (not iid.endswith("\\") or
+                            iid[len(parent_iid): -1] > dir_name):
+                        break
+                    index += 1
+
+                if self.lazy:
+                    self.add_unfilled_folder(parent_iid, dir_name, index)
+                else:
+                    tags_tree.insert(parent_iid, index, iid=folder_iid,
+                                     tags=("item", ), text=dir_name)
+            parent_iid = folder_iid
+
+        if parent_iid in self.unfilled_folders:
+            return None
+        return parent_iid
+
+    def get_tag_path_index(self):
+        if self._tag_path_index is None:
+            self._tag_path_index = {
+                (b.path, b.class_1.data): b
+                for b in self.active_map.tag_index.tag_index}
+        return self._tag_path_index
+
+    def update_tag_path_index(self, renames):
+        '''
+        Moves the renamed tags to their new (path, class) in the
+        tag path index, if it's been made yet.
+        '''
+        tag_path_index = self._tag_path_index
+        if tag_path_index is None:
             return
 
-        for tree in self.sibling_tree_frames.values():
-            if tree is not self and hasattr(tree, 'rename_tag_index_refs'):
-                tree.rename_tag_index_refs(renamed_index_refs, old_basename,
-                                           new_basename, new_cls, False)
+        for index_ref, old_key in renames:
+            if old_key is None:
+                # can't tell where the tag was. make the index again
+                self._tag_path_index = None
+                return
+            elif tag_path_index.get(old_key) is index_ref:
+                del tag_path_index[old_key]
+
+            tag_path_index[
+                (index_ref.path, index_ref.class_1.data)] = index_ref
+
+    def is_tag_in_tree(self, tag_id, tag_index_ref):
+        if self.tags_tree.exists(tag_id):
+            return True
+        # tags in folders that haven't been opened aren't in the tree yet
+        return self.lazy and self.get_trie_tree_key(tag_index_ref) is not None
+
+    def remove_empty_unfilled_folders(self):
+        '''
+        Removes the folders that haven't been opened yet that no longer
+        have any tags in them, along with any parents left empty.
+        '''
+        tags_tree = self.tags_tree
+        trie = self.get_tag_path_trie()
+        for folder_iid in tuple(self.unfilled_folders):
+            if not tags_tree.exists(folder_iid):
+                self.unfilled_folders.discard(folder_iid)
+                continue
+            elif trie.get_node(self.get_folder_parts(folder_iid)) is not None:
+                continue
+
+            self.unfilled_folders.discard(folder_iid)
+            while folder_iid and len(tags_tree.get_children(
+                    tags_tree.parent(folder_iid))) <= 1:
+                folder_iid = tags_tree.parent(folder_iid)
+
+            if folder_iid:
+                tags_tree.delete(folder_iid)
 
     def get_tag_tree_key(self, tag_index_ref):
         if (hasattr(self.valid_classes, "__iter__") and
@@ -414,7 +877,21 @@ def get_tag_tree_key(self, tag_index_ref):
     def add_tag_index_refs(self, index_refs):
         if self.active_map is None:
             return
+        elif self.lazy:
+            self.add_lazy_tag_index_refs(index_refs)
+            return
 
+        self.insert_tree_rows(self.build_tree_rows(index_refs))
+
+    def build_tree_rows(self, index_refs):
+        '''
+        Returns the (parent iid, iid, text, values, tag index ref) of each
+        folder and tag to add to the tree for the given tags, in the order
+        to add them. Folders have no values or tag index ref. This doesn't
+        use the treeview, so it can be called off the main thread.
+        '''
+        rows = []
+        added_folders = set()
         sorted_index_refs = self.sort_index_refs(index_refs)
 
         # add all the directories before files
@@ -426,22 +903,118 @@ def add_tag_index_refs(self, index_refs):
         for dir_path in sorted(indices_by_dirpath):
             b = sorted_index_refs[indices_by_dirpath[dir_path]][1]
             if not is_reserved_tag(b):
-                self.add_folder_path(PureWindowsPath(dir_path).parts)
+                self.add_folder_rows(
+                    PureWindowsPath(dir_path).parts, rows, added_folders)
 
         for tag_path, tag_index_ref in sorted_index_refs:
             if is_reserved_tag(tag_index_ref):
                 continue
 
-            tag_path = PureWindowsPath(tag_path)
-            self.add_tag_index_ref(
-                tag_path.parent.parts, tag_path.name, tag_index_ref)
+            dir_parts, tag_path = self.split_tree_key(tag_path)
+            self.add_tag_row(
+                self.add_folder_rows(dir_parts, rows, added_folders),
+                tag_path, tag_index_ref, rows)
+
+        return rows
+
+    def add_folder_rows(self, dir_parts, rows, added_folders):
+        '''
+        Adds a row for each of the given folders not in added_folders
+        to rows and added_folders. Returns the iid of the last folder.
+        '''
+        parent_iid = ""
+        for dir_name in dir_parts:
+            if not dir_name:
+                break
+
+            folder_iid = _ensure_backslash_for_folder(parent_iid + dir_name)
+            if folder_iid not in added_folders:
+                added_folders.add(folder_iid)
+                rows.append((parent_iid, folder_iid, dir_name, None, None))
+            parent_iid = folder_iid
+
+        return parent_iid
+
+    def add_tag_row(self, parent_iid, tag_path, tag_index_ref, rows):
+        try:
+            tag_id, values = self.get_tag_item_values(tag_index_ref)
+            rows.append((parent_iid, tag_id, tag_path, values, tag_index_ref))
+        except Exception:
+            print(format_exc())
+
+    def insert_tree_rows(self, rows, start=0, end=None):
+        '''
+        Adds the items for the given rows made by build_tree_rows.
+        Folders that are already in the tree are skipped.
+        '''
+        tags_tree = self.tags_tree
+        tree_id_to_index_ref = self.tree_id_to_index_ref
+        for i in range(start, len(rows) if end is None else end):
+            parent_iid, iid, text, values, tag_index_ref = rows[i]
+            try:
+                if values is None:
+                    if not tags_tree.exists(iid):
+                        tags_tree.insert(
+                            parent_iid, 'end', iid=iid,
+                            tags=("item", ), text=text)
+                    continue
+
+                tags_tree.insert(
+                    # NEED TO DO str OR ELSE THE SCENARIO TAG'S ID WILL
+                    # BE INTERPRETED AS NOTHING AND BE CHANGED TO 'I001'
+                    parent_iid, 'end', iid=str(iid),
+                    tags=("item", ), text=text, values=values)
+                tree_id_to_index_ref[iid] = tag_index_ref
+            except Exception:
+                print(format_exc())
+
+    def add_lazy_tag_index_refs(self, index_refs):
+        '''
+        Adds the given tags to the folders they're in that have already
+        been filled. Folders not filled yet will get them from the trie.
+        '''
+        for tree_key, tag_index_ref in self.sort_index_refs(index_refs):
+            if is_reserved_tag(tag_index_ref):
+                continue
+
+            dir_parts, tag_path = self.split_tree_key(tree_key)
+            parent_iid = ""
+            for dir_name in dir_parts:
+                if parent_iid in self.unfilled_folders:
+                    break
+                elif dir_name:
+                    parent_iid = self.add_unfilled_folder(parent_iid, dir_name)
+            else:
+                if parent_iid not in self.unfilled_folders:
+                    self.insert_tag_item(parent_iid, tag_path, tag_index_ref)
 
     def add_tag_index_ref(self, parent_dir_parts, tag_path, tag_index_ref):
-        tag_id = tag_index_ref.id & 0xFFff
+        try:
+            parent_iid = self.add_folder_path(parent_dir_parts)
+        except Exception:
+            print(format_exc())
+            return
+
+        self.insert_tag_item(parent_iid, tag_path, tag_index_ref)
+
+    def insert_tag_item(self, parent_iid, tag_path, tag_index_ref):
+        rows = []
+        self.add_tag_row(parent_iid, tag_path, tag_index_ref, rows)
+        self.insert_tree_rows(rows)
+
+    def get_tag_item_id(self, tag_index_ref):
         if not self.active_map.map_magic:
             # resource cache tag
-            tag_id = tag_index_ref.id
-
+            return tag_index_ref.id
+        return tag_index_ref.id & 0xFFff
+
+    def get_tag_item_values(self, tag_index_ref):
+        '''
+        Returns the iid of the given tag's item, and the column values
+        to display for it. Doesn't use the treeview, so it can be called
+        off the main thread.
+        '''
+        tag_id = self.get_tag_item_id(tag_index_ref)
         pointer_converter = self.active_map.map_pointer_converter
         if hasattr(self.active_map, "bsp_pointer_converters"):
             pointer_converter = self.active_map.bsp_pointer_converters.get(
@@ -462,26 +1035,15 @@ def add_tag_index_ref(self, parent_dir_parts, tag_path, tag_index_ref):
 
         meta_offset = '%08X' % tag_index_ref.meta_offset
 
-        try:
-            cls1 = cls2 = cls3 = ""
-            if tag_index_ref.class_1.enum_name not in BAD_CLASSES:
-                cls1 = int_to_fourcc(tag_index_ref.class_1.data)
-            if tag_index_ref.class_2.enum_name not in BAD_CLASSES:
-                cls2 = int_to_fourcc(tag_index_ref.class_2.data)
-            if tag_index_ref.class_3.enum_name not in BAD_CLASSES:
-                cls3 = int_to_fourcc(tag_index_ref.class_3.data)
+        cls1 = cls2 = cls3 = ""
+        if tag_index_ref.class_1.enum_name not in BAD_CLASSES:
+            cls1 = int_to_fourcc(tag_index_ref.class_1.data)
+        if tag_index_ref.class_2.enum_name not in BAD_CLASSES:
+            cls2 = int_to_fourcc(tag_index_ref.class_2.data)
+        if tag_index_ref.class_3.enum_name not in BAD_CLASSES:
+            cls3 = int_to_fourcc(tag_index_ref.class_3.data)
 
-            parent_iid = self.add_folder_path(parent_dir_parts)
-            self.tags_tree.insert(
-                # NEED TO DO str OR ELSE THE SCENARIO TAG'S ID WILL
-                # BE INTERPRETED AS NOTHING AND BE CHANGED TO 'I001'
-                parent_iid, 'end', iid=str(tag_id),
-                tags=("item", ), text=tag_path,
-                values=(cls1, cls2, cls3,
-                        meta_offset, pointer, '%04X' % tag_id))
-            self.tree_id_to_index_ref[tag_id] = tag_index_ref
-        except Exception:
-            print(format_exc())
+        return tag_id, (cls1, cls2, cls3, meta_offset, pointer, '%04X' % tag_id)
 
     def add_folder_path(self, dir_parts):
         abs_dir_path = str(PureWindowsPath(*dir_parts))
@@ -513,7 +1075,7 @@ def _add_folder_path(self, dir_parts, parent_dir):
 
         return self._add_folder_path(dir_parts, abs_dir_path)
 
-    open_selected = close_selected = no_op
+    close_selected = no_op
 
     set_root_dir = add_root_dir = insert_root_dir = del_root_dir = no_op
 
@@ -18,6 +18,8 @@
 
 
 class ExplorerHybridTree(ExplorerHierarchyTree):
+    # shares its tag path trie with the class tree
+    trie_key = "class"
 
     def get_tag_tree_key(self, tag_index_ref):
         tag_path_key = ExplorerHierarchyTree.get_tag_tree_key(self, tag_index_ref)
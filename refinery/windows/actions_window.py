@@ -163,6 +163,8 @@ def __init__(self, *args, **kwargs):
             command=self.destroy, width=14)
         self.show_meta_button = tk.Button(
             self, text="Display metadata", command=self.show_meta)
+        self.show_refs_button = tk.Button(
+            self, text="Display tags referencing this", command=self.show_refs)
 
         # pack everything
         # frames
@@ -203,6 +205,7 @@ def __init__(self, *args, **kwargs):
         self.cancel_button.pack(side='left')
         if self.tag_index_ref is not None:
             self.show_meta_button.pack(padx=4, pady=4, expand=True, fill='x')
+            self.show_refs_button.pack(padx=4, pady=(0, 4), expand=True, fill='x')
 
         # make the window not show up on the start bar
         self.transient(self.master)
@@ -308,6 +311,9 @@ def show_meta(self):
         index_ref = self.tag_index_ref
         if not index_ref:
             return
+        elif getattr(self.app_root, "running", False):
+            print("Cannot display metadata while extracting.")
+            return
 
         try:
             halo_map = self.settings.get("halo_map")
@@ -344,6 +350,27 @@ def show_meta(self):
             print(format_exc())
             return
 
+    def show_refs(self):
+        index_ref = self.tag_index_ref
+        if not index_ref:
+            return
+        elif getattr(self.app_root, "running", False):
+            print("Cannot display tags referencing this while extracting.")
+            return
+
+        try:
+            halo_map = self.settings.get("halo_map")
+            if halo_map is None:
+                print("Could not get map.")
+                return
+
+            print(self.app_root.generate_refs_to_string(
+                index_ref.id, halo_map.map_name, halo_map.engine))
+            self.destroy()
+        except Exception:
+            print(format_exc())
+            return
+
 
 class RefineryEditActionsWindow(RefineryActionsWindow):
 
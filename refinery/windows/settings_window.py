@@ -88,7 +88,11 @@ def __init__(self, *args, **kwargs):
                      "do_printout", "print_heuristic_name_changes",
                      "use_scenario_names_for_script_names",
                      "skip_seen_tags_during_queue_processing",
-                     "disable_safe_mode", "disable_tag_cleaning",):
+                     "disable_safe_mode", "disable_tag_cleaning",
+                     "patch_tag_paths_in_place", "use_tag_index_cache",
+                     "lazy_load_resources", "use_dependency_graph",
+                     "lazy_explorer_trees", "extract_workers",
+                     "deprotect_workers",):
             object.__setattr__(self, attr, settings.get(attr, tk.IntVar(self)))
 
         for attr in ("bitmap_extract_format", "globals_overwrite_mode",
@@ -149,6 +153,9 @@ def __init__(self, *args, **kwargs):
         self.recursive_cbtn = tk.Checkbutton(
             self.extract_frame, text="Recursive extraction",
             variable=self.recursive)
+        self.use_dependency_graph_cbtn = tk.Checkbutton(
+            self.extract_frame, variable=self.use_dependency_graph,
+            text="Find all dependencies before starting recursive extraction")
         self.do_printout_cbtn = tk.Checkbutton(
             self.extract_frame, text="Print extracted file names",
             variable=self.do_printout)
@@ -171,6 +178,13 @@ def __init__(self, *args, **kwargs):
             variable=self.globals_overwrite_mode, menu_width=50,
             options=globals_overwrite_gui_names)
 
+        self.extract_workers_frame = tk.LabelFrame(
+            self.extract_frame, relief="flat",
+            text="Processes to extract Halo 1 tags with(0 = one per cpu)")
+        self.extract_workers_spinbox = tk.Spinbox(
+            self.extract_workers_frame, width=3, state="readonly",
+            textvariable=self.extract_workers, from_=0, to=64)
+
 
         self.decode_adpcm_cbtn = tk.Checkbutton(
             self.data_extract_frame, variable=self.decode_adpcm,
@@ -226,6 +240,16 @@ def __init__(self, *args, **kwargs):
             self.deprotect_frame, text=("Fix tag index offset when saving\n"
                                         "WARNING: Can corrupt certain maps"),
             variable=self.fix_tag_index_offset, justify='left')
+        self.patch_tag_paths_in_place_cbtn = tk.Checkbutton(
+            self.deprotect_frame, text=("Write changed tag paths over the old ones\n"
+                                        "when saving if there is room for them"),
+            variable=self.patch_tag_paths_in_place, justify='left')
+        self.deprotect_workers_frame = tk.LabelFrame(
+            self.deprotect_frame, relief="flat",
+            text="Processes to deprotect all maps with(0 = one per cpu)")
+        self.deprotect_workers_spinbox = tk.Spinbox(
+            self.deprotect_workers_frame, width=3, state="readonly",
+            textvariable=self.deprotect_workers, from_=0, to=64)
 
 
         self.valid_tag_paths_are_accurate_cbtn = tk.Checkbutton(
@@ -298,6 +322,15 @@ def __init__(self, *args, **kwargs):
             self.other_frame, text=("Load resource maps automatically\n" +
                                     "when loading a non-resource map"),
             variable=self.autoload_resources, justify="left")
+        self.lazy_load_resources_cbtn = tk.Checkbutton(
+            self.other_frame, variable=self.lazy_load_resources,
+            text="Wait until resource maps are needed to load them")
+        self.lazy_explorer_trees_cbtn = tk.Checkbutton(
+            self.other_frame, variable=self.lazy_explorer_trees,
+            text="Wait until folders are opened to list their tags")
+        self.use_tag_index_cache_cbtn = tk.Checkbutton(
+            self.other_frame, variable=self.use_tag_index_cache,
+            text="Cache resource map engines and names to load them faster")
         self.extract_yelo_cheape_cbtn = tk.Checkbutton(
             self.other_frame, variable=self.extract_yelo_cheape,
             text="Extract cheape.map when extracting from yelo maps")
@@ -322,13 +355,16 @@ def __init__(self, *args, **kwargs):
             w.pack(padx=4, pady=2, fill="x")
 
         for w in (self.overwrite_cbtn, self.recursive_cbtn,
+                  self.use_dependency_graph_cbtn,
                   self.do_printout_cbtn, self.force_lower_case_paths_cbtn,
                   self.skip_seen_tags_during_queue_processing_cbtn,
-                  self.globals_overwrite_mode_frame):
+                  self.globals_overwrite_mode_frame,
+                  self.extract_workers_frame):
             w.pack(padx=4, anchor='w')
 
         for w in (self.bitmap_extract_keep_alpha_cbtn,
-                  self.bitmap_extract_format_menu, self.globals_overwrite_mode_menu):
+                  self.bitmap_extract_format_menu, self.globals_overwrite_mode_menu,
+                  self.extract_workers_spinbox):
             w.pack(padx=16, anchor='w')
 
         for w in (self.decode_adpcm_cbtn, self.bitmap_extract_frame,
@@ -347,9 +383,12 @@ def __init__(self, *args, **kwargs):
         for w in (self.fix_tag_classes_cbtn, self.use_heuristics_cbtn,
                   self.fix_tag_index_offset_cbtn, self.rename_cached_tags_cbtn,
                   self.limit_tag_path_lengths_cbtn,
+                  self.patch_tag_paths_in_place_cbtn,
                   self.scrape_tag_paths_from_scripts_cbtn,
+                  self.deprotect_workers_frame,
                   ):
             w.pack(padx=4, anchor='w')
+        self.deprotect_workers_spinbox.pack(padx=16, anchor='w')
 
         for w in (self.print_heuristic_progress_cbtn,
                   self.valid_tag_paths_are_accurate_cbtn,
@@ -358,7 +397,9 @@ def __init__(self, *args, **kwargs):
                   ):
             w.pack(padx=4, anchor='w')
 
-        for w in (self.autoload_resources_cbtn, self.extract_yelo_cheape_cbtn,
+        for w in (self.autoload_resources_cbtn, self.lazy_load_resources_cbtn,
+                  self.use_tag_index_cache_cbtn, self.lazy_explorer_trees_cbtn,
+                  self.extract_yelo_cheape_cbtn,
                   self.show_all_fields_cbtn, self.show_structure_meta_cbtn,
                   self.edit_all_fields_cbtn, self.allow_corrupt_cbtn,
                   ):
@@ -0,0 +1,75 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+'''
+Times TagPathHandler.shorten_paths on synthetic 20000 tag trees.
+
+Run it from the repository root with:
+    python tests/benchmark_shorten_paths.py [max_len] [repeats]
+
+The time printed for each tree shape is the best of the repeats. If
+shortening fails, the time it took to fail is printed with the error.
+'''
+
+import os
+import sys
+
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from refinery.tag_index.tag_path_handler import TagPathHandler
+
+from fakes import FakeTagIndexRef
+
+TAG_COUNT = 20000
+# the number of directories the tags are spread across
+DIR_COUNTS = (4000, 10000, 20000)
+
+
+def make_tag_index(dir_count, tag_count=TAG_COUNT):
+    # similarly named directories full of similarly named tags, so that
+    # shortening runs into as many name collisions as it can
+    tags_per_dir = tag_count // dir_count
+    tag_index = []
+    for i in range(tag_count):
+        dir_index, tag_index_in_dir = divmod(i, tags_per_dir)
+        tag_index.append(FakeTagIndexRef(
+            i, "levels\\shared\\scenery\\object_group_%s\\object_tag_%s" %
+            (dir_index, tag_index_in_dir), "scenery"))
+    return tag_index
+
+
+def time_shorten_paths(dir_count, max_len):
+    path_handler = TagPathHandler(make_tag_index(dir_count))
+    start = perf_counter()
+    try:
+        path_handler.shorten_paths(max_len)
+    except Exception as e:
+        return perf_counter() - start, e
+    return perf_counter() - start, None
+
+
+def main(max_len=20, repeats=3):
+    print("shorten_paths on %s tags, max_len %s, best of %s" %
+          (TAG_COUNT, max_len, repeats))
+    for dir_count in DIR_COUNTS:
+        results = [time_shorten_paths(dir_count, max_len)
+                   for _ in range(repeats)]
+        duration, error = min(results, key=lambda result: result[0])
+        tags_per_dir = TAG_COUNT // dir_count
+        line = "  %5s dirs x %s tag%s: %6.2fs" % (
+            dir_count, tags_per_dir, "" if tags_per_dir == 1 else "s",
+            duration)
+        if error is not None:
+            line += " (failed: %r)" % error
+        print(line)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1: 3]))
@@ -0,0 +1,38 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+'''
+Stand-ins for the parts of a map's tag index the tests and benchmarks
+use, so they don't need a real map to run.
+'''
+
+__all__ = ("FakeEnum", "FakeTagIndexRef", )
+
+
+class FakeEnum:
+    def __init__(self, enum_name, data=0):
+        self.enum_name = enum_name
+        self.data = data
+
+
+class FakeTagIndexRef:
+    indexed = False
+
+    def __init__(self, tag_id, path, tag_class, tag_cls=None):
+        '''
+        tag_class is the full name of the tag's class. If the four
+        character code of the class is given as tag_cls, it's used
+        as the data of the class enum.
+        '''
+        class_data = 0
+        if tag_cls is not None:
+            class_data = int.from_bytes(tag_cls.encode("latin-1"), "big")
+
+        self.id = tag_id
+        self.path = path
+        self.class_1 = FakeEnum(tag_class, class_data)
@@ -0,0 +1,114 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+import tempfile
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+from refinery import dependency_graph
+from refinery.dependency_graph import DependencyGraph, get_dependency_graph
+from refinery.tag_index_cache import TagIndexCache
+
+from fakes import FakeTagIndexRef
+
+
+# the ids of the tags each tag references
+TEST_DEPENDENCIES = (
+    (1, 2),
+    (3, ),
+    (3, 4),
+    (),
+    (5, ),
+    (1, ),
+    )
+
+
+class FakeTagIndex:
+    def __init__(self, tag_index):
+        self.tag_index = tag_index
+
+
+class FakeHalo1Map:
+    is_resource = False
+
+    def __init__(self, filepath, tag_cls="bitm"):
+        self.filepath = filepath
+        self.tag_index = FakeTagIndex([
+            FakeTagIndexRef(i, "tag_%s" % i, "bitmap", tag_cls)
+            for i in range(len(TEST_DEPENDENCIES))])
+
+
+class TestDependencyGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.map_path = Path(self.temp_dir.name, "test.map")
+        self.map_path.write_bytes(b"\x00" * 64)
+        self.cache = TagIndexCache(Path(self.temp_dir.name, "cache"))
+        self.builds = 0
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def build_dependency_graph(self, halo_map, **kw):
+        self.builds += 1
+        return DependencyGraph(TEST_DEPENDENCIES)
+
+    def get_graph(self, halo_map):
+        with mock.patch.object(dependency_graph, "can_build_dependency_graph",
+                               lambda halo_map: True),\
+             mock.patch.object(dependency_graph, "build_dependency_graph",
+                               self.build_dependency_graph):
+            return get_dependency_graph(halo_map, self.cache)
+
+    def test_closure(self):
+        graph = DependencyGraph(TEST_DEPENDENCIES)
+        self.assertEqual(graph.get_closure((0, )), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(graph.get_closure((4, 2)), [2, 4, 3, 5, 1])
+        # tags are only reached through tags that aren't skipped
+        self.assertEqual(graph.get_closure((0, ), skip=(2, )), [0, 1, 3])
+        self.assertEqual(graph.get_closure((0, 99)), [0, 1, 2, 3, 4, 5])
+
+    def test_serialize_round_trip(self):
+        graph = DependencyGraph(TEST_DEPENDENCIES)
+        data = graph.serialize(1234)
+        read_graph = DependencyGraph.deserialize(
+            data, len(TEST_DEPENDENCIES), 1234)
+        self.assertEqual(read_graph.dependencies, graph.dependencies)
+
+        self.assertIsNone(DependencyGraph.deserialize(
+            data, len(TEST_DEPENDENCIES), 4321))
+        self.assertIsNone(DependencyGraph.deserialize(
+            data, len(TEST_DEPENDENCIES) + 1, 1234))
+        self.assertIsNone(DependencyGraph.deserialize(
+            data[: -4], len(TEST_DEPENDENCIES), 1234))
+
+    def test_cached_graph_round_trip(self):
+        graph = self.get_graph(FakeHalo1Map(self.map_path))
+        self.assertEqual(self.builds, 1)
+
+        # a newly loaded copy of the map reads the graph from the cache
+        halo_map = FakeHalo1Map(self.map_path)
+        cached_graph = self.get_graph(halo_map)
+        self.assertEqual(self.builds, 1)
+        self.assertIsNot(cached_graph, graph)
+        self.assertIs(halo_map.dependency_graph, cached_graph)
+        self.assertEqual(cached_graph.dependencies, graph.dependencies)
+
+    def test_cached_graph_rebuilt_for_new_classes(self):
+        self.get_graph(FakeHalo1Map(self.map_path))
+        # the tags were re-classed, so what they reference may differ
+        self.get_graph(FakeHalo1Map(self.map_path, tag_cls="snd!"))
+        self.assertEqual(self.builds, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from refinery.core import RefineryCore
+from refinery.dependency_graph import DependencyGraph
+
+from fakes import FakeEnum, FakeTagIndexRef
+
+
+# tag path, class, full class name, and the ids of the tags it references
+TEST_TAGS = (
+    ("levels\\test\\test", "scnr", "scenario", (1, 2, 6)),
+    ("globals\\globals", "matg", "globals", (3, 4)),
+    ("levels\\test\\bitmaps\\ground", "bitm", "bitmap", ()),
+    ("weapons\\pistol\\pistol", "weap", "weapon", (5, )),
+    ("sound\\sfx\\ui\\click", "snd!", "sound", ()),
+    ("weapons\\pistol\\fp\\fp", "mod2", "gbxmodel", ()),
+    # the meta of this tag can't be read, so what it references is only
+    # known to the graph and shouldn't be extracted by either mode
+    ("levels\\test\\devices\\broken", "mach", "device_machine", (7, )),
+    ("levels\\test\\devices\\broken_lights", "ligh", "light", ()),
+    )
+BROKEN_TAG_ID = 6
+
+
+class FakeTagRef:
+    def __init__(self, tag_index_ref):
+        self.id = tag_index_ref.id
+        self.filepath = tag_index_ref.path
+
+
+class FakeMeta:
+    def __init__(self, tag_id):
+        self.tag_id = tag_id
+
+    def serialize(self, calc_pointers=True):
+        return b"%d" % self.tag_id
+
+
+class FakeTagIndex:
+    def __init__(self, tag_index):
+        self.tag_index = tag_index
+        self.scenario_tag_id = 0
+
+
+class FakeHalo1Map:
+    engine = "halo1ce"
+    map_name = "test"
+    is_resource = False
+
+    def __init__(self):
+        self.tag_index = FakeTagIndex([
+            FakeTagIndexRef(i, path, full_tag_class, tag_cls)
+            for i, (path, tag_cls, full_tag_class, _) in enumerate(TEST_TAGS)])
+        self.tag_headers = {tag_cls: b"header" for _, tag_cls, __, ___ in
+                            TEST_TAGS}
+        self.map_header = type("FakeMapHeader", (), dict(
+            map_type=FakeEnum("mp")))()
+        self.maps = {}
+        self.metas_read = []
+
+    def get_meta(self, tag_id, reextract=False, **kw):
+        self.metas_read.append(tag_id)
+        if tag_id != BROKEN_TAG_ID:
+            return FakeMeta(tag_id)
+
+    def get_dependencies(self, meta, tag_id, tag_cls):
+        tag_index_array = self.tag_index.tag_index
+        return [FakeTagRef(tag_index_array[i]) for i in TEST_TAGS[tag_id][3]]
+
+    def meta_to_tag_data(self, meta, tag_cls, tag_index_ref, **kw):
+        return meta
+
+    def clear_map_cache(self):
+        pass
+
+
+class FakeRefinery(RefineryCore):
+    overwrite_globals = False
+    prompts = 0
+
+    def prompt_globals_overwrite(self, halo_map, tag_id):
+        self.prompts += 1
+        return self.overwrite_globals
+
+
+class TestDependencyGraphExtraction(unittest.TestCase):
+
+    def extract(self, use_graph, overwrite_globals=False, existing=()):
+        halo_map = FakeHalo1Map()
+        halo_map.dependency_graph = DependencyGraph(
+            deps for _, __, ___, deps in TEST_TAGS)
+
+        refinery = self.refinery = FakeRefinery()
+        refinery.overwrite_globals = overwrite_globals
+        refinery.maps_by_engine[halo_map.engine] = {
+            halo_map.map_name: halo_map}
+
+        with tempfile.TemporaryDirectory() as out_dir:
+            for tag_id in existing:
+                path, _, full_tag_class, __ = TEST_TAGS[tag_id]
+                filepath = Path(out_dir, *path.split("\\")).with_suffix(
+                    "." + full_tag_class)
+                filepath.parent.mkdir(parents=True, exist_ok=True)
+                filepath.write_bytes(b"")
+
+            extracted = refinery.extract_tags(
+                (0, ), halo_map.map_name, halo_map.engine, recursive=True,
+                use_dependency_graph=use_graph, out_dir=out_dir,
+                tagslist_path="", do_printout=False, extract_workers=1)
+
+            written = sorted(
+                str(path.relative_to(out_dir)) for path in
+                Path(out_dir).rglob("*")
+                if path.is_file() and path.stat().st_size)
+
+        return extracted, written, halo_map.metas_read
+
+    def assert_modes_match(self, **kw):
+        serial = self.extract(False, **kw)
+        graph = self.extract(True, **kw)
+        self.assertEqual(serial[:2], graph[:2])
+        return serial
+
+    def test_globals_not_overwritten(self):
+        extracted, _, __ = self.assert_modes_match(
+            overwrite_globals=False, existing=(1, ))
+        # the globals and everything only it references are skipped
+        self.assertEqual(extracted, {0, 2})
+
+    def test_globals_overwritten(self):
+        extracted, _, __ = self.assert_modes_match(
+            overwrite_globals=True, existing=(1, ))
+        self.assertTrue({0, 2, 3, 4, 5}.issubset(extracted))
+
+    def test_new_globals(self):
+        extracted, _, __ = self.assert_modes_match()
+        self.assertEqual(extracted, {0, 1, 2, 3, 4, 5})
+
+    def test_existing_tags_not_read_with_graph(self):
+        _, __, serial_metas = self.assert_modes_match(existing=(3, ))
+        _, __, graph_metas = self.extract(True, existing=(3, ))
+        self.assertIn(3, serial_metas)
+        self.assertNotIn(3, graph_metas)
+
+    def test_globals_prompted_once(self):
+        for overwrite_globals in (False, True):
+            for use_graph in (False, True):
+                self.extract(use_graph, overwrite_globals, existing=(1, ))
+                self.assertEqual(self.refinery.prompts, 1)
+
+    def test_failed_tag_dependencies_not_read(self):
+        _, __, graph_metas = self.extract(True)
+        self.assertIn(BROKEN_TAG_ID, graph_metas)
+        self.assertNotIn(TEST_TAGS[BROKEN_TAG_ID][3][0], graph_metas)
+
+
+if __name__ == "__main__":
+    unittest.main()
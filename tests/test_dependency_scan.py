@@ -0,0 +1,132 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+import unittest
+
+from struct import pack_into
+
+from reclaimer.meta.wrappers.halo1_map import Halo1Map
+from supyr_struct.buffer import BytesBuffer
+from supyr_struct.field_types import FieldType
+
+from refinery.dependency_graph import _get_tag_dependency_ids,\
+     get_dependency_layout
+
+from fakes import FakeTagIndexRef
+
+
+# the number of structs each reflexive is given
+REFLEXIVE_COUNT = 2
+
+
+class IdentityPointerConverter:
+    def v_ptr_to_f_ptr(self, ptr):
+        return ptr
+
+
+class FakeTagIndex:
+    scenario_tag_id = 0xFFFF
+
+    def __init__(self, tag_index):
+        self.tag_index = tag_index
+
+
+class FakeMapData:
+    '''
+    Builds map data with a struct laid out by a dependency layout, giving
+    every tag reference in it a different tag id.
+    '''
+    def __init__(self):
+        self.data = bytearray()
+        self.next_tag_id = 1
+
+    def alloc(self, size):
+        off = len(self.data)
+        self.data += bytes(size)
+        return off
+
+    def fill(self, struct_ptr, layout):
+        for entry in layout:
+            if not isinstance(entry, tuple):
+                pack_into("<I", self.data, struct_ptr + entry + 12,
+                          self.next_tag_id)
+                self.next_tag_id += 1
+                continue
+
+            refl_off, struct_size, sub_layout = entry
+            array_ptr = self.alloc(struct_size * REFLEXIVE_COUNT)
+            pack_into("<2I", self.data, struct_ptr + refl_off,
+                      REFLEXIVE_COUNT, array_ptr)
+            for i in range(REFLEXIVE_COUNT):
+                self.fill(array_ptr + i * struct_size, sub_layout)
+
+
+class TestDependencyScan(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.halo_map = Halo1Map({})
+        cls.halo_map.map_pointer_converter = IdentityPointerConverter()
+        cls.halo_map.bsp_pointer_converters = {}
+
+    def scan_and_parse(self, tag_cls, desc, layout):
+        fake_data = FakeMapData()
+        # a null pointer is never parsed, so nothing can start at 0
+        fake_data.alloc(8)
+        meta_offset = fake_data.alloc(desc["SIZE"])
+        fake_data.fill(meta_offset, layout)
+        # the parser can read a little past the end of the last struct
+        map_data = BytesBuffer(bytes(fake_data.data) + bytes(64))
+
+        tag_index_ref = FakeTagIndexRef(0, "test", tag_cls, tag_cls)
+        tag_index_ref.meta_offset = meta_offset
+        halo_map = self.halo_map
+        halo_map.tag_index = FakeTagIndex([tag_index_ref] + [
+            FakeTagIndexRef(i, "dependency_%s" % i, "bitmap", "bitm")
+            for i in range(1, fake_data.next_tag_id)])
+        halo_map.map_data = map_data
+
+        # any dependencies found have to come from the scan
+        halo_map.get_meta = lambda *a, **kw: None
+        try:
+            scanned = _get_tag_dependency_ids(halo_map, 0)
+        finally:
+            del halo_map.get_meta
+
+        # parse the meta the same way the map does, and find them in it
+        parent = [None]
+        with FieldType.force_little:
+            desc["TYPE"].parser(
+                desc, parent=parent, attr_index=0, rawdata=map_data,
+                map_pointer_converter=halo_map.map_pointer_converter,
+                offset=meta_offset, tag_index_manager=None,
+                safe_mode=False, parsing_resource=False)
+
+        parsed = halo_map.get_dependencies(parent[0], 0, tag_cls)
+        return sorted(scanned), sorted(ref.id & 0xFFff for ref in parsed)
+
+    def test_scan_matches_get_dependencies(self):
+        checked = 0
+        for tag_cls in sorted(self.halo_map.defs):
+            desc = self.halo_map.get_meta_descriptor(tag_cls)
+            layout = None if desc is None else get_dependency_layout(desc)
+            if tag_cls == "scnr" or not layout:
+                continue
+
+            with self.subTest(tag_cls=tag_cls):
+                scanned, parsed = self.scan_and_parse(tag_cls, desc, layout)
+                self.assertEqual(scanned, parsed)
+                checked += 1
+
+        # make sure the scan was actually used for most tag classes
+        self.assertGreater(checked, 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
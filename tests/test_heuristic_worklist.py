@@ -0,0 +1,164 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+import unittest
+
+from unittest import mock
+
+from refinery import core
+from refinery.constants import INF
+from refinery.core import RefineryCore
+from refinery.dependency_graph import DependencyGraph
+from refinery.tag_index.tag_path_handler import TagPathHandler
+
+from fakes import FakeTagIndexRef
+
+
+# class and the ids of the tags referenced by each tag
+TEST_TAGS = (
+    ("scenario", ()),
+    ("actor_variant", (2, 3)),
+    ("gbxmodel", (4, )),
+    ("damage_effect", ()),
+    ("bitmap", ()),
+    ("biped", (4, )),
+    ("scenery", (2, )),
+    # visiting another scenery after the first one gives the worklist a
+    # chance to schedule a revisit of the actor_variant in between them
+    ("scenery", ()),
+    )
+MODEL_ID, EFFECT_ID, BITMAP_ID = 2, 3, 4
+
+# the classes the heuristics visited before the final actor_variant
+# and scenery passes, in the order they visited them
+CLASS_PASSES = (
+    "scenario_structure_bsp", "vehicle", "weapon", "equipment",
+    "actor_variant", "biped",
+    "ui_widget_collection", "ui_widget_definition", "hud_globals",
+    "project_yellow", "globals", "scenario", "tag_collection")
+
+
+def fake_heuristic_deprotect(tag_id, halo_map, path_handler, **kw):
+    kw.pop("do_printout", None)
+    halo_map.calls.append((tag_id, kw))
+    tag_class = TEST_TAGS[tag_id][0]
+    if tag_class == "actor_variant":
+        # the name given to the effect depends on the names of the model
+        # and the bitmap it uses, so it changes when either is renamed
+        path_handler.set_path_by_priority(
+            MODEL_ID, "characters\\actor\\actor", 1.0)
+        path_handler.set_path_by_priority(
+            EFFECT_ID, "%s_%s" % (
+                path_handler.get_path(MODEL_ID),
+                path_handler.get_basename(BITMAP_ID)),
+            1.0, override=True)
+    elif tag_class == "biped":
+        path_handler.set_path_by_priority(
+            BITMAP_ID, "characters\\biped\\bitmaps\\biped", 2.0)
+    elif tag_class == "scenery":
+        path_handler.set_path_by_priority(
+            MODEL_ID, "scenery\\scenery\\scenery", 3.0)
+
+
+class FakeTagIndex:
+    def __init__(self):
+        self.tag_index = [
+            FakeTagIndexRef(i, "tags\\tag_%s" % i, tag_class)
+            for i, (tag_class, _) in enumerate(TEST_TAGS)]
+
+
+class FakeHalo1Map:
+    engine = "halo1ce"
+    map_name = "test"
+    is_resource = False
+    matg_meta = None
+
+    def __init__(self):
+        self.tag_index = FakeTagIndex()
+        self.maps = {}
+        # the tag id and keyword arguments of each heuristic_deprotect call
+        self.calls = []
+        self.dependency_graph = DependencyGraph(
+            deps for _, deps in TEST_TAGS)
+
+    def get_meta(self, tag_id, *args, **kwargs):
+        return None
+
+
+def get_tag_paths(path_handler):
+    return [path_handler.get_path(i) for i in range(len(TEST_TAGS))]
+
+
+class TestHeuristicWorklist(unittest.TestCase):
+
+    def get_fixed_pass_paths(self):
+        # visit the tags the way the heuristics did before the worklist:
+        # each class in turn, then every actor_variant, then every scenery.
+        # the final passes didn't pass on the settings given
+        halo_map = FakeHalo1Map()
+        path_handler = TagPathHandler(halo_map.tag_index.tag_index)
+        for tag_class in CLASS_PASSES:
+            depth = 0 if tag_class == "ui_widget_collection" else INF
+            for tag_id in range(len(TEST_TAGS)):
+                if TEST_TAGS[tag_id][0] == tag_class:
+                    fake_heuristic_deprotect(
+                        tag_id, halo_map, path_handler, depth=depth,
+                        shallow_ui_widget_nesting=True,
+                        use_minimum_priorities=False)
+
+        for tag_class, named_depth in (("actor_variant", 1), ("scenery", 0)):
+            for tag_id in range(len(TEST_TAGS)):
+                if TEST_TAGS[tag_id][0] != tag_class:
+                    continue
+                depth = named_depth
+                if (path_handler.get_priority(tag_id) ==
+                        path_handler.def_priority):
+                    depth = INF
+                fake_heuristic_deprotect(tag_id, halo_map, path_handler,
+                                         depth=depth)
+
+        return get_tag_paths(path_handler), halo_map.calls
+
+    def get_worklist_paths(self, use_graph):
+        halo_map = FakeHalo1Map()
+        path_handler = TagPathHandler(halo_map.tag_index.tag_index)
+        refinery = RefineryCore()
+        refinery.maps_by_engine[halo_map.engine] = {
+            halo_map.map_name: halo_map}
+
+        with mock.patch.object(core, "heuristic_deprotect",
+                               fake_heuristic_deprotect):
+            refinery._heuristics_deprotect(
+                path_handler, halo_map.map_name, halo_map.engine,
+                do_printout=False, print_errors=False,
+                shallow_ui_widget_nesting=True, use_minimum_priorities=False,
+                use_dependency_graph=use_graph)
+
+        return get_tag_paths(path_handler), halo_map.calls
+
+    def test_names_match_fixed_passes(self):
+        expected = self.get_fixed_pass_paths()[0]
+        # the effect is named after the bitmap the biped renamed, but not
+        # after the model the scenery renamed after the actor_variant pass
+        self.assertEqual(expected[EFFECT_ID],
+                         "characters\\actor\\actor_biped")
+        self.assertEqual(self.get_worklist_paths(True)[0], expected)
+
+    def test_names_match_fixed_passes_without_graph(self):
+        self.assertEqual(self.get_worklist_paths(False)[0],
+                         self.get_fixed_pass_paths()[0])
+
+    def test_calls_match_fixed_passes(self):
+        expected = self.get_fixed_pass_paths()[1]
+        self.assertEqual(self.get_worklist_paths(True)[1], expected)
+        self.assertEqual(self.get_worklist_paths(False)[1], expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
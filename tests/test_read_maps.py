@@ -0,0 +1,101 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+import tempfile
+import threading
+import unittest
+
+from pathlib import Path
+
+from refinery import core
+from refinery.core import RefineryCore
+
+
+class FakeSharedMap:
+    engine = "halo2"
+    is_resource = False
+
+    # the number of maps being parsed at once, and the most there were
+    parsing = 0
+    most_parsing = 0
+    counter_lock = threading.Lock()
+
+    def __init__(self, maps):
+        self.maps = maps
+        self.unloaded = False
+
+    def load_map(self, map_path, **kw):
+        cls = type(self)
+        with cls.counter_lock:
+            cls.parsing += 1
+            cls.most_parsing = max(cls.most_parsing, cls.parsing)
+
+        # give the other threads a chance to start parsing too
+        threading.Event().wait(0.01)
+        self.map_name = Path(map_path).stem
+        self.filepath = Path(map_path)
+        self.maps[self.map_name] = self
+        if self.map_name == "shared":
+            # the halo 2 wrapper also registers shared maps by their type
+            self.maps["single_player_shared"] = self
+
+        with cls.counter_lock:
+            cls.parsing -= 1
+
+    def unload_map(self):
+        self.unloaded = True
+
+
+class FakeRefinery(RefineryCore):
+    def identify_map(self, map_path, tag_index_cache=None):
+        return "halo2", Path(map_path).stem, FakeSharedMap, None
+
+
+class TestReadMaps(unittest.TestCase):
+
+    def setUp(self):
+        FakeSharedMap.parsing = FakeSharedMap.most_parsing = 0
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.map_paths = []
+        for map_name in ("shared", "a", "b", "c"):
+            map_path = Path(self.temp_dir.name, map_name + ".map")
+            map_path.write_bytes(b"\x00" * 64)
+            self.map_paths.append(map_path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_maps_parsed_one_at_a_time(self):
+        refinery = FakeRefinery()
+        results = list(refinery.read_maps(self.map_paths, load_workers=4))
+        self.assertEqual([r[0] for r in results], self.map_paths)
+        self.assertEqual([r[2] for r in results], [None] * 4)
+        self.assertEqual(FakeSharedMap.most_parsing, 1)
+        for _, halo_map, __ in results:
+            refinery.discard_read_map(halo_map)
+
+    def test_parse_lock_released(self):
+        refinery = FakeRefinery()
+        list(refinery.read_maps(self.map_paths, load_workers=4))
+        self.assertTrue(core._map_parse_lock.acquire(blocking=False))
+        core._map_parse_lock.release()
+
+    def test_aliases_kept_when_added(self):
+        refinery = FakeRefinery()
+        loaded = refinery.load_maps(self.map_paths, load_workers=4,
+                                    autoload_resources=False)
+        maps = refinery.maps_by_engine["halo2"]
+        self.assertIs(maps["shared"], loaded[0])
+        self.assertIs(maps["single_player_shared"], loaded[0])
+        for halo_map in loaded:
+            self.assertIs(halo_map.maps, maps)
+
+
+if __name__ == "__main__":
+    unittest.main()
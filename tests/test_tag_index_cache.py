@@ -0,0 +1,68 @@
+#
+# This file is part of Refinery.
+#
+# For authors and copyright check AUTHORS.TXT
+#
+# Refinery is free software under the GNU General Public License v3.0.
+# See LICENSE for more information.
+#
+
+import os
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from refinery.tag_index_cache import CachedMapIdentity, TagIndexCache
+
+
+class FakeRsrcMap:
+    engine = "halo1ce"
+    map_name = "bitmaps"
+    is_resource = True
+
+
+class TestTagIndexCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.map_path = Path(self.temp_dir.name, "bitmaps.map")
+        self.map_path.write_bytes(b"\x01\x00\x00\x00" + b"\x00" * 60)
+        self.cache = TagIndexCache(Path(self.temp_dir.name, "cache"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def change_map(self, data):
+        stat = self.map_path.stat()
+        self.map_path.write_bytes(data)
+        # make sure the modification time changes too
+        os.utime(str(self.map_path), ns=(stat.st_atime_ns,
+                                         stat.st_mtime_ns + 10**9))
+
+    def test_round_trip(self):
+        self.assertIsNone(self.cache.get(self.map_path))
+        self.cache.put(self.map_path, FakeRsrcMap())
+        self.assertEqual(self.cache.get(self.map_path),
+                         CachedMapIdentity("halo1ce", "bitmaps", True))
+
+    def test_changed_map_not_used(self):
+        self.cache.put(self.map_path, FakeRsrcMap())
+        self.change_map(b"\x02\x00\x00\x00" + b"\x00" * 60)
+        self.assertIsNone(self.cache.get(self.map_path))
+
+    def test_one_file_per_map(self):
+        self.cache.put(self.map_path, FakeRsrcMap())
+        self.cache.put_cache_data(self.map_path, ".deps", b"graph")
+        for i in range(3):
+            self.change_map(b"\x01\x00\x00\x00" + bytes([i]) * 60)
+            self.cache.put(self.map_path, FakeRsrcMap())
+            self.cache.put_cache_data(self.map_path, ".deps", b"graph")
+
+        self.assertEqual(len(list(self.cache.cache_dir.iterdir())), 2)
+        self.assertEqual(
+            self.cache.get_cache_data(self.map_path, ".deps"), b"graph")
+
+
+if __name__ == "__main__":
+    unittest.main()